@@ -0,0 +1,202 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'chordkit'))
+
+import defaults as de
+from chord_utils import ChordSpectrum, MergedSpectrum, Timbre
+from roughness_models import roughness_complex
+from overlap_models import overlap_complex
+from chord_plots import roughness_curve, overlap_curve
+from kernel_tables import kernel_table
+
+# Benchmarks for the hot paths of chordkit: chord construction, spectrum
+# merging, the summation models for every function_type over a range of
+# spectrum sizes, whole curves over the standard transposition domains, and
+# the startup cost of importing the package in a fresh interpreter.
+#
+# Each benchmark is timed with timeit (best of `repeat` runs of an
+# automatically chosen number of calls) and reported in seconds per call.
+# Every run is appended, with the commit and environment, to a history file
+# (one JSON object per line, kept out of version control), and compared with
+# the previous run in that file from the same environment (host, machine,
+# Python and NumPy versions): benchmarks slower by more than `threshold` are
+# reported as regressions (and, with --fail-on-regression, make the script
+# exit with status 1).
+#
+# Usage (from the repository root):
+#   python benchmarks/benchmarks.py [--filter curve] [--quick] [--fail-on-regression]
+
+chordkit_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'chordkit')
+
+default_history = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'history.jsonl')
+
+roughness_function_types = ['SETHARES', 'CBW', 'PARNCUTT', 'HELMHOLTZ']
+overlap_function_types = ['SETHARES_BELL', 'PARNCUTT_BELL', 'CBW', 'COS']
+
+# Chords of increasing size: (notes, partials per note)
+spectrum_sizes = [(1, 12), (3, 12), (4, 24), (6, 32)]
+
+def sized_chord(notes: int, partials: int) -> ChordSpectrum:
+    timbre = Timbre(range(1, partials + 1), [0.88 ** p for p in range(partials)])
+    return ChordSpectrum([0, 4, 7, 10, 14, 17][:notes], 'ST_DIFF', timbre=timbre, fund_hz=de.a3)
+
+##############
+# BENCHMARKS #
+##############
+
+# Benchmarks as (name, function of no arguments), with all setup done here
+def benchmarks() -> list:
+    cases = []
+
+    env = dict(os.environ, PYTHONPATH=chordkit_path)
+    for (name, code) in [('chordkit', 'import chordkit'), ('scoring', 'import chord_scoring, chord_plots')]:
+        cases.append((f'import/{name}',
+            lambda code=code: subprocess.run([sys.executable, '-c', code], env=env, check=True)))
+
+    for (notes, partials) in spectrum_sizes:
+        timbre = Timbre(range(1, partials + 1), [0.88 ** p for p in range(partials)])
+        struct = [0, 4, 7, 10, 14, 17][:notes]
+        cases.append((f'construct/{notes}x{partials}',
+            lambda struct=struct, timbre=timbre: ChordSpectrum(struct, 'ST_DIFF', timbre=timbre, fund_hz=de.a3)))
+
+        chord = sized_chord(notes, partials)
+        other = ChordSpectrum([2, 5, 9, 12, 16, 19][:notes], 'ST_DIFF', timbre=timbre, fund_hz=de.a3)
+        cases.append((f'merge/{notes}x{partials}', lambda chord=chord, other=other: MergedSpectrum(chord, other)))
+
+        for function_type in roughness_function_types:
+            options = {'amp_type': 'MIN', 'cutoff': False, 'original': False}
+            if function_type == 'HELMHOLTZ':
+                options['ref'] = other.hz
+            cases.append((f'roughness_complex/{function_type}/{notes}x{partials}',
+                lambda chord=chord, function_type=function_type, options=options:
+                    roughness_complex(chord, function_type, options=options)))
+
+        for function_type in overlap_function_types:
+            options = {'amp_type': 'MIN', 'cutoff': False}
+            cases.append((f'overlap_complex/{function_type}/{notes}x{partials}',
+                lambda chord=chord, function_type=function_type, options=options:
+                    overlap_complex(chord, function_type, options=options)))
+
+    # The compiled backend, with and without kernel tables, on the largest
+    # spectrum
+    chord = sized_chord(*spectrum_sizes[-1])
+    for (measure, function_type, complex_assess) in [('ROUGHNESS', 'SETHARES', roughness_complex),
+            ('OVERLAP', 'SETHARES_BELL', overlap_complex), ('ROUGHNESS', 'PARNCUTT', roughness_complex),
+            ('OVERLAP', 'PARNCUTT_BELL', overlap_complex)]:
+        table = kernel_table(measure, function_type)
+        for (suffix, options) in [('', {'amp_type': 'MIN'}), ('/table', {'amp_type': 'MIN', 'kernel_table': table})]:
+            cases.append((f'{complex_assess.__name__}/{function_type}/numba{suffix}',
+                lambda chord=chord, function_type=function_type, complex_assess=complex_assess, options=options:
+                    complex_assess(chord, function_type, backend='NUMBA', options=options)))
+
+    curve_options = {'crossterms_only': False, 'amp_type': 'MIN', 'cutoff': False, 'original': False, 'show_partials': False}
+    for (domain_name, domain) in [('one_octave', de.one_octave), ('two_octaves', de.two_octaves)]:
+        for (partials, tone) in [(7, de.SetharesTone(7)), (11, de.HarrisonTone(11))]:
+            for function_type in ['SETHARES', 'PARNCUTT']:
+                cases.append((f'roughness_curve/{function_type}/{domain_name}/{partials}',
+                    lambda tone=tone, domain=domain, function_type=function_type: roughness_curve(
+                        tone, tone, transpose_domain=domain, function_type=function_type, options=curve_options)))
+            for function_type in ['SETHARES_BELL', 'PARNCUTT_BELL']:
+                cases.append((f'overlap_curve/{function_type}/{domain_name}/{partials}',
+                    lambda tone=tone, domain=domain, function_type=function_type: overlap_curve(
+                        tone, tone, transpose_domain=domain, function_type=function_type, options=curve_options)))
+            cases.append((f'roughness_curve/SETHARES/{domain_name}/{partials}/adaptive',
+                lambda tone=tone, domain=domain: roughness_curve(
+                    tone, tone, transpose_domain=domain, sweep_type='ADAPTIVE', options=curve_options)))
+
+    return cases
+
+# Best time per call, in seconds
+def time_call(function, repeat: int = 5, min_time: float = 0.2) -> float:
+    timer = timeit.Timer(function)
+    (number, _) = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+###########
+# HISTORY #
+###########
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+            check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def read_history(path: str) -> list:
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def append_history(path: str, run: dict):
+    with open(path, 'a') as f:
+        f.write(json.dumps(run, sort_keys=True) + '\n')
+
+# Fields of a run that identify its environment; runs are only compared
+# with earlier runs in the same environment
+environment_fields = ['host', 'machine', 'python', 'numpy']
+
+# Latest run in history with the same environment as run, or None
+def previous_run(history: list, run: dict):
+    for earlier in reversed(history):
+        if all(earlier.get(field) == run[field] for field in environment_fields):
+            return earlier
+    return None
+
+# Benchmarks present in both runs whose time grew by more than threshold, as
+# (name, previous seconds, current seconds)
+def regressions(previous: dict, current: dict, threshold: float) -> list:
+    return [(name, previous[name], seconds) for (name, seconds) in current.items()
+        if name in previous and seconds > threshold * previous[name]]
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Run the chordkit benchmarks and record them in a history file.')
+    parser.add_argument('--filter', default='', help='only run benchmarks whose name contains this string')
+    parser.add_argument('--history', default=default_history, help='history file (one JSON run per line)')
+    parser.add_argument('--no-history', action='store_true', help='do not record this run')
+    parser.add_argument('--quick', action='store_true', help='fewer, shorter repeats')
+    parser.add_argument('--threshold', type=float, default=1.25, help='slowdown ratio reported as a regression')
+    parser.add_argument('--fail-on-regression', action='store_true', help='exit with status 1 on any regression')
+    args = parser.parse_args(argv)
+
+    (repeat, min_time) = (2, 0.05) if args.quick else (5, 0.2)
+    results = {}
+    for (name, function) in benchmarks():
+        if args.filter not in name:
+            continue
+        results[name] = time_call(function, repeat, min_time)
+        print(f'{name:<52} {results[name] * 1e3:10.3f} ms', flush=True)
+
+    history = read_history(args.history)
+    run = {
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'results': results
+    }
+    if not args.no_history:
+        append_history(args.history, run)
+
+    previous = previous_run(history, run)
+    slower = regressions(previous['results'], results, args.threshold) if previous is not None else []
+    for (name, before, after) in slower:
+        print(f'REGRESSION {name}: {before * 1e3:.3f} ms -> {after * 1e3:.3f} ms ({after / before:.2f}x)')
+
+    return 1 if slower and args.fail_on_regression else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,31 @@
-from chordkit import chord_plots, chord_utils, defaults, hearing_models, overlap_models, pair_constants, roughness_models
-from chordkit.chord_plots import roughness_curve
-from chordkit.defaults import one_octave
-from chordkit.chord_utils import Timbre, ChordSpectrum as Chord, TransposeDomain
+import importlib
+
+# Submodules and names are loaded on first access (PEP 562), so that
+# `import chordkit` is cheap and e.g. scoring code never loads matplotlib.
+submodules = ['chord_plots', 'chord_utils', 'defaults', 'hearing_models', 'overlap_models', 'pair_constants', 'roughness_models']
+
+# Name -> (submodule, attribute in it)
+lazy_names = {
+    'roughness_curve': ('chord_plots', 'roughness_curve'),
+    'one_octave': ('defaults', 'one_octave'),
+    'Timbre': ('chord_utils', 'Timbre'),
+    'Chord': ('chord_utils', 'ChordSpectrum'),
+    'TransposeDomain': ('chord_utils', 'TransposeDomain'),
+}
+
+__all__ = submodules + list(lazy_names)
+
+def __getattr__(name: str):
+    if name in submodules:
+        value = importlib.import_module(f'{__name__}.{name}')
+    elif name in lazy_names:
+        (submodule, attribute) = lazy_names[name]
+        value = getattr(importlib.import_module(f'{__name__}.{submodule}'), attribute)
+    else:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,209 @@
+from contextlib import contextmanager
+import os
+import threading
+import time
+
+from result_store import ResultStore
+
+# This file contains the build graph used to draw many figures from shared
+# results. Each stored result (a curve, a table of chord scores) is a node,
+# keyed by a hash of its inputs and of the version of the code computing it.
+# A BuildGraph wraps a ResultStore and is passed wherever a store is
+# accepted (e.g. store= of roughness_curve, overlap_curve, score_chords):
+#
+#   - a node whose key is in the store is loaded, so a rebuild only computes
+#     the nodes whose inputs or code changed;
+#   - a missing node is claimed by the first process that needs it (through
+#     a lock file next to the result), and other processes needing it wait
+#     for it and load it, so a node shared by several targets is computed
+#     once per build, even by a pool of workers;
+#   - the nodes read by each target (e.g. each figure) are recorded, in
+#     target().
+#
+# A process that dies while computing a node leaves a stale lock, which is
+# taken over by the next process needing the node. A process that has to
+# wait for a node gives up the claims it holds first (e.g. the batches
+# stream_scores has in flight), so that two processes never wait for each
+# other; a node given up this way may be computed by both.
+
+class BuildGraph:
+    def __init__(self, store: ResultStore, version: str = '', wait: float = 0.05):
+        self.store = store
+        self.version = version
+        self.wait = wait
+        # Nodes this process has claimed and is computing
+        self.held = set()
+        # Nodes read or written by the current target, in order
+        self.used = []
+        self.computed = 0
+        self.loaded = 0
+        self.waited = 0
+        self.lock = threading.Lock()
+
+    # Locks cannot be pickled; a copy gets its own
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    @property
+    def directory(self) -> str:
+        return self.store.directory
+
+    # Key of a node: its name, its inputs and the code version
+    def key(self, name: str, *inputs) -> str:
+        return self.store.key(name, self.version, *inputs)
+
+    def lock_path(self, key: str) -> str:
+        return os.path.join(self.store.directory, key + '.lock')
+
+    # Whether a node has been stored, as an array or as a table
+    def exists(self, key: str) -> bool:
+        return (os.path.exists(self.store.path(key))
+            or os.path.exists(os.path.join(self.store.directory, key, 'columns.json')))
+
+    # Whether the process holding a lock file is still running
+    def lock_alive(self, lock_path: str) -> bool:
+        try:
+            with open(lock_path) as f:
+                pid = int(f.read() or 0)
+        except (FileNotFoundError, ValueError):
+            return True
+        if pid <= 0:
+            # Lock file still being written
+            return True
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    # Claim the computation of a missing node. Returns True if the caller
+    # should compute it, and False once another process has stored it.
+    def claim(self, key: str) -> bool:
+        os.makedirs(self.store.directory, exist_ok=True)
+        lock_path = self.lock_path(key)
+        waited = False
+        while True:
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if self.exists(key):
+                    break
+                if not self.lock_alive(lock_path):
+                    try:
+                        os.remove(lock_path)
+                    except FileNotFoundError:
+                        pass
+                    continue
+                # Waiting while holding claims could deadlock with a process
+                # waiting for one of them
+                self.release_all()
+                waited = True
+                time.sleep(self.wait)
+                continue
+
+            with os.fdopen(fd, 'w') as f:
+                f.write(str(os.getpid()))
+            # The node may have been stored between the lookup and the claim
+            if self.exists(key):
+                os.remove(lock_path)
+                break
+            with self.lock:
+                self.held.add(key)
+            return True
+
+        if waited:
+            with self.lock:
+                self.waited += 1
+        return False
+
+    def release(self, key: str):
+        with self.lock:
+            if key not in self.held:
+                return
+            self.held.discard(key)
+        try:
+            os.remove(self.lock_path(key))
+        except FileNotFoundError:
+            pass
+
+    # Release every claim of this process, e.g. after a target failed
+    # before storing the nodes it claimed
+    def release_all(self):
+        with self.lock:
+            held = list(self.held)
+        for key in held:
+            self.release(key)
+
+    def record(self, key: str, loaded: bool):
+        with self.lock:
+            if key not in self.used:
+                self.used.append(key)
+            if loaded:
+                self.loaded += 1
+            else:
+                self.computed += 1
+
+    # Stored node, or None after claiming it, in which case the caller
+    # computes it and saves it
+    def load(self, key: str):
+        result = self.store.load(key)
+        if result is None and not self.claim(key):
+            result = self.store.load(key)
+        if result is not None:
+            self.record(key, True)
+        return result
+
+    def save(self, key: str, array, inputs=None):
+        self.store.save(key, array, inputs)
+        self.record(key, False)
+        self.release(key)
+
+    def load_frame(self, key: str, start: int = 0):
+        frame = self.store.load_frame(key, start)
+        if frame is None and not self.claim(key):
+            frame = self.store.load_frame(key, start)
+        if frame is not None:
+            self.record(key, True)
+        return frame
+
+    def save_frame(self, key: str, frame):
+        self.store.save_frame(key, frame)
+        self.record(key, False)
+        self.release(key)
+
+    # Stored node for key, computing and storing it first if needed
+    def get_or_compute(self, key: str, compute, inputs=None):
+        result = self.load(key)
+        if result is None:
+            try:
+                result = compute()
+            except BaseException:
+                self.release(key)
+                raise
+            self.save(key, result, inputs)
+        return result
+
+    # Record the nodes used by one target (e.g. a figure) as a list of keys,
+    # filled in when the block exits; claims left by a failed target are
+    # released
+    @contextmanager
+    def target(self):
+        previous = self.used
+        self.used = []
+        used = self.used
+        try:
+            yield used
+        finally:
+            self.release_all()
+            self.used = previous
+
+    def stats(self) -> dict:
+        return {'computed': self.computed, 'loaded': self.loaded, 'waited': self.waited}
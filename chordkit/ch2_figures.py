@@ -1,18 +1,29 @@
 #
 # To use, execute
-# $ python ch2_figures.py [save]
+# $ python ch2_figures.py [save] [FIGURE ...] [--jobs N] [--force]
 #
-# You will need to uncomment out the figures to be generated from `main` at
-# the end of this file.
+# Figures are selected by the name of their function (e.g.
+# `octave_drift_parncutt`), by figure name or by their id in `figure_idx`
+# (e.g. `8b`); with none given, every figure is drawn.
 #
 # Passing the `save` argument from the command line will cause the relevant
-# figure(s) to be saved. If no argument is passed, the figure(s) will be
-# displayed but not saved.
+# figure(s) to be saved, rendered without a display, by N worker processes
+# at once. A figure is only redrawn if it has never been saved, or if its
+# function or the library code has changed since (or with --force), and
+# only the curves and scores whose inputs changed are recomputed. If
+# `save` is not passed, the figure(s) will be displayed but not saved.
 #
 
 import numpy as np
 from matplotlib.ticker import MultipleLocator
 from matplotlib import pyplot as plt
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
+import hashlib
+import inspect
+import json
+import os
 import sys
 
 from chord_utils import MergedSpectrum, ChordSpectrum, TransposeDomain
@@ -23,15 +34,39 @@ from defaults import (SineTone, SetharesTone, HarrisonTone, FlatSawTone,
 from chord_plots import overlap_curve, roughness_curve
 from roughness_models import roughness_complex
 from overlap_models import overlap_complex
+from chord_scoring import score_chords, chord_spectra, default_models
+from result_store import ResultStore
+from build_graph import BuildGraph
 from pair_constants import AUDITORY_CONSTANTS as ac
 from chord_lists import (fratres_8vedrone_nocb8ves, fratres_8vedrone_cb8va,
     fratres_no8ves, fratres_phrase_end_sonorities, fratres_phrase_start_sonorities,
     fratres_tenths_only, fratres_tenths_only_thindrone)
 
+# Hash of the library code (every module next to this one), on which every
+# figure depends
+def library_fingerprint():
+    directory = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha256()
+    for file_name in sorted(os.listdir(directory)):
+        if file_name.endswith('.py') and file_name != os.path.basename(__file__):
+            digest.update(file_name.encode())
+            with open(os.path.join(directory, file_name), 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+# Curves and chord scores are nodes of a build graph, stored in ch2_results/
+# and keyed by their inputs and the library code: redrawing a figure loads
+# them, changing a figure only computes the nodes whose inputs changed, and
+# figures drawn at once by several workers compute the nodes they share
+# once (see build_graph).
+results = BuildGraph(ResultStore('ch2_results'), version=library_fingerprint())
+roughness_curve = partial(roughness_curve, store=results)
+overlap_curve = partial(overlap_curve, store=results)
+score_chords = partial(score_chords, store=results)
 
 figure_idx = {
     'timbre_plots': '1',
-    'helmholtz_pair': '2a',
+    'pair_roughness_helmholtz': '2a',
     'pair_roughness': '3a',
     'complex_roughness': '3b', # add on from here
     'fratres_roughness': '6',
@@ -68,9 +103,14 @@ figure_idx = {
     'fratres_ratio_tenths_no8vedrone': '16x'
 }
 
+# Figures are saved next to the results they are drawn from
+def figure_file(name):
+    return os.path.join(results.directory, f'ch2_fig{figure_idx[name]}_{name}.png')
+
 def save_show(name, action):
     if action.lower() == 'save':
-        title = f'ch2_fig{figure_idx[name]}_{name}.png'
+        title = figure_file(name)
+        os.makedirs(results.directory, exist_ok=True)
         plt.savefig(title, dpi=350)
         print(f'{title} saved')
     
@@ -291,11 +331,11 @@ def fratres_roughness(action):
     
     # Helper function perform the various manipulations for each curve
     def get_curves(lst):
-        fratres = [ChordSpectrum(chord, 'ST_DIFF', timbre=tim, fund_hz=fund) for chord in lst]
-        sethares_roughness = np.array([roughness_complex(chord, 'SETHARES') for chord in fratres])
-        sethares_overlap = np.array([overlap_complex(chord, 'SETHARES_BELL') for chord in fratres])
-        parncutt_roughness = np.array([roughness_complex(chord, 'PARNCUTT') for chord in fratres])
-        parncutt_overlap = np.array([overlap_complex(chord, 'PARNCUTT_BELL') for chord in fratres])
+        scores = score_chords(chord_spectra(lst, 'ST_DIFF', timbre=tim, fund_hz=fund), default_models)
+        sethares_roughness = scores['roughness_sethares'].to_numpy()
+        sethares_overlap = scores['overlap_sethares_bell'].to_numpy()
+        parncutt_roughness = scores['roughness_parncutt'].to_numpy()
+        parncutt_overlap = scores['overlap_parncutt_bell'].to_numpy()
         
         sethares_ratio = sethares_roughness / sethares_overlap
         parncutt_ratio = parncutt_roughness / parncutt_overlap
@@ -652,7 +692,7 @@ def octave_drift_parncutt(action):
 
 # Pair-overlap curve (Sethares-like)
 def pair_overlap_sethares(action):
-    name = 'pair_overlap'
+    name = 'pair_overlap_sethares'
 
     ref_tone = SineTone(a4)
     test_tone = SineTone(a4)
@@ -1429,13 +1469,17 @@ def m18m_i(action):
         # data redacted
     ]
 
-    a_rough = np.array([roughness_complex(MergedSpectrum(ChordSpectrum(chord, 'ST_DIFF', timbre=tim, fund_hz=fund_i)), function_type='SETHARES') for chord in m18m_i_arch_a])
-    a_overlap = np.array([overlap_complex(MergedSpectrum(ChordSpectrum(chord, 'ST_DIFF', timbre=tim, fund_hz=fund_i)), function_type='SETHARES_BELL') for chord in m18m_i_arch_a])
+    models = [('ROUGHNESS', 'SETHARES'), ('OVERLAP', 'SETHARES_BELL')]
+
+    a_scores = score_chords(chord_spectra(m18m_i_arch_a, 'ST_DIFF', timbre=tim, fund_hz=fund_i), models)
+    a_rough = a_scores['roughness_sethares'].to_numpy()
+    a_overlap = a_scores['overlap_sethares_bell'].to_numpy()
     a_ratio = a_rough / a_overlap
     a_ratio /= np.max(a_ratio)
 
-    b_rough = np.array([roughness_complex(MergedSpectrum(ChordSpectrum(chord, 'ST_DIFF', timbre=tim, fund_hz=fund_i)), function_type='SETHARES') for chord in m18m_i_arch_b])
-    b_overlap = np.array([overlap_complex(MergedSpectrum(ChordSpectrum(chord, 'ST_DIFF', timbre=tim, fund_hz=fund_i)), function_type='SETHARES_BELL') for chord in m18m_i_arch_b])
+    b_scores = score_chords(chord_spectra(m18m_i_arch_b, 'ST_DIFF', timbre=tim, fund_hz=fund_i), models)
+    b_rough = b_scores['roughness_sethares'].to_numpy()
+    b_overlap = b_scores['overlap_sethares_bell'].to_numpy()
     b_ratio = b_rough / b_overlap
     b_ratio /= np.max(b_ratio)
 
@@ -1464,10 +1508,12 @@ def m18m_ix(action):
         [],
         # data temporarily redacted
     ]
-    m18m_ix_loop = [m18m_ix_backdrop + chord for chord in m18m_ix_loop_top]
+    m18m_ix_loop = (m18m_ix_backdrop + chord for chord in m18m_ix_loop_top)
 
-    sect_ix_rough = np.array([roughness_complex(MergedSpectrum(ChordSpectrum(chord, 'ST_DIFF', timbre=tim, fund_hz=fund_ix)), function_type='SETHARES') for chord in m18m_ix_loop])
-    sect_ix_overlap = np.array([overlap_complex(MergedSpectrum(ChordSpectrum(chord, 'ST_DIFF', timbre=tim, fund_hz=fund_ix)), function_type='SETHARES_BELL') for chord in m18m_ix_loop])
+    models = [('ROUGHNESS', 'SETHARES'), ('OVERLAP', 'SETHARES_BELL')]
+    sect_ix_scores = score_chords(chord_spectra(m18m_ix_loop, 'ST_DIFF', timbre=tim, fund_hz=fund_ix), models)
+    sect_ix_rough = sect_ix_scores['roughness_sethares'].to_numpy()
+    sect_ix_overlap = sect_ix_scores['overlap_sethares_bell'].to_numpy()
     sect_ix_ratio = sect_ix_rough / sect_ix_overlap
     sect_ix_ratio /= np.max(sect_ix_ratio)
 
@@ -1631,39 +1677,158 @@ def complex_roughness_helmholtz(action):
     save_show(name, action)
 
 
-def __main__(argv):
-    action = ''
-    if len(argv) > 1:
-        action = argv[1].lower()
+################
+# BATCH RUNNER #
+################
+
+# Figure functions by name, with the names (as in figure_idx) of the
+# figures each one saves
+figures = {
+    'pair_roughness_helmholtz': (pair_roughness_helmholtz, ['pair_roughness_helmholtz']),
+    'timbre_plots': (timbre_plots, ['timbre_plots']),
+    'pair_roughness': (pair_roughness, ['pair_roughness']),
+    'complex_roughness': (complex_roughness, ['complex_roughness']),
+    'fratres_roughness': (fratres_roughness, ['fratres_roughness_structural', 'fratres_roughness_tenths']),
+    'cardinality_proximity': (cardinality_proximity, ['cardinality_proximity']),
+    'octave_drift_sethares': (octave_drift_sethares, ['octave_drift_sethares']),
+    'octave_drift_parncutt': (octave_drift_parncutt, ['octave_drift_parncutt']),
+    'pair_overlap_sethares': (pair_overlap_sethares, ['pair_overlap_sethares']),
+    'pair_overlap_parncutt': (pair_overlap_parncutt, ['pair_overlap_parncutt']),
+    'complex_overlap_sethares': (complex_overlap_sethares, ['complex_overlap_sethares']),
+    'complex_overlap_parncutt': (complex_overlap_parncutt, ['complex_overlap_parncutt']),
+    'vary_k_overlap': (vary_k_overlap, ['vary_k_overlap']),
+    'rel_roughness_8ve_h11_sethares': (rel_roughness_8ve_h11_sethares, ['rel_roughness_8ve_h11_sethares']),
+    'rel_roughness_8ve_h11_parncutt': (rel_roughness_8ve_h11_parncutt, ['rel_roughness_8ve_h11_parncutt']),
+    'rel_roughness_8ve_e11_sethares': (rel_roughness_8ve_e11_sethares, ['rel_roughness_8ve_e11_sethares']),
+    'rel_roughness_8ve_e11_parncutt': (rel_roughness_8ve_e11_parncutt, ['rel_roughness_8ve_e11_parncutt']),
+    'different_operations_roughness_overlap': (different_operations_roughness_overlap, ['different_operations_roughness_overlap']),
+    'maj7_chord': (maj7_chord, ['maj7_chord']),
+    'add_to_triad': (add_to_triad, ['add_to_triad']),
+    'm18m_chorale': (m18m_chorale, ['m18m_chorale']),
+    'm18m_i': (m18m_i, ['m18m_i']),
+    'm18m_ix': (m18m_ix, ['m18m_ix']),
+    'high_partials_sensitivity': (high_partials_sensitivity, ['high_partials_sensitivity']),
+    'idealized_overlap': (idealized_overlap, ['idealized_overlap']),
+    'complex_roughness_helmholtz': (complex_roughness_helmholtz, ['complex_roughness_helmholtz']),
+}
 
-    # Uncomment these individually to generate the appropriate plot.
-    
-    # timbre_plots(action)
-    # helmholtz_pair(action)
-    # pair_roughness(action)
-    # complex_roughness(action)
-    # fratres_roughness(action)
-    # cardinality_proximity(action)
-    # octave_drift_sethares(action)
-    octave_drift_parncutt(action)
-    # pair_overlap_sethares(action)
-    # pair_overlap_parncutt(action)
-    # complex_overlap_sethares(action)
-    # complex_overlap_parncutt(action)
-    # vary_k_overlap(action)
-    # rel_roughness_8ve_h11_sethares(action)
-    # rel_roughness_8ve_h11_parncutt(action)
-    # rel_roughness_8ve_e11_sethares(action)
-    # rel_roughness_8ve_e11_parncutt(action)
-    # different_operations_roughness_overlap(action)
-    # maj7_chord(action)
-    # add_to_triad(action)
-    # m18m_chorale(action)
-    # m18m_i(action)
-    # m18m_ix(action)
-    # high_partials_sensitivity(action)
-    # idealized_overlap(action)
-    # complex_roughness_helmholtz(action)
+# Names of the figure functions drawing the selected figures, in registry
+# order. A selector is a function name, a figure name, a figure_idx id, or
+# 'all'.
+def select_figures(selectors):
+    selected = set()
+    for selector in selectors:
+        matches = [name for (name, (_, outputs)) in figures.items()
+            if selector in ['all', name] or selector in outputs
+            or selector in [figure_idx[output] for output in outputs]]
+        if not matches:
+            raise ValueError(f'Invalid figure: {selector}')
+        selected.update(matches)
+    return [name for name in figures if name in selected]
+
+# A figure needs redrawing when this changes
+def figure_fingerprint(name, library):
+    return hashlib.sha256((library + inspect.getsource(figures[name][0])).encode()).hexdigest()
+
+# For each figure as last saved, its fingerprint and the keys of the nodes
+# (curves, score tables) it was drawn from, kept with the stored results
+manifest_path = os.path.join(results.directory, 'figures.json')
+
+def read_manifest():
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+def write_manifest(manifest):
+    os.makedirs(results.directory, exist_ok=True)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+# Draw and save one figure function's figures without a display. Runs in
+# the worker processes. Returns the nodes the figure used and the node
+# counts of this process.
+def render_figure(name):
+    plt.switch_backend('Agg')
+    with results.target() as nodes:
+        figures[name][0]('save')
+    plt.close('all')
+    return (nodes, dict(results.stats(), pid=os.getpid()))
+
+# Save the selected figures, skipping those whose fingerprint matches the
+# manifest and whose files exist, in a pool of `jobs` processes. Every node
+# is computed at most once per build, by whichever worker first needs it.
+def render_figures(selectors, *, jobs=1, force=False):
+    library = library_fingerprint()
+    manifest = read_manifest()
+
+    stale = []
+    for name in select_figures(selectors):
+        fingerprint = figure_fingerprint(name, library)
+        saved = all(os.path.exists(figure_file(output)) for output in figures[name][1])
+        if force or not saved or manifest.get(name, {}).get('fingerprint') != fingerprint:
+            stale.append((name, fingerprint))
+        else:
+            print(f'{name} unchanged, skipped')
+
+    # Node counts per worker process, and the figures using each node
+    worker_stats = {}
+    users = {}
+
+    def finish(name, fingerprint, render):
+        try:
+            (nodes, stats) = render()
+        except Exception as error:
+            print(f'{name} failed: {error!r}')
+            return
+        worker_stats[stats['pid']] = stats
+        for key in nodes:
+            users.setdefault(key, []).append(name)
+        manifest[name] = {'fingerprint': fingerprint, 'nodes': nodes}
+        write_manifest(manifest)
+
+    if jobs > 1 and len(stale) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(render_figure, name): (name, fingerprint) for (name, fingerprint) in stale}
+            for future in as_completed(futures):
+                (name, fingerprint) = futures[future]
+                finish(name, fingerprint, future.result)
+    else:
+        for (name, fingerprint) in stale:
+            finish(name, fingerprint, partial(render_figure, name))
+
+    if users:
+        computed = sum(stats['computed'] for stats in worker_stats.values())
+        shared = sum(len(names) > 1 for names in users.values())
+        print(f'{len(users)} nodes: {computed} computed, {len(users) - computed} loaded, '
+            f'{shared} shared by several figures')
+
+def __main__(argv):
+    parser = argparse.ArgumentParser(description='Draw the figures of chapter 2.')
+    parser.add_argument('action', nargs='?', default='show',
+        help="'save' to save the figures, 'show' (the default) to display them")
+    parser.add_argument('figures', nargs='*',
+        help='figure function names, figure names or figure_idx ids (default: all)')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1,
+        help='worker processes used when saving')
+    parser.add_argument('--force', action='store_true',
+        help='save figures even if they are unchanged')
+    args = parser.parse_args(argv[1:])
+
+    # The action may be left out: `python ch2_figures.py 8b`
+    selectors = args.figures
+    if args.action.lower() not in ['save', 'show']:
+        selectors = [args.action] + selectors
+        args.action = 'show'
+    if not selectors:
+        selectors = ['all']
+
+    if args.action.lower() == 'save':
+        render_figures(selectors, jobs=args.jobs, force=args.force)
+    else:
+        for name in select_figures(selectors):
+            figures[name][0]('show')
 
     plt.close('all')
 
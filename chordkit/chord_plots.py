@@ -2,12 +2,15 @@ from typing import Dict
 
 import numpy as np
 from numpy.typing import ArrayLike
-import matplotlib.pyplot as plt
 import defaults as de
 from roughness_models import roughness_complex
 from overlap_models import overlap_complex
+from chord_sweeps import roughness_sweep, overlap_sweep, threaded_sweep, adaptive_sweep
 from chord_utils import MergedSpectrum, ChordSpectrum, TransposeDomain, Timbre
+from result_store import ResultStore
+from profiling import timed
 
+@timed('overlap_curve')
 def overlap_curve(
     ref_chord: ChordSpectrum,
     test_chord: ChordSpectrum,
@@ -15,6 +18,11 @@ def overlap_curve(
     transpose_domain: TransposeDomain = de.default_transpose_domain,
     function_type: str = de.default_overlap_function_type,
     normalize: bool = False,
+    sweep_type: str = de.default_sweep_type,
+    chunk_size: int = de.default_chunk_size,
+    tolerance: float = de.default_tolerance,
+    threads: int = 1,
+    store: ResultStore = None,
     options: Dict = {
         'crossterms_only': False,
         'amp_type': 'MIN',
@@ -24,46 +32,100 @@ def overlap_curve(
     }
 ) -> ArrayLike:
 
-    overlap_vals = np.zeros(np.shape(transpose_domain.domain))
+    if sweep_type.upper() not in ['BATCH', 'LOOP', 'ADAPTIVE']:
+        raise ValueError(f'Invalid sweep type: {sweep_type.upper()}')
 
-    if options['crossterms_only']:
-        if options['show_partials']:
-            ref_self_overlap = (overlap_complex(ref_chord, function_type, options=options))['overlap']
-        else:
-            ref_self_overlap = (overlap_complex(ref_chord, function_type, options=options))
+    # An adaptive sweep (see chord_sweeps.adaptive_sweep) chooses its own
+    # positions, and returns them with the curve.
+    adaptive = sweep_type.upper() == 'ADAPTIVE'
+    if adaptive and options.get('show_partials', False):
+        raise ValueError('Invalid sweep type with show_partials: ADAPTIVE')
 
-    for (idx, position) in enumerate(transpose_domain.domain):
-        # new_test_timbre['fund_multiple'] = cu.slide_timbre(position, test_timbre, chord_struct_type=chord_struct_type)
-        # test_chord = cu.make_chord(test_chord_struct, chord_struct_type, timbre=new_test_timbre, fund_hz=fund_hz)
-        test_chord.transpose(position, transpose_domain.transpose_type)
-        # union = ref_chord.append(test_chord, ignore_index=True)
+    # With a store, the (unnormalized) curve is loaded if an earlier run
+    # computed it, and saved otherwise. Adaptive curves are stored as
+    # (positions, values) rows.
+    overlap_vals = None
+    if store is not None:
+        store_inputs = ['overlap_curve', ref_chord, test_chord, transpose_domain, function_type, options]
+        if adaptive:
+            store_inputs += ['ADAPTIVE', tolerance]
+        store_key = store.key(*store_inputs)
+        overlap_vals = store.load(store_key)
+    loaded = overlap_vals is not None
+    if loaded and adaptive:
+        (positions, overlap_vals) = overlap_vals
 
-        union = MergedSpectrum(ref_chord, test_chord)
-
-        if options['show_partials']:
-            curr_overlap_val = (overlap_complex(union, function_type, options=options))['overlap']
-        else:
-            curr_overlap_val = (overlap_complex(union, function_type, options=options))
+    # show_partials goes through the step-by-step loop. With threads > 1,
+    # the batched sweep runs in a thread pool (see chord_sweeps.threaded_sweep).
+    if loaded:
+        pass
+    elif adaptive:
+        (positions, overlap_vals) = adaptive_sweep(
+            overlap_sweep,
+            ref_chord,
+            test_chord,
+            transpose_domain,
+            function_type,
+            tolerance=tolerance,
+            threads=threads,
+            chunk_size=chunk_size,
+            options=options
+        )
+    elif sweep_type.upper() == 'BATCH' and not options.get('show_partials', False):
+        overlap_vals = threaded_sweep(
+            overlap_sweep,
+            ref_chord,
+            test_chord,
+            transpose_domain,
+            function_type,
+            threads=threads,
+            chunk_size=chunk_size,
+            options=options
+        )
+    else:
+        overlap_vals = np.zeros(np.shape(transpose_domain.domain))
 
         if options['crossterms_only']:
             if options['show_partials']:
-                test_self_overlap = (overlap_complex(ref_chord, function_type, options=options))['overlap']
+                ref_self_overlap = (overlap_complex(ref_chord, function_type, options=options))['overlap']
+            else:
+                ref_self_overlap = (overlap_complex(ref_chord, function_type, options=options))
+
+        for (idx, position) in enumerate(transpose_domain.domain):
+            # new_test_timbre['fund_multiple'] = cu.slide_timbre(position, test_timbre, chord_struct_type=chord_struct_type)
+            # test_chord = cu.make_chord(test_chord_struct, chord_struct_type, timbre=new_test_timbre, fund_hz=fund_hz)
+            transposed_chord = test_chord.transposed(position, transpose_domain.transpose_type)
+            # union = ref_chord.append(test_chord, ignore_index=True)
+
+            union = MergedSpectrum(ref_chord, transposed_chord)
+
+            if options['show_partials']:
+                curr_overlap_val = (overlap_complex(union, function_type, options=options))['overlap']
             else:
-                test_self_overlap = (overlap_complex(ref_chord, function_type, options=options))
-            curr_overlap_val -= (ref_self_overlap + test_self_overlap)
+                curr_overlap_val = (overlap_complex(union, function_type, options=options))
 
-        overlap_vals[idx] = curr_overlap_val
+            if options['crossterms_only']:
+                if options['show_partials']:
+                    test_self_overlap = (overlap_complex(transposed_chord, function_type, options=options))['overlap']
+                else:
+                    test_self_overlap = (overlap_complex(transposed_chord, function_type, options=options))
+                curr_overlap_val -= (ref_self_overlap + test_self_overlap)
 
+            overlap_vals[idx] = curr_overlap_val
 
-    # test_chord has been mutated by .transpose(); need to reset
-    test_chord.reset_partials()
+    if store is not None and not loaded:
+        store.save(store_key, np.stack([positions, overlap_vals]) if adaptive else overlap_vals, store_inputs)
 
     if normalize:
         plotMax = max(overlap_vals)
-        overlap_vals /= float(plotMax)
+        overlap_vals = overlap_vals / float(plotMax)
+
+    if adaptive:
+        return (positions, overlap_vals)
 
     return overlap_vals
 
+@timed('roughness_curve')
 def roughness_curve(
     ref_chord: ChordSpectrum,
     test_chord: ChordSpectrum,
@@ -78,6 +140,11 @@ def roughness_curve(
     function_type: str = de.default_roughness_function_type,
     normalize: bool = False,
     plot: bool = False,
+    sweep_type: str = de.default_sweep_type,
+    chunk_size: int = de.default_chunk_size,
+    tolerance: float = de.default_tolerance,
+    threads: int = 1,
+    store: ResultStore = None,
     options: Dict = {
         'crossterms_only': False,
         'amp_type': 'MIN',
@@ -98,56 +165,117 @@ def roughness_curve(
     # new_test_timbre = test_timbre.copy()
 
     if (ref_chord == test_chord):
-        copy_tim = Timbre(ref_chord.partials['hz_orig'], ref_chord.partials['amp'])
+        copy_tim = Timbre(ref_chord.hz_orig, ref_chord.amp)
         test_chord = ChordSpectrum([0], 'ST_DIFF', timbre=copy_tim, fund_hz=1)
-        min_hz = np.min(test_chord.partials['hz_orig'])
-        test_chord.partials['fund_multiple'] /= min_hz
-
-    roughness_vals = np.zeros(np.shape(transpose_domain.domain))
+        min_hz = np.min(test_chord.hz_orig)
+        test_chord.fund_multiple = test_chord.fund_multiple / min_hz
+        test_chord.invalidate()
 
-    # if chord_struct_type.upper() == 'HZ_SHIFT':
-        # fund_hz = 0
+    if sweep_type.upper() not in ['BATCH', 'LOOP', 'ADAPTIVE']:
+        raise ValueError(f'Invalid sweep type: {sweep_type.upper()}')
 
-    if options['crossterms_only']:
-        if options['show_partials']:
-            ref_self_diss = (roughness_complex(ref_chord, function_type, options=options))['roughness']
-        else:
-            ref_self_diss = (roughness_complex(ref_chord, function_type, options=options))
+    # An adaptive sweep (see chord_sweeps.adaptive_sweep) chooses its own
+    # positions, and returns them with the curve. It is batched, so it does
+    # not cover Helmholtz's model or show_partials.
+    adaptive = sweep_type.upper() == 'ADAPTIVE'
+    if adaptive and function_type.upper() == 'HELMHOLTZ':
+        raise ValueError(f'Invalid sweep type for {function_type.upper()}: ADAPTIVE')
+    if adaptive and options.get('show_partials', False):
+        raise ValueError('Invalid sweep type with show_partials: ADAPTIVE')
 
-    for (idx, position) in enumerate(transpose_domain.domain):
-        # new_test_timbre['fund_multiple'] = cu.slide_timbre(position, test_timbre, chord_struct_type=chord_struct_type)
-        # test_chord = cu.make_chord(test_chord_struct, chord_struct_type, timbre=new_test_timbre, fund_hz=fund_hz)
-        test_chord.transpose(position, transpose_domain.transpose_type)
-        # union = ref_chord.append(test_chord, ignore_index=True)
+    # With a store, the (unnormalized) curve is loaded if an earlier run
+    # computed it, and saved otherwise. Adaptive curves are stored as
+    # (positions, values) rows.
+    roughness_vals = None
+    if store is not None:
+        store_inputs = ['roughness_curve', ref_chord, test_chord, transpose_domain, function_type, options]
+        if adaptive:
+            store_inputs += ['ADAPTIVE', tolerance]
+        store_key = store.key(*store_inputs)
+        roughness_vals = store.load(store_key)
+    loaded = roughness_vals is not None
+    if loaded and adaptive:
+        (positions, roughness_vals) = roughness_vals
 
-        if function_type.upper() == 'HELMHOLTZ':
-            union = MergedSpectrum(test_chord)
-        else:
-            union = MergedSpectrum(ref_chord, test_chord)
+    # The batched sweep covers the pairwise models. Helmholtz's model and
+    # show_partials go through the step-by-step loop. With threads > 1, the
+    # batched sweep runs in a thread pool (see chord_sweeps.threaded_sweep).
+    if loaded:
+        pass
+    elif adaptive:
+        (positions, roughness_vals) = adaptive_sweep(
+            roughness_sweep,
+            ref_chord,
+            test_chord,
+            transpose_domain,
+            function_type,
+            tolerance=tolerance,
+            threads=threads,
+            chunk_size=chunk_size,
+            options=options
+        )
+    elif (sweep_type.upper() == 'BATCH' and function_type.upper() != 'HELMHOLTZ'
+            and not options.get('show_partials', False)):
+        roughness_vals = threaded_sweep(
+            roughness_sweep,
+            ref_chord,
+            test_chord,
+            transpose_domain,
+            function_type,
+            threads=threads,
+            chunk_size=chunk_size,
+            options=options
+        )
+    else:
+        roughness_vals = np.zeros(np.shape(transpose_domain.domain))
 
-        if options['show_partials']:
-            curr_roughness_val = (roughness_complex(union, function_type, options=options))['roughness']
-        else:
-            curr_roughness_val = (roughness_complex(union, function_type, options=options))
+        # if chord_struct_type.upper() == 'HZ_SHIFT':
+            # fund_hz = 0
 
         if options['crossterms_only']:
             if options['show_partials']:
-                test_self_diss = (roughness_complex(ref_chord, function_type, options=options))['roughness']
+                ref_self_diss = (roughness_complex(ref_chord, function_type, options=options))['roughness']
             else:
-                test_self_diss = (roughness_complex(ref_chord, function_type, options=options))
-            curr_roughness_val -= (ref_self_diss + test_self_diss)
+                ref_self_diss = (roughness_complex(ref_chord, function_type, options=options))
 
-        roughness_vals[idx] = curr_roughness_val
+        for (idx, position) in enumerate(transpose_domain.domain):
+            # new_test_timbre['fund_multiple'] = cu.slide_timbre(position, test_timbre, chord_struct_type=chord_struct_type)
+            # test_chord = cu.make_chord(test_chord_struct, chord_struct_type, timbre=new_test_timbre, fund_hz=fund_hz)
+            transposed_chord = test_chord.transposed(position, transpose_domain.transpose_type)
+            # union = ref_chord.append(test_chord, ignore_index=True)
 
-    # test_chord has been mutated by .transpose(); need to reset
-    test_chord.reset_partials()
+            if function_type.upper() == 'HELMHOLTZ':
+                union = MergedSpectrum(transposed_chord)
+            else:
+                union = MergedSpectrum(ref_chord, transposed_chord)
+
+            if options['show_partials']:
+                curr_roughness_val = (roughness_complex(union, function_type, options=options))['roughness']
+            else:
+                curr_roughness_val = (roughness_complex(union, function_type, options=options))
+
+            if options['crossterms_only']:
+                if options['show_partials']:
+                    test_self_diss = (roughness_complex(transposed_chord, function_type, options=options))['roughness']
+                else:
+                    test_self_diss = (roughness_complex(transposed_chord, function_type, options=options))
+                curr_roughness_val -= (ref_self_diss + test_self_diss)
+
+            roughness_vals[idx] = curr_roughness_val
+
+    if store is not None and not loaded:
+        store.save(store_key, np.stack([positions, roughness_vals]) if adaptive else roughness_vals, store_inputs)
 
     if normalize:
         plotMax = max(roughness_vals)
-        roughness_vals /= float(plotMax)
+        roughness_vals = roughness_vals / float(plotMax)
 
     if plot:
-        plt.plot(transpose_domain.domain, roughness_vals)
+        import matplotlib.pyplot as plt
+        plt.plot(positions if adaptive else transpose_domain.domain, roughness_vals)
         plt.show()
 
+    if adaptive:
+        return (positions, roughness_vals)
+
     return roughness_vals
@@ -0,0 +1,251 @@
+from __future__ import annotations
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import numpy as np
+from chord_utils import CompactSpectrum, ChordSpectrum, Timbre
+from result_store import ResultStore
+from spectrum_cache import SpectrumCache
+from pair_utils import PairGeometry, window_hz, window_pairs
+from roughness_models import sethares_roughness_geometry, cbw_roughness_geometry, parncutt_roughness_geometry
+from overlap_models import cbw_overlap_geometry, cos_overlap_geometry, sethares_bell_overlap_geometry, parncutt_bell_overlap_geometry
+from profiling import timed, count
+
+# This file contains the batch scoring of many chords at once, e.g. all the
+# sonorities of a piece or a corpus. Each chord is reduced to its hz and amp
+# arrays, the chords are split into batches, and the batches are scored
+# across a pool of worker processes. Results come back in input order. Within
+# a chord, all models are evaluated in one pass over its partial pairs.
+#
+# For corpora too large to hold in memory, the pipeline also streams: chord
+# structures are read lazily (e.g. from a file), spectra are built only as
+# they are needed, and stream_scores yields one table per batch, so memory
+# use is bounded by the batch size rather than the corpus length.
+#
+# pandas is only imported to build the score tables, so the worker
+# processes, which only run score_batch, never load it.
+
+# Models are given as (measure, function_type) pairs, where measure is
+# 'ROUGHNESS' or 'OVERLAP' and function_type is as in roughness_complex or
+# overlap_complex.
+default_models = [
+    ('ROUGHNESS', 'SETHARES'),
+    ('OVERLAP', 'SETHARES_BELL'),
+    ('ROUGHNESS', 'PARNCUTT'),
+    ('OVERLAP', 'PARNCUTT_BELL'),
+]
+
+# Column name for a model in the result table, e.g. 'roughness_sethares'
+def model_name(model: tuple) -> str:
+    measure, function_type = model
+    return f'{measure.lower()}_{function_type.lower()}'
+
+# Compact, picklable form of a spectrum: just what the models read
+def spectrum_arrays(spectrum: CompactSpectrum) -> tuple:
+    return (np.asarray(spectrum.hz, dtype=float), np.asarray(spectrum.amp, dtype=float))
+
+# Pairwise models available to score_spectrum, as functions of a shared
+# PairGeometry. Helmholtz's model compares a spectrum to a separate reference
+# and so is only available through roughness_complex.
+geometry_models = {
+    ('ROUGHNESS', 'SETHARES'): sethares_roughness_geometry,
+    ('ROUGHNESS', 'CBW'): cbw_roughness_geometry,
+    ('ROUGHNESS', 'PARNCUTT'): parncutt_roughness_geometry,
+    ('OVERLAP', 'SETHARES_BELL'): sethares_bell_overlap_geometry,
+    ('OVERLAP', 'PARNCUTT_BELL'): parncutt_bell_overlap_geometry,
+    ('OVERLAP', 'CBW'): cbw_overlap_geometry,
+    ('OVERLAP', 'COS'): cos_overlap_geometry,
+}
+
+# Score one spectrum with several models in a single pass. The pairs of the
+# spectrum are selected once (all pairs, or those within
+# options['cbw_window'] as in roughness_complex), and their geometry is
+# computed once and shared by every model. Returns a dict keyed by
+# model_name, with the same values as roughness_complex and overlap_complex.
+@timed('score_spectrum')
+def score_spectrum(
+    spectrum: CompactSpectrum,
+    models: list = default_models,
+    options={
+        'amp_type': 'MIN',
+        'cutoff': False,
+        'original': False,
+        'cbw_window': None
+    }
+) -> dict:
+    assessors = []
+    for (measure, function_type) in models:
+        if measure.upper() not in ['ROUGHNESS', 'OVERLAP']:
+            raise ValueError(f'Invalid measure: {measure.upper()}')
+        if (measure.upper(), function_type.upper()) not in geometry_models:
+            raise ValueError(f'Invalid assessment function type: {function_type.upper()}')
+        assessors.append(geometry_models[(measure.upper(), function_type.upper())])
+
+    hz = np.asarray(spectrum.hz, dtype=float)
+    amp = np.asarray(spectrum.amp, dtype=float)
+
+    if options.get('cbw_window', None) is None:
+        i, j = np.triu_indices(len(hz), 1)
+    else:
+        order = np.argsort(hz, kind='stable')
+        i, j, _ = window_pairs(hz[order], window_hz(hz[order], options['cbw_window']))
+        i, j = order[i], order[j]
+        count('pairs_pruned', len(hz) * (len(hz) - 1) // 2 - len(i))
+    count('pairs_evaluated', len(i) * len(models))
+
+    geometry = PairGeometry(hz[i], hz[j], amp[i], amp[j])
+
+    scores = {}
+    for (model, assess) in zip(models, assessors):
+        score = np.sum(assess(geometry, options))
+        # Parncutt's roughness is normalized by the total squared amplitude,
+        # as in roughness_complex
+        if (model[0].upper(), model[1].upper()) == ('ROUGHNESS', 'PARNCUTT'):
+            score = score / np.sum(amp ** 2)
+        scores[model_name(model)] = score
+
+    return scores
+
+# Score one batch of spectra (as (hz, amp) pairs) with every model. Returns a
+# (spectra x models) array. Runs in the worker processes.
+def score_batch(batch: list, models: list, options: dict) -> np.ndarray:
+    scores = np.zeros((len(batch), len(models)))
+
+    for (idx, (hz, amp)) in enumerate(batch):
+        spectrum = CompactSpectrum(hz=hz, amp=amp)
+        spectrum_scores = score_spectrum(spectrum, models, options)
+        scores[idx] = [spectrum_scores[model_name(model)] for model in models]
+
+    return scores
+
+#############
+# STREAMING #
+#############
+
+# Chord structures from a text file, one chord per line, as numbers
+# separated by whitespace or commas (e.g. "0, 4, 7"). Blank lines and
+# comments starting with '#' are skipped. Lines are read one at a time.
+def read_chord_structs(path: str):
+    with open(path) as f:
+        for line in f:
+            line = line.split('#')[0].replace(',', ' ').strip()
+            if line:
+                yield [float(x) for x in line.split()]
+
+# Spectra for a stream of chord structures, built only as they are consumed.
+# With a SpectrumCache, repeated chords are built once and shared (frozen).
+def chord_spectra(structs, struct_type: str = 'ST_DIFF', *, timbre: Timbre = None, fund_hz: float = 220.0, cache: SpectrumCache = None):
+    for struct in structs:
+        if cache is not None:
+            yield cache.get(struct, struct_type, timbre=timbre, fund_hz=fund_hz)
+        elif timbre is None:
+            yield ChordSpectrum(struct, struct_type, fund_hz=fund_hz)
+        else:
+            yield ChordSpectrum(struct, struct_type, timbre=timbre, fund_hz=fund_hz)
+
+# Successive lists of up to batch_size items of an iterable
+def batches(items, batch_size: int):
+    items = iter(items)
+    while True:
+        batch = list(islice(items, batch_size))
+        if not batch:
+            return
+        yield batch
+
+# Score table for one batch, indexed by position in the whole stream
+def score_frame(scores: np.ndarray, models: list, start: int) -> pd.DataFrame:
+    import pandas as pd
+    return pd.DataFrame(
+        scores,
+        columns=[model_name(model) for model in models],
+        index=pd.RangeIndex(start, start + len(scores))
+    )
+
+# Score table for one batch, loaded from the store if an earlier run scored
+# the same batch, and None otherwise
+def stored_frame(store: ResultStore, batch: list, models: list, options: dict, start: int):
+    if store is None:
+        return (None, None)
+    key = store.key('scores', batch, models, options)
+    return (key, store.load_frame(key, start))
+
+# Score a stream of chords (any iterable, consumed lazily) in batches of
+# batch_size, yielding one DataFrame per batch, in input order. With
+# workers > 1, batches are scored in a process pool, with at most two
+# batches per worker in flight at a time. With a store, batches scored by an
+# earlier run are loaded (column by column, memory-mapped) instead, and new
+# ones are saved.
+def stream_scores(
+    chords,
+    models: list = default_models,
+    *,
+    workers: int = 1,
+    batch_size: int = 256,
+    store: ResultStore = None,
+    options={
+        'amp_type': 'MIN',
+        'cutoff': False,
+        'original': False,
+        'cbw_window': None
+    }
+):
+    arrays = (spectrum_arrays(chord) for chord in chords)
+    start = 0
+
+    # Table for a batch, from its stored frame or its scores, saving the
+    # latter
+    def batch_frame(key, frame, scores, start):
+        if frame is not None:
+            return frame
+        frame = score_frame(scores, models, start)
+        if store is not None:
+            store.save_frame(key, frame)
+        return frame
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for batch in batches(arrays, batch_size):
+                (key, frame) = stored_frame(store, batch, models, options, start)
+                scores = executor.submit(score_batch, batch, models, options) if frame is None else None
+                pending.append((key, frame, scores, start))
+                start += len(batch)
+                if len(pending) >= 2 * workers:
+                    (key, frame, scores, batch_start) = pending.popleft()
+                    yield batch_frame(key, frame, scores.result() if scores is not None else None, batch_start)
+            while pending:
+                (key, frame, scores, batch_start) = pending.popleft()
+                yield batch_frame(key, frame, scores.result() if scores is not None else None, batch_start)
+    else:
+        for batch in batches(arrays, batch_size):
+            (key, frame) = stored_frame(store, batch, models, options, start)
+            scores = score_batch(batch, models, options) if frame is None else None
+            yield batch_frame(key, frame, scores, start)
+            start += len(batch)
+
+# Score many chords (ChordSpectrum, MergedSpectrum, or any CompactSpectrum)
+# with several models. With workers > 1, batches of `batch_size` chords are
+# scored in a pool of that many processes. Returns a DataFrame with one row
+# per chord, in input order, and one column per model.
+def score_chords(
+    chords,
+    models: list = default_models,
+    *,
+    workers: int = 1,
+    batch_size: int = 256,
+    store: ResultStore = None,
+    options={
+        'amp_type': 'MIN',
+        'cutoff': False,
+        'original': False,
+        'cbw_window': None
+    }
+) -> pd.DataFrame:
+    import pandas as pd
+    frames = list(stream_scores(chords, models, workers=workers, batch_size=batch_size, store=store, options=options))
+    if not frames:
+        return score_frame(np.zeros((0, len(models))), models, 0)
+
+    return pd.concat(frames)
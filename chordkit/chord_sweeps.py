@@ -0,0 +1,568 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+from numpy.typing import ArrayLike
+from chord_utils import ChordSpectrum, TransposeDomain
+from roughness_models import (sethares_roughness_array, cbw_roughness_array, parncutt_roughness_array,
+    ROUGHNESS_INVARIANT_TRANSPOSITIONS)
+from overlap_models import (sethares_bell_overlap_array, parncutt_bell_overlap_array, cbw_overlap_array,
+    cos_overlap_array, OVERLAP_INVARIANT_TRANSPOSITIONS)
+from pair_cache import cached_assess
+from profiling import timed
+
+# This file contains the batched ("whole-domain") evaluation of transposition
+# sweeps. Instead of transposing test_chord one step at a time and rescoring
+# the merged spectrum, the frequencies of test_chord at every position of the
+# domain are laid out as a (steps x partials) table, and each block of pairs
+# of the merged spectrum is assessed with the array models in bulk.
+#
+# The merged spectrum of ref_chord and test_chord splits into three blocks
+# of pairs:
+#   - ref x ref: fixed over the whole sweep; assessed once.
+#   - test x test: assessed once if the model is invariant under the
+#     transposition type (see *_INVARIANT_TRANSPOSITIONS), otherwise at every
+#     step, as a (steps x pairs) tensor.
+#   - ref x test: assessed at every step, as a (steps x ref x test) tensor.
+# When only crossterms are requested and the self terms cancel, only the
+# ref x test block is assessed at all. Steps are processed `chunk_size` at a
+# time to bound the size of the tensors in memory. Blocks go through
+# options['cache'] (a pair_cache.PairCache) when one is given.
+
+#################
+# BLOCK SUMMING #
+#################
+
+# Sums of pairwise contributions within ref_chord, within test_chord, and
+# across the two, at each position of the transposition domain. `ref_self`
+# is a scalar; `test_self` and `cross` are arrays with one value per step.
+# With self_terms=False, only the cross block is assessed (the self terms
+# are left at zero). With test_invariant=True, the test x test block is
+# assessed at the first position only and reused for every step.
+@timed('pair_sweep')
+def pair_sweep(
+    array_assess,
+    ref_chord: ChordSpectrum,
+    test_chord: ChordSpectrum,
+    transpose_domain: TransposeDomain,
+    *,
+    chunk_size: int = 512,
+    self_terms: bool = True,
+    test_invariant: bool = False,
+    options={}
+) -> dict:
+    ref_hz = np.asarray(ref_chord.hz, dtype=float)
+    ref_amp = np.asarray(ref_chord.amp, dtype=float)
+    test_amp = np.asarray(test_chord.amp, dtype=float)
+    test_hz = test_chord.transposed_hz(transpose_domain.domain, transpose_domain.transpose_type)
+
+    steps = np.shape(test_hz)[0]
+    ref_i, ref_j = np.triu_indices(len(ref_hz), 1)
+    test_i, test_j = np.triu_indices(len(test_amp), 1)
+
+    ref_self = 0.0
+    test_self = np.zeros(steps)
+    cross = np.zeros(steps)
+
+    if self_terms:
+        ref_self = cached_assess(array_assess, ref_hz[ref_i], ref_hz[ref_j], ref_amp[ref_i], ref_amp[ref_j], options, 'ALL')
+        if test_invariant and steps > 0:
+            test_self[:] = cached_assess(
+                array_assess, test_hz[0, test_i], test_hz[0, test_j], test_amp[test_i], test_amp[test_j], options, 'ALL'
+            )
+
+    for start in range(0, steps, chunk_size):
+        chunk = slice(start, start + chunk_size)
+        chunk_hz = test_hz[chunk]
+
+        if self_terms and not test_invariant:
+            test_self[chunk] = cached_assess(
+                array_assess, chunk_hz[:, test_i], chunk_hz[:, test_j], test_amp[test_i], test_amp[test_j], options, 1
+            )
+        cross[chunk] = cached_assess(
+            array_assess,
+            ref_hz[np.newaxis, :, np.newaxis],
+            chunk_hz[:, np.newaxis, :],
+            ref_amp[np.newaxis, :, np.newaxis],
+            test_amp[np.newaxis, np.newaxis, :],
+            options,
+            (1, 2)
+        )
+
+    return {
+        'ref_self': ref_self,
+        'test_self': test_self,
+        'cross': cross
+    }
+
+################
+# SWEEP MODELS #
+################
+
+# Batched equivalent of the step-by-step loop in chord_plots.roughness_curve,
+# for the pairwise models (i.e., all but HELMHOLTZ).
+@timed('roughness_sweep')
+def roughness_sweep(
+    ref_chord: ChordSpectrum,
+    test_chord: ChordSpectrum,
+    transpose_domain: TransposeDomain,
+    function_type: str = 'SETHARES',
+    *,
+    chunk_size: int = 512,
+    options={
+        'crossterms_only': False,
+        'amp_type': 'MIN',
+        'cutoff': False,
+        'original': False
+    }
+) -> ArrayLike:
+    ref_denom = 1
+    test_denom = 1
+    union_denom = 1
+
+    if function_type.upper() == 'SETHARES':
+        array_assess = sethares_roughness_array
+    elif function_type.upper() == 'CBW':
+        array_assess = cbw_roughness_array
+    elif function_type.upper() == 'PARNCUTT':
+        array_assess = parncutt_roughness_array
+        # As in roughness_complex, a single denominator over the whole
+        # (merged) spectrum. It does not depend on the transposition.
+        ref_denom = np.sum(np.asarray(ref_chord.amp, dtype=float) ** 2)
+        test_denom = np.sum(np.asarray(test_chord.amp, dtype=float) ** 2)
+        union_denom = ref_denom + test_denom
+    else:
+        raise ValueError(f'Invalid sweep function type: {function_type.upper()}')
+
+    # Kernel tables only pay off in the compiled backend of roughness_complex
+    # and overlap_complex, which the sweeps do not use
+    if options.get('kernel_table', None) is not None:
+        raise ValueError('Invalid sweep option: kernel_table')
+
+    crossterms_only = options.get('crossterms_only', False)
+    test_invariant = (transpose_domain.transpose_type.upper()
+        in ROUGHNESS_INVARIANT_TRANSPOSITIONS[function_type.upper()])
+
+    # Crossterms are the merged roughness minus each chord's own roughness.
+    # The self terms cancel exactly unless the denominators differ.
+    self_terms = not crossterms_only or not (ref_denom == test_denom == union_denom)
+
+    blocks = pair_sweep(
+        array_assess,
+        ref_chord,
+        test_chord,
+        transpose_domain,
+        chunk_size=chunk_size,
+        self_terms=self_terms,
+        test_invariant=test_invariant,
+        options=options
+    )
+
+    if crossterms_only:
+        return (blocks['cross'] / union_denom
+            + blocks['ref_self'] * (1 / union_denom - 1 / ref_denom)
+            + blocks['test_self'] * (1 / union_denom - 1 / test_denom))
+
+    return (blocks['ref_self'] + blocks['test_self'] + blocks['cross']) / union_denom
+
+# Batched equivalent of the step-by-step loop in chord_plots.overlap_curve.
+@timed('overlap_sweep')
+def overlap_sweep(
+    ref_chord: ChordSpectrum,
+    test_chord: ChordSpectrum,
+    transpose_domain: TransposeDomain,
+    function_type: str = 'SETHARES_BELL',
+    *,
+    chunk_size: int = 512,
+    options={
+        'crossterms_only': False,
+        'amp_type': 'MIN',
+        'cutoff': False,
+        'original': False
+    }
+) -> ArrayLike:
+    if function_type.upper() == 'SETHARES_BELL':
+        array_assess = sethares_bell_overlap_array
+    elif function_type.upper() == 'PARNCUTT_BELL':
+        array_assess = parncutt_bell_overlap_array
+    elif function_type.upper() == 'CBW':
+        array_assess = cbw_overlap_array
+    elif function_type.upper() == 'COS':
+        array_assess = cos_overlap_array
+    else:
+        raise ValueError(f'Invalid sweep function type: {function_type.upper()}')
+
+    if options.get('kernel_table', None) is not None:
+        raise ValueError('Invalid sweep option: kernel_table')
+
+    # Crossterms are the merged overlap minus each chord's own overlap, i.e.
+    # exactly the cross block.
+    crossterms_only = options.get('crossterms_only', False)
+    test_invariant = (transpose_domain.transpose_type.upper()
+        in OVERLAP_INVARIANT_TRANSPOSITIONS[function_type.upper()])
+
+    blocks = pair_sweep(
+        array_assess,
+        ref_chord,
+        test_chord,
+        transpose_domain,
+        chunk_size=chunk_size,
+        self_terms=not crossterms_only,
+        test_invariant=test_invariant,
+        options=options
+    )
+
+    return blocks['ref_self'] + blocks['test_self'] + blocks['cross']
+
+###################
+# THREADED SWEEPS #
+###################
+
+# A sweep (roughness_sweep or overlap_sweep) with its domain split into
+# `threads` contiguous parts (default: one per CPU), swept in a thread pool.
+# NumPy releases the GIL inside the large array operations the sweeps
+# consist of, so the parts run concurrently; unlike worker processes, the
+# threads share the chords, options, PairCache and kernel tables without
+# copying them. Sweeps never modify their arguments, so this is safe with
+# any chords, including frozen ones from a SpectrumCache.
+def threaded_sweep(
+    sweep,
+    ref_chord: ChordSpectrum,
+    test_chord: ChordSpectrum,
+    transpose_domain: TransposeDomain,
+    function_type: str,
+    *,
+    threads: int = None,
+    chunk_size: int = 512,
+    options={}
+) -> ArrayLike:
+    if threads is None:
+        threads = os.cpu_count() or 1
+
+    parts = [TransposeDomain.from_positions(positions, transpose_domain.transpose_type)
+        for positions in np.array_split(transpose_domain.domain, max(1, threads)) if len(positions) > 0]
+    if len(parts) <= 1:
+        return sweep(ref_chord, test_chord, transpose_domain, function_type, chunk_size=chunk_size, options=options)
+
+    def sweep_part(part):
+        return sweep(ref_chord, test_chord, part, function_type, chunk_size=chunk_size, options=options)
+
+    with ThreadPoolExecutor(max_workers=len(parts)) as executor:
+        return np.concatenate(list(executor.map(sweep_part, parts)))
+
+###################
+# ADAPTIVE SWEEPS #
+###################
+
+# A sweep sampled more densely where the curve changes quickly. Curves are
+# flat over most of a domain and have sharp minima (at just intervals) in a
+# few places, so a uniform domain fine enough for the minima wastes most of
+# its steps. The adaptive sweep starts from `initial_steps` positions
+# spanning transpose_domain (by default, one in 8 of its steps), and
+# repeatedly bisects every interval whose midpoint value is farther than
+# `tolerance` (relative to the range of the curve) from the straight line
+# between its ends, at most `max_depth` times. Each round of midpoints is
+# swept at once (by threaded_sweep), so a round costs one batched sweep.
+#
+# Straight lines between the returned positions follow the curve to within
+# a small multiple of `tolerance`. With the defaults, this is about as
+# accurate as the uniform one_octave and two_octaves domains, from 35-45% as
+# many positions. Features narrower than the initial spacing may fall
+# between two positions and be missed; raise initial_steps to catch them.
+#
+# Returns (positions, values), sorted by position.
+def adaptive_sweep(
+    sweep,
+    ref_chord: ChordSpectrum,
+    test_chord: ChordSpectrum,
+    transpose_domain: TransposeDomain,
+    function_type: str,
+    *,
+    tolerance: float = 1e-3,
+    initial_steps: int = None,
+    max_depth: int = 12,
+    threads: int = 1,
+    chunk_size: int = 512,
+    options={}
+) -> tuple:
+    def sweep_positions(positions):
+        return threaded_sweep(
+            sweep,
+            ref_chord,
+            test_chord,
+            TransposeDomain.from_positions(positions, transpose_domain.transpose_type),
+            function_type,
+            threads=threads,
+            chunk_size=chunk_size,
+            options=options
+        )
+
+    if initial_steps is None:
+        initial_steps = max(3, (len(transpose_domain.domain) - 1) // 8 + 1)
+
+    positions = [np.linspace(np.min(transpose_domain.domain), np.max(transpose_domain.domain), initial_steps)]
+    values = [sweep_positions(positions[0])]
+
+    # Intervals still to be checked, by their ends
+    (low, high) = (positions[0][:-1], positions[0][1:])
+    (low_vals, high_vals) = (values[0][:-1], values[0][1:])
+    for depth in range(max_depth + 1):
+        if len(low) == 0:
+            break
+        mid = (low + high) / 2
+        mid_vals = sweep_positions(mid)
+        positions.append(mid)
+        values.append(mid_vals)
+        if depth == max_depth:
+            break
+
+        all_values = np.concatenate(values)
+        error = np.abs(mid_vals - (low_vals + high_vals) / 2)
+        split = error > tolerance * (np.max(all_values) - np.min(all_values))
+        (low, high) = (np.concatenate([low[split], mid[split]]), np.concatenate([mid[split], high[split]]))
+        (low_vals, high_vals) = (np.concatenate([low_vals[split], mid_vals[split]]),
+            np.concatenate([mid_vals[split], high_vals[split]]))
+
+    positions = np.concatenate(positions)
+    order = np.argsort(positions, kind='stable')
+    return (positions[order], np.concatenate(values)[order])
+
+############
+# SURFACES #
+############
+
+# Sweeps over several independent transpositions at once, e.g. the triads
+# [0, x, y] for x and y on a fine grid. ref_chord stays fixed and each of
+# test_chords moves along its own TransposeDomain; the result has one axis
+# per domain. The merged spectrum at each grid point splits into blocks:
+#   - ref x ref: assessed once.
+#   - test_k x test_k and ref x test_k: one value per step of domain k,
+#     assessed once per domain (by pair_sweep), not once per grid point.
+#   - test_k x test_l: a (steps_k x steps_l) grid for each pair of test
+#     chords, assessed `chunk_size` grid points at a time, in a pool of
+#     `workers` processes.
+# The surface is the sum of the blocks, broadcast over the grid.
+
+# Sums of pairwise contributions between chords a and b, for every
+# combination of rows of hz_a (steps_a x partials) and hz_b (steps_b x
+# partials)
+def grid_cross(array_assess, hz_a, amp_a, hz_b, amp_b, options={}) -> np.ndarray:
+    return cached_assess(
+        array_assess,
+        hz_a[:, np.newaxis, :, np.newaxis],
+        hz_b[np.newaxis, :, np.newaxis, :],
+        amp_a[np.newaxis, np.newaxis, :, np.newaxis],
+        amp_b[np.newaxis, np.newaxis, np.newaxis, :],
+        options,
+        (2, 3)
+    )
+
+# grid_cross over row chunks of hz_a, in parallel with workers > 1
+def chunked_grid_cross(array_assess, hz_a, amp_a, hz_b, amp_b, *, chunk_size=512, workers=1, options={}) -> np.ndarray:
+    rows = max(1, chunk_size // max(1, len(hz_b)))
+    chunks = [hz_a[start:start + rows] for start in range(0, len(hz_a), rows)]
+    if len(chunks) == 0:
+        return np.zeros((0, len(hz_b)))
+
+    if workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(
+                grid_cross,
+                [array_assess] * len(chunks),
+                chunks,
+                [amp_a] * len(chunks),
+                [hz_b] * len(chunks),
+                [amp_b] * len(chunks),
+                [options] * len(chunks)
+            ))
+    else:
+        results = [grid_cross(array_assess, chunk, amp_a, hz_b, amp_b, options) for chunk in chunks]
+
+    return np.concatenate(results)
+
+# Block sums for a surface. Returns ref_self (a scalar), and per test chord
+# k, `self` (test_k x test_k) and `ref_cross` (ref x test_k) over domain k,
+# and `cross` (test_k x test_l, for k < l) over domains k and l. With
+# self_terms=False, ref_self and `self` are not assessed (left at zero).
+def surface_blocks(
+    array_assess,
+    ref_chord: ChordSpectrum,
+    test_chords: list,
+    transpose_domains: list,
+    invariant_transpositions: list,
+    *,
+    chunk_size: int = 512,
+    workers: int = 1,
+    self_terms: bool = True,
+    options={}
+) -> dict:
+    if len(test_chords) != len(transpose_domains):
+        raise ValueError(f'Expected one TransposeDomain per test chord, got {len(transpose_domains)} for {len(test_chords)}')
+
+    blocks = {'ref_self': 0.0, 'self': [], 'ref_cross': [], 'cross': {}}
+
+    for (k, (test_chord, transpose_domain)) in enumerate(zip(test_chords, transpose_domains)):
+        sweep = pair_sweep(
+            array_assess,
+            ref_chord,
+            test_chord,
+            transpose_domain,
+            chunk_size=chunk_size,
+            self_terms=self_terms,
+            test_invariant=transpose_domain.transpose_type.upper() in invariant_transpositions,
+            options=options
+        )
+        blocks['ref_self'] = sweep['ref_self']
+        blocks['self'].append(sweep['test_self'])
+        blocks['ref_cross'].append(sweep['cross'])
+
+    test_hz = [chord.transposed_hz(domain.domain, domain.transpose_type)
+        for (chord, domain) in zip(test_chords, transpose_domains)]
+    test_amp = [np.asarray(chord.amp, dtype=float) for chord in test_chords]
+
+    for k in range(len(test_chords)):
+        for l in range(k + 1, len(test_chords)):
+            blocks['cross'][(k, l)] = chunked_grid_cross(
+                array_assess,
+                test_hz[k],
+                test_amp[k],
+                test_hz[l],
+                test_amp[l],
+                chunk_size=chunk_size,
+                workers=workers,
+                options=options
+            )
+
+    return blocks
+
+# Add a block that varies along the given axes into an N-D surface
+def add_block(surface: np.ndarray, block: np.ndarray, axes: tuple):
+    shape = [1] * surface.ndim
+    for axis in axes:
+        shape[axis] = surface.shape[axis]
+    surface += np.reshape(block, shape)
+
+# Roughness of ref_chord merged with every test chord, at each point of the
+# grid of transpose_domains (one per test chord). With crossterms_only, each
+# chord's own roughness (at its transposition) is subtracted, as in
+# roughness_curve. Pairwise models only.
+def roughness_surface(
+    ref_chord: ChordSpectrum,
+    test_chords: list,
+    transpose_domains: list,
+    function_type: str = 'SETHARES',
+    *,
+    chunk_size: int = 512,
+    workers: int = 1,
+    options={
+        'crossterms_only': False,
+        'amp_type': 'MIN',
+        'cutoff': False,
+        'original': False
+    }
+) -> np.ndarray:
+    ref_denom = 1
+    test_denoms = [1] * len(test_chords)
+
+    if function_type.upper() == 'SETHARES':
+        array_assess = sethares_roughness_array
+    elif function_type.upper() == 'CBW':
+        array_assess = cbw_roughness_array
+    elif function_type.upper() == 'PARNCUTT':
+        array_assess = parncutt_roughness_array
+        ref_denom = np.sum(np.asarray(ref_chord.amp, dtype=float) ** 2)
+        test_denoms = [np.sum(np.asarray(chord.amp, dtype=float) ** 2) for chord in test_chords]
+    else:
+        raise ValueError(f'Invalid sweep function type: {function_type.upper()}')
+
+    if options.get('kernel_table', None) is not None:
+        raise ValueError('Invalid sweep option: kernel_table')
+
+    union_denom = ref_denom + sum(test_denoms) if function_type.upper() == 'PARNCUTT' else 1
+
+    # As in roughness_sweep, the self terms cancel with crossterms_only
+    # unless the denominators differ
+    crossterms_only = options.get('crossterms_only', False)
+    self_terms = not crossterms_only or function_type.upper() == 'PARNCUTT'
+
+    blocks = surface_blocks(
+        array_assess,
+        ref_chord,
+        test_chords,
+        transpose_domains,
+        ROUGHNESS_INVARIANT_TRANSPOSITIONS[function_type.upper()],
+        chunk_size=chunk_size,
+        workers=workers,
+        self_terms=self_terms,
+        options=options
+    )
+
+    surface = np.zeros(tuple(len(domain.domain) for domain in transpose_domains))
+
+    surface += blocks['ref_self'] * (1 / union_denom - (1 / ref_denom if crossterms_only else 0))
+    for k in range(len(test_chords)):
+        add_block(surface, blocks['self'][k] * (1 / union_denom - (1 / test_denoms[k] if crossterms_only else 0)), (k,))
+        add_block(surface, blocks['ref_cross'][k] / union_denom, (k,))
+    for ((k, l), cross) in blocks['cross'].items():
+        add_block(surface, cross / union_denom, (k, l))
+
+    return surface
+
+# Overlap of ref_chord merged with every test chord, at each point of the
+# grid of transpose_domains. With crossterms_only, only the pairs across
+# different chords count.
+def overlap_surface(
+    ref_chord: ChordSpectrum,
+    test_chords: list,
+    transpose_domains: list,
+    function_type: str = 'SETHARES_BELL',
+    *,
+    chunk_size: int = 512,
+    workers: int = 1,
+    options={
+        'crossterms_only': False,
+        'amp_type': 'MIN',
+        'cutoff': False,
+        'original': False
+    }
+) -> np.ndarray:
+    if function_type.upper() == 'SETHARES_BELL':
+        array_assess = sethares_bell_overlap_array
+    elif function_type.upper() == 'PARNCUTT_BELL':
+        array_assess = parncutt_bell_overlap_array
+    elif function_type.upper() == 'CBW':
+        array_assess = cbw_overlap_array
+    elif function_type.upper() == 'COS':
+        array_assess = cos_overlap_array
+    else:
+        raise ValueError(f'Invalid sweep function type: {function_type.upper()}')
+
+    if options.get('kernel_table', None) is not None:
+        raise ValueError('Invalid sweep option: kernel_table')
+
+    crossterms_only = options.get('crossterms_only', False)
+
+    blocks = surface_blocks(
+        array_assess,
+        ref_chord,
+        test_chords,
+        transpose_domains,
+        OVERLAP_INVARIANT_TRANSPOSITIONS[function_type.upper()],
+        chunk_size=chunk_size,
+        workers=workers,
+        self_terms=not crossterms_only,
+        options=options
+    )
+
+    surface = np.zeros(tuple(len(domain.domain) for domain in transpose_domains))
+
+    if not crossterms_only:
+        surface += blocks['ref_self']
+    for k in range(len(test_chords)):
+        if not crossterms_only:
+            add_block(surface, blocks['self'][k], (k,))
+        add_block(surface, blocks['ref_cross'][k], (k,))
+    for ((k, l), cross) in blocks['cross'].items():
+        add_block(surface, cross, (k, l))
+
+    return surface
@@ -1,58 +1,221 @@
-import pandas as pd
-import matplotlib.pyplot as plt
+from __future__ import annotations
+
 import numpy as np
+from numpy.typing import ArrayLike
+from profiling import timed
+
+# pandas and matplotlib are imported on first use (of `partials` and plot()),
+# so that code that only scores chords never loads them.
+
+# Display a stem plot of a spectrum
+def stem_plot(hz, amp) -> None:
+    import matplotlib.pyplot as plt
+    plt.stem(hz, amp)
+    plt.show()
 
 ###########
 # CLASSES #
 ###########
-class Timbre:
+
+# Base class for anything holding a table of partials. Each column is stored
+# as a contiguous NumPy array (None if the column is absent), so the models
+# can work on the arrays directly. `partials` is a DataFrame view of the
+# same table, built on first access, kept for backward compatibility.
+# A frozen spectrum (see freeze()) has read-only arrays and cannot be
+# modified, so it can be shared, e.g. through a SpectrumCache.
+class CompactSpectrum:
+    __slots__ = ('hz', 'amp', 'note_id', 'fund_multiple', 'hz_orig', '_partials', 'frozen')
+
+    # Columns of the `partials` view, in order
+    partial_columns = ['hz', 'amp', 'note_id', 'fund_multiple', 'hz_orig']
+
+    def __init__(self, hz=None, amp=None, note_id=None, fund_multiple=None, hz_orig=None):
+        self.hz = hz
+        self.amp = amp
+        self.note_id = note_id
+        self.fund_multiple = fund_multiple
+        self.hz_orig = hz_orig
+        self._partials = None
+        self.frozen = False
+
+    # The view is a snapshot: writing into it does not update the arrays.
+    # Either assign a whole DataFrame to `partials`, or update the arrays and
+    # call invalidate().
+    @property
+    def partials(self) -> pd.DataFrame:
+        if self._partials is None:
+            import pandas as pd
+            self._partials = pd.DataFrame({
+                column: getattr(self, column) for column in self.partial_columns
+                if getattr(self, column) is not None
+            })
+        return self._partials
+
+    @partials.setter
+    def partials(self, partials: pd.DataFrame) -> None:
+        self.check_mutable()
+        for column in CompactSpectrum.partial_columns:
+            setattr(self, column, partials[column].to_numpy() if column in partials else None)
+        self._partials = None
+
+    # Build a spectrum of this class (e.g. Timbre.from_partials) from a
+    # partials table, e.g. one held by another object. Only the partials are
+    # set; a subclass's other attributes are left unset.
+    @classmethod
+    def from_partials(cls, partials: pd.DataFrame):
+        spectrum = cls.__new__(cls)
+        CompactSpectrum.__init__(spectrum)
+        spectrum.partials = partials
+        return spectrum
+
+    # Drop the cached `partials` view after the arrays have been changed
+    def invalidate(self) -> None:
+        self._partials = None
+
+    def __len__(self) -> int:
+        return len(self.amp) if self.amp is not None else 0
+
+    # Make the spectrum read-only
+    def freeze(self):
+        for column in CompactSpectrum.partial_columns:
+            array = getattr(self, column)
+            if array is not None:
+                array.setflags(write=False)
+        self.frozen = True
+        return self
+
+    def check_mutable(self) -> None:
+        if self.frozen:
+            raise ValueError('Cannot modify a frozen spectrum; modify a copy() instead')
+
+class Timbre(CompactSpectrum):
+    __slots__ = ()
+    partial_columns = ['fund_multiple', 'amp']
+
     def __init__(self, fund_multiple: list or range, amp: list = 1):
-        self.partials = pd.DataFrame({
-            'fund_multiple': list(fund_multiple),
-            'amp': np.ones_like(fund_multiple)
-        })
+        fund_multiple = np.asarray(list(fund_multiple))
 
         if type(amp) != int or amp != 1:
-            self.partials['amp'] = amp
+            amp = np.broadcast_to(np.asarray(amp), np.shape(fund_multiple)).copy()
+        else:
+            amp = np.ones_like(fund_multiple)
+
+        CompactSpectrum.__init__(self, amp=amp, fund_multiple=fund_multiple)
 
     def copy(self):
-        return Timbre(list(self.partials['fund_multiple']), list(self.partials['amp']))
+        return Timbre(self.fund_multiple.copy(), self.amp.copy())
 
+@timed('sort_partials')
 def sort_partials(partials: pd.DataFrame) -> pd.DataFrame:
     return partials.reindex(['hz', 'amp', 'note_id', 'fund_multiple', 'hz_orig'], axis=1).sort_values(by = 'hz', ignore_index = True)
 
-class MergedSpectrum:
-    # Need to overload to merge two chords
+# Sort a table of columns (a dict of arrays, as in CompactSpectrum) by hz,
+# unless it is sorted already, which is the usual case.
+def sorted_columns(columns: dict) -> dict:
+    hz = columns['hz']
+    if np.all(hz[:-1] <= hz[1:]):
+        return columns
+
+    order = np.argsort(hz, kind='stable')
+    return {
+        column: (None if array is None else array[order])
+        for (column, array) in columns.items()
+    }
+
+# Merge two tables of columns, each sorted by hz, into one sorted table. No
+# sort is needed: the merged position of each entry is its own index plus the
+# number of entries of the other table that precede it. Ties keep the entries
+# of `a` first. Columns missing from only one table are filled with NaN.
+def merge_two_columns(a: dict, b: dict) -> dict:
+    a_pos = np.searchsorted(b['hz'], a['hz'], side='left') + np.arange(len(a['hz']))
+    b_pos = np.searchsorted(a['hz'], b['hz'], side='right') + np.arange(len(b['hz']))
+
+    merged = {}
+    for column in CompactSpectrum.partial_columns:
+        if a[column] is None and b[column] is None:
+            merged[column] = None
+            continue
+
+        a_col = np.full(len(a_pos), np.nan) if a[column] is None else a[column]
+        b_col = np.full(len(b_pos), np.nan) if b[column] is None else b[column]
+        merged[column] = np.empty(len(a_pos) + len(b_pos), dtype=np.result_type(a_col, b_col))
+        merged[column][a_pos] = a_col
+        merged[column][b_pos] = b_col
+
+    return merged
+
+# Merge any number of tables of columns, pairwise in a balanced tree, so
+# that merging many chord layers costs O(partials * log(layers)).
+def merge_columns(*layers: dict) -> dict:
+    if len(layers) == 0:
+        return {column: np.zeros(0) for column in CompactSpectrum.partial_columns}
+
+    layers = [sorted_columns(layer) for layer in layers]
+    if len(layers) == 1:
+        return {
+            column: (None if array is None else array.copy())
+            for (column, array) in layers[0].items()
+        }
+
+    while len(layers) > 1:
+        layers = [
+            merge_two_columns(layers[k], layers[k + 1]) if k + 1 < len(layers) else layers[k]
+            for k in range(0, len(layers), 2)
+        ]
+
+    return layers[0]
+
+# Merge the partials of several spectra, sorted by hz
+def merge_partials(*spectra: CompactSpectrum) -> dict:
+    return merge_columns(*[
+        {column: getattr(spectrum, column) for column in CompactSpectrum.partial_columns}
+        for spectrum in spectra
+    ])
+
+class MergedSpectrum(CompactSpectrum):
+    __slots__ = ('fund_hz',)
+
+    # Called with a Timbre and a fundamental, or with any number of spectra to
+    # merge (e.g. several chord layers)
+    @timed('MergedSpectrum')
     def __init__(self, *args):
+        CompactSpectrum.__init__(self)
+
         if isinstance(args[0], Timbre):
-            self.partials = args[0].partials.copy()
-            self.partials['hz'] = self.partials['fund_multiple']
+            self.fund_multiple = args[0].fund_multiple.copy()
+            self.amp = args[0].amp.copy()
+            self.hz = args[0].fund_multiple.copy()
             if isinstance(args[1], float) or isinstance(args[1], int):
                 self.fund_hz = float(args[1])
                 if args[1] > 0:
-                    self.partials['hz'] *= self.fund_hz
+                    self.hz = self.hz * self.fund_hz
             else:
                 self.fund_hz = 0
 
         # Constructor called with ChordSpectrum or MergedSpectrum objects: merges them
-        elif isinstance(args[0].partials, pd.DataFrame):
+        else:
             self.fund_hz = 0
-            # Two spectra provided: merge them
-            if len(args) > 1 and isinstance(args[1].partials, pd.DataFrame):
-                # self.partials = args[0].partials.append(args[1].partials, ignore_index = True)
-                self.partials = pd.concat([args[0].partials, args[1].partials], ignore_index = True)
-                self.partials = sort_partials(self.partials)
+            spectra = [spectrum if isinstance(spectrum, CompactSpectrum) else CompactSpectrum.from_partials(spectrum.partials)
+                for spectrum in args]
+            # Two or more spectra provided: merge them
+            if len(spectra) > 1:
+                for (column, array) in merge_partials(*spectra).items():
+                    setattr(self, column, array)
             # Only one spectrum provided: copy it over
             else:
-                self.partials = args[0].partials.copy(deep=True)
+                for column in CompactSpectrum.partial_columns:
+                    array = getattr(spectra[0], column)
+                    setattr(self, column, None if array is None else array.copy())
 
     # Display a stem plot of the spectrum
     def plot(self):
-        plt.stem(self.partials['hz'], self.partials['amp'])
-        plt.show()
+        stem_plot(self.hz, self.amp)
 
 
-class ChordSpectrum:
+class ChordSpectrum(CompactSpectrum):
+    __slots__ = ('struct', 'struct_type', 'timbre', 'fund_hz', 'fund_hz_orig', 'ref_tone')
+
+    @timed('ChordSpectrum')
     def __init__(
         self,
         chord_struct: list,
@@ -61,7 +224,7 @@ class ChordSpectrum:
         timbre: Timbre = Timbre(range(1, 13), [0.88 ** p for p in range(0, 12)]),
         fund_hz: float = 220.0
     ):
-        self.partials = pd.DataFrame()
+        CompactSpectrum.__init__(self)
         self.struct = chord_struct
         self.struct_type = chord_struct_type
         self.timbre = timbre
@@ -69,65 +232,180 @@ class ChordSpectrum:
         self.fund_hz_orig = fund_hz
         self.ref_tone = MergedSpectrum(timbre, fund_hz)
 
-        # Generate chord from reference tone and chord structure
+        # Generate chord from reference tone and chord structure: one layer
+        # per note, each sorted by hz, merged together.
+        layers = []
         for (idx, note) in enumerate(chord_struct):
-            new_tone = MergedSpectrum(timbre, fund_hz)
-            # print('note', note)
-            new_tone.partials['hz'] = self.add_note_hz(note)
-            new_tone.partials['hz_orig'] = new_tone.partials['hz']
-            new_tone.partials['note_id'] = idx
-            # self.partials = self.partials.append(new_tone.partials, ignore_index = True)
-            self.partials = pd.concat([self.partials, new_tone.partials], ignore_index = True)
+            note_hz = self.add_note_hz(note)
+            layers.append({
+                'hz': note_hz,
+                'amp': timbre.amp,
+                'note_id': np.full(len(timbre), idx),
+                'fund_multiple': timbre.fund_multiple,
+                'hz_orig': note_hz
+            })
 
-        self.partials = sort_partials(self.partials)
+        for (column, array) in merge_columns(*layers).items():
+            setattr(self, column, array)
 
     # Generate a new note for the chord, based on the chord_struct_type
-    def add_note_hz(self, note_hz: float) -> float:
+    def add_note_hz(self, note_hz: float) -> np.ndarray:
         # chord_struct defines intervals by semitone difference
         if self.struct_type.upper() == 'ST_DIFF':
-            return 2 ** (note_hz / 12) * self.ref_tone.partials['hz']
+            return 2 ** (note_hz / 12) * self.ref_tone.hz
         # chord_struct defines intervals by frequency scaling (ratios)
         elif self.struct_type.upper() == 'SCALE_FACTOR':
-            return note_hz * self.ref_tone.partials['hz']
+            return note_hz * self.ref_tone.hz
         # chord_struct defines intervals by absolute Hz difference
         # NB: This is still assuming that the timbre describes each tone by
         # multiples of that tone's fundamental.
         elif self.struct_type.upper() == 'HZ_SHIFT':
-            return note_hz + self.ref_tone.partials['hz']
+            return note_hz + self.ref_tone.hz
         else:
             raise ValueError(f'invalid chord structure type: {self.struct_type}')
 
+    # Mutable copy of the chord (e.g. of a frozen, shared one). The timbre
+    # and reference tone are shared.
+    def copy(self):
+        chord = ChordSpectrum.__new__(ChordSpectrum)
+        CompactSpectrum.__init__(chord, *[
+            None if getattr(self, column) is None else getattr(self, column).copy()
+            for column in CompactSpectrum.partial_columns
+        ])
+        for attr in ChordSpectrum.__slots__:
+            setattr(chord, attr, getattr(self, attr))
+        chord.struct = list(self.struct)
+        return chord
+
     def reset_partials(self) -> None:
+        self.check_mutable()
         self.set_fund_hz(self.fund_hz_orig)
-        self.partials['hz'] = self.partials['hz_orig']
+        self.hz = self.hz_orig.copy()
+        self.invalidate()
 
     def set_fund_hz(self, new_fund_hz: float) -> None:
+        self.check_mutable()
         self.fund_hz = new_fund_hz
-        self.partials['hz'] = self.partials['fund_multiple'] * new_fund_hz
+        self.hz = self.fund_multiple * new_fund_hz
+        self.invalidate()
 
     # Update chord's frequency table to reflect a transposition
+    @timed('ChordSpectrum.transpose')
     def transpose(self, position: float, transpose_type: str) -> None:
+        self.check_mutable()
         if transpose_type.upper() != self.struct_type.upper():
             Warning('chord structure type does not match transposition type')
 
         if transpose_type.upper() == 'ST_DIFF':
             # self.partials['hz'] *= 2 ** (position / 12)
             self.set_fund_hz(2 ** (position / 12) * self.fund_hz_orig)
-            self.partials['fund_multiple'] = self.partials['hz'] / self.fund_hz
+            self.fund_multiple = self.hz / self.fund_hz
         elif transpose_type.upper() == 'SCALE_FACTOR':
             # self.partials['hz'] *= position
             self.set_fund_hz(position * self.fund_hz_orig)
-            self.partials['fund_multiple'] = self.partials['hz'] / self.fund_hz
+            self.fund_multiple = self.hz / self.fund_hz
         elif transpose_type.upper() == 'HZ_SHIFT':
-            self.partials['hz'] = self.partials['hz_orig'] + position
+            self.hz = self.hz_orig + position
+            self.invalidate()
         else:
             raise ValueError('invalid chord structure type')
 
+    # Read-only view of the chord at one transposition (see
+    # TransposedSpectrum); the chord itself is not modified
+    def transposed(self, position: float, transpose_type: str):
+        return TransposedSpectrum(self, position, transpose_type)
+
+    # Frequency table of the chord at each of several transpositions, as a
+    # (positions x partials) array. Row k holds the frequencies that
+    # transpose(positions[k], transpose_type) would leave in partials['hz'],
+    # but the chord itself is not modified.
+    @timed('ChordSpectrum.transposed_hz')
+    def transposed_hz(self, positions: ArrayLike, transpose_type: str) -> np.ndarray:
+        positions = np.asarray(positions, dtype=float)[:, np.newaxis]
+
+        if transpose_type.upper() == 'ST_DIFF':
+            fund_hz = 2 ** (positions / 12) * self.fund_hz_orig
+            return np.asarray(self.fund_multiple, dtype=float)[np.newaxis, :] * fund_hz
+        elif transpose_type.upper() == 'SCALE_FACTOR':
+            fund_hz = positions * self.fund_hz_orig
+            return np.asarray(self.fund_multiple, dtype=float)[np.newaxis, :] * fund_hz
+        elif transpose_type.upper() == 'HZ_SHIFT':
+            return np.asarray(self.hz_orig, dtype=float)[np.newaxis, :] + positions
+        else:
+            raise ValueError('invalid chord structure type')
 
     # Display a stem plot of the chord
     def plot(self) -> None:
-        plt.stem(self.partials['hz'], self.partials['amp'])
-        plt.show()
+        stem_plot(self.hz, self.amp)
+
+
+# Read-only view of a chord at one transposition. The view holds the chord
+# and the transform hz = source * scale + shift, where source is the chord's
+# fund_multiple (ST_DIFF, SCALE_FACTOR) or hz_orig (HZ_SHIFT); the other
+# columns are the chord's own arrays, and hz is computed on first access.
+# Nothing is copied and the chord is never modified, so any number of views,
+# e.g. in concurrent sweeps, can share one chord (which should not itself be
+# modified meanwhile). The frequencies are those transpose(position,
+# transpose_type) would set.
+class TransposedSpectrum(CompactSpectrum):
+    __slots__ = ('base', 'position', 'transpose_type', 'source', 'scale', 'shift', '_hz')
+
+    def __init__(self, base: ChordSpectrum, position: float, transpose_type: str):
+        self.base = base
+        self.position = position
+        self.transpose_type = transpose_type
+
+        if transpose_type.upper() == 'ST_DIFF':
+            (self.source, self.scale, self.shift) = (base.fund_multiple, 2 ** (position / 12) * base.fund_hz_orig, 0)
+        elif transpose_type.upper() == 'SCALE_FACTOR':
+            (self.source, self.scale, self.shift) = (base.fund_multiple, position * base.fund_hz_orig, 0)
+        elif transpose_type.upper() == 'HZ_SHIFT':
+            (self.source, self.scale, self.shift) = (base.hz_orig, 1, position)
+        else:
+            raise ValueError('invalid chord structure type')
+
+        self._hz = None
+        self._partials = None
+        self.frozen = True
+
+    @property
+    def hz(self) -> np.ndarray:
+        if self._hz is None:
+            hz = np.asarray(self.source, dtype=float) * self.scale + self.shift
+            hz.setflags(write=False)
+            self._hz = hz
+        return self._hz
+
+    @property
+    def amp(self) -> np.ndarray:
+        return self.base.amp
+
+    @property
+    def note_id(self) -> np.ndarray:
+        return self.base.note_id
+
+    @property
+    def fund_multiple(self) -> np.ndarray:
+        return self.base.fund_multiple
+
+    @property
+    def hz_orig(self) -> np.ndarray:
+        return self.base.hz_orig
+
+    @property
+    def fund_hz(self) -> float:
+        if self.transpose_type.upper() == 'HZ_SHIFT':
+            return self.base.fund_hz_orig
+        return self.scale
+
+    # Views pickle as (chord, position, transpose_type), e.g. for process
+    # pools
+    def __reduce__(self):
+        return (TransposedSpectrum, (self.base, self.position, self.transpose_type))
+
+    # Display a stem plot of the transposed chord
+    def plot(self) -> None:
+        stem_plot(self.hz, self.amp)
 
 
 class TransposeDomain:
@@ -135,6 +413,15 @@ class TransposeDomain:
         self.domain = np.linspace(low_bound, high_bound, num=steps)
         self.transpose_type = transpose_type
 
+    # Domain of arbitrary (e.g. non-uniform, or part of another domain's)
+    # positions
+    @classmethod
+    def from_positions(cls, positions: ArrayLike, transpose_type: str):
+        transpose_domain = cls.__new__(cls)
+        transpose_domain.domain = np.asarray(positions, dtype=float)
+        transpose_domain.transpose_type = transpose_type
+        return transpose_domain
+
 # Sample usage: make_timbre(range(1, 13))
 # def make_timbre(fund_multiple: list or range, amp: list = 1):
 #     timbre = pd.DataFrame({
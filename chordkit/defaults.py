@@ -49,13 +49,23 @@ default_fund = a3
 # TRANSPOSITION DOMAINS #
 #########################
 # These are not generally modified over the course of the computations,
-# so we can keep referencing these same objects in memory
-
-one_octave = TransposeDomain(-0.5, 12.5, 1301, 'ST_DIFF')
-two_octaves = TransposeDomain(-0.5, 24.5, 2501, 'ST_DIFF')
-two_octaves_symm = TransposeDomain(-12.5, 12.5, 2501, 'ST_DIFF')
-
-default_transpose_domain = one_octave
+# so we can keep referencing these same objects in memory. Like the default
+# chord, each is built on first use (see LAZY DEFAULTS below).
+lazy_defaults = {
+    'one_octave': lambda: TransposeDomain(-0.5, 12.5, 1301, 'ST_DIFF'),
+    'two_octaves': lambda: TransposeDomain(-0.5, 24.5, 2501, 'ST_DIFF'),
+    'two_octaves_symm': lambda: TransposeDomain(-12.5, 12.5, 2501, 'ST_DIFF'),
+    'default_transpose_domain': lambda: lazy_default('one_octave'),
+}
+
+# Curves are computed over the whole domain at once ('BATCH') unless the
+# step-by-step loop ('LOOP') is requested. Batched sweeps process this many
+# transposition steps at a time.
+default_sweep_type = 'BATCH'
+default_chunk_size = 512
+# Adaptive sweeps ('ADAPTIVE') refine the curve until straight lines between
+# its positions are within about this fraction of its range
+default_tolerance = 1e-3
 
 ###############
 # CHORD TYPES #
@@ -88,10 +98,27 @@ class HarrisonMajTriad(ChordSpectrum):
     def __init__(self, partials=12, fund=default_fund):
         ChordSpectrum.__init__(self, [0, 4, 7], 'ST_DIFF', timbre=HarrisonTimbre(partials), fund_hz=fund)
 
-default_chord = SetharesTone(1)
+lazy_defaults['default_chord'] = lambda: SetharesTone(1)
 
 #####################
 # RELATION DEFAULTS #
 #####################
 default_overlap_function_type = 'BELL'
 default_roughness_function_type = 'SETHARES'
+
+#################
+# LAZY DEFAULTS #
+#################
+
+# A default from lazy_defaults, built the first time it is used and the same
+# object afterwards
+def lazy_default(name: str):
+    if name not in globals():
+        globals().setdefault(name, lazy_defaults[name]())
+    return globals()[name]
+
+# Module attributes (PEP 562) for the lazy defaults, e.g. defaults.one_octave
+def __getattr__(name: str):
+    if name in lazy_defaults:
+        return lazy_default(name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
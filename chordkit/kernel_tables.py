@@ -0,0 +1,249 @@
+import os
+
+import numpy as np
+from pair_constants import SETHARES_CONSTANTS as sc, AUDITORY_CONSTANTS as ac
+from pair_utils import PairGeometry
+from roughness_models import sethares_roughness_geometry, parncutt_roughness_geometry
+from overlap_models import sethares_bell_overlap_geometry, parncutt_bell_overlap_geometry
+
+# This file contains precomputed interpolation tables for the smooth
+# pairwise models, for very large sweeps where the exponentials and powers
+# of the array models dominate.
+#
+# Each of these models is an amplitude factor times a "shape" that depends
+# only on the two frequencies. The shape is tabulated on a grid of
+#   - log2 of the lower frequency, between min_hz and max_hz, and
+#   - normalized distance u = |f1 - f2| / (s1 * min(f) + s2), the frequency
+#     difference in units of Sethares' critical-band scaling (see
+#     SETHARES_CONSTANTS), which is cheap to compute per pair,
+# and evaluated by bilinear interpolation. Pairs whose lower frequency is off
+# the grid are assessed exactly; pairs beyond the last distance are zero.
+# The amplitude factor and Sethares' cutoff are applied exactly. Sethares'
+# shapes depend on u alone, so their tables collapse to a single row and are
+# evaluated by linear interpolation in u, without the log2.
+#
+# The maximum error (on the shape, i.e. per unit amplitude factor) is
+# estimated when a table is built and stored as `max_error`: the largest
+# interpolation error at the centers of the grid cells, or, for a model with
+# a hard cutoff, the size of its jump if that is larger (pairs within a cell
+# of the cutoff may be off by up to the jump). With the default grid it is
+# about 1e-5 for SETHARES and SETHARES_BELL, 1e-4 for PARNCUTT_BELL, and
+# 1.2e-2 (the jump) for PARNCUTT.
+#
+# A table passed as options['kernel_table'] to roughness_complex or
+# overlap_complex with backend='NUMBA' is evaluated by compiled kernels
+# (numba_kernels.compiled_table), 2.5-4.5x faster than the compiled models
+# for spectra of 100 partials and more; Sethares' roughness with cutoff=True
+# gains less, since the cutoff is still computed exactly. With NumPy, the
+# lookups are no faster than np.exp (gathers from a table are not vectorized
+# the way np.exp is): the NumPy backend evaluates a table only so that
+# results do not depend on the backend (e.g. without numba), and the sweeps
+# do not accept tables.
+#
+# Tables can be saved to and loaded from .npz files; kernel_table() keeps
+# them in a directory and builds each one only once.
+
+# Models that can be tabulated: (measure, function_type) to the model, the
+# options it is built with, the largest normalized distance at which it is
+# (numerically) nonzero, and the size of the jump at its hard cutoff, if any
+def table_model(measure: str, function_type: str, K: float = -2.374):
+    if (measure.upper(), function_type.upper()) == ('ROUGHNESS', 'SETHARES'):
+        # exp(-a s d) falls below 1e-12 of its peak by u = 27.6 / (a s*)
+        return (sethares_roughness_geometry, {'amp_type': 'MIN', 'cutoff': False, 'original': False},
+            27.6 / (sc['a'] * sc['s_star']), 0.0)
+    elif (measure.upper(), function_type.upper()) == ('OVERLAP', 'SETHARES_BELL'):
+        if K >= 0:
+            raise ValueError(f'Cannot tabulate a non-decaying bell: K = {K}')
+        return (sethares_bell_overlap_geometry, {'amp_type': 'MIN', 'cutoff': False, 'K': K},
+            27.6 / (-K * sc['b'] * sc['s_star']), 0.0)
+    elif (measure.upper(), function_type.upper()) == ('ROUGHNESS', 'PARNCUTT'):
+        # Both Parncutt models are zero past 1.2 CBWs, i.e. u < 5.05 on the
+        # audible range
+        return (parncutt_roughness_geometry, {}, 6.0, ((np.exp(1) / 0.25) * 1.2 * np.exp(-1.2 / 0.25)) ** 2)
+    elif (measure.upper(), function_type.upper()) == ('OVERLAP', 'PARNCUTT_BELL'):
+        return (parncutt_bell_overlap_geometry, {}, 6.0, np.exp(-(1.2 ** 2) / (0.25 ** 3 / 1.19614)))
+    else:
+        raise ValueError(f'Invalid table model: {measure.upper()}, {function_type.upper()}')
+
+# Amplitude factor of a tabulated model, as used by the model itself
+def table_amp_factor(measure: str, function_type: str, geometry: PairGeometry, options={}):
+    if function_type.upper() == 'SETHARES':
+        amp_type = options.get('amp_type', 'MIN')
+        if options.get('original', False) == True:
+            amp_type = 'MIN'
+        return geometry.volume(amp_type)
+    elif function_type.upper() == 'SETHARES_BELL':
+        return geometry.volume(options.get('amp_type', 'MIN'))
+    elif function_type.upper() == 'PARNCUTT':
+        return geometry.amp_product
+    else:
+        return geometry.amp_product / geometry.amp_square_sum
+
+# Normalized distance used as the second table axis
+def normalized_distance(low_hz, distance):
+    return distance / (sc['s1'] * low_hz + sc['s2'])
+
+class KernelTable:
+    def __init__(self, measure: str, function_type: str, log_hz, u, values, *, K: float = -2.374, max_error: float = None):
+        self.measure = measure.upper()
+        self.function_type = function_type.upper()
+        self.K = K
+        self.log_hz = np.asarray(log_hz, dtype=float)
+        self.u = np.asarray(u, dtype=float)
+        self.values = np.asarray(values, dtype=float)
+        self.max_error = max_error
+
+    # Tabulate a model on a grid of hz_steps lower frequencies (log-spaced
+    # between min_hz and max_hz) by u_steps normalized distances
+    @classmethod
+    def build(
+        cls,
+        measure: str,
+        function_type: str,
+        *,
+        min_hz: float = 20.0,
+        max_hz: float = 20000.0,
+        hz_steps: int = 512,
+        u_steps: int = 4096,
+        K: float = -2.374
+    ):
+        (_, _, u_max, jump) = table_model(measure, function_type, K)
+        log_hz = np.linspace(np.log2(min_hz), np.log2(max_hz), hz_steps)
+        u = np.linspace(0, u_max, u_steps)
+
+        table = cls(measure, function_type, log_hz, u, np.zeros((hz_steps, u_steps)), K=K)
+        table.values = table.exact_shape(np.exp2(log_hz)[:, np.newaxis], u[np.newaxis, :])
+        if np.max(np.abs(table.values - table.values[0])) <= 1e-12 * np.max(np.abs(table.values)):
+            table.values = table.values[:1]
+
+        # Worst case of bilinear interpolation is at the cell centers
+        log_mid = (log_hz[:-1] + log_hz[1:]) / 2
+        u_mid = (u[:-1] + u[1:]) / 2
+        exact = table.exact_shape(np.exp2(log_mid)[:, np.newaxis], u_mid[np.newaxis, :])
+        interpolated = table.interpolate(log_mid[:, np.newaxis], u_mid[np.newaxis, :])
+        table.max_error = max(float(np.max(np.abs(exact - interpolated))), jump)
+
+        return table
+
+    # Model value per unit amplitude factor, computed directly
+    def exact_shape(self, low_hz, u):
+        (geometry_assess, shape_options, _, _) = table_model(self.measure, self.function_type, self.K)
+        distance = u * (sc['s1'] * low_hz + sc['s2'])
+        geometry = PairGeometry(low_hz, low_hz + distance, 1.0, 1.0)
+
+        return geometry_assess(geometry, shape_options) / table_amp_factor(self.measure, self.function_type, geometry)
+
+    # Bilinear interpolation of the table at (log2 lower frequency, u), or
+    # linear in u for a single-row table (log_hz is then ignored). Zero past
+    # the last distance; lower frequencies are clamped to the grid.
+    def interpolate(self, log_hz, u):
+        u_steps = len(self.u)
+        u_pos = np.minimum(u * (1 / (self.u[1] - self.u[0])), u_steps - 1)
+        u_idx = np.minimum(u_pos.astype(np.intp), u_steps - 2)
+        u_frac = u_pos - u_idx
+
+        if len(self.values) == 1:
+            row = self.values[0]
+            low = row.take(u_idx)
+            values = low + (row.take(u_idx + 1) - low) * u_frac
+        else:
+            hz_steps = len(self.log_hz)
+            hz_pos = np.clip((log_hz - self.log_hz[0]) * (1 / (self.log_hz[1] - self.log_hz[0])), 0, hz_steps - 1)
+            hz_idx = np.minimum(hz_pos.astype(np.intp), hz_steps - 2)
+            hz_frac = hz_pos - hz_idx
+
+            flat = self.values.ravel()
+            idx = hz_idx * u_steps + u_idx
+            low = flat.take(idx)
+            low = low + (flat.take(idx + 1) - low) * u_frac
+            high = flat.take(idx + u_steps)
+            high = high + (flat.take(idx + u_steps + 1) - high) * u_frac
+            values = low + (high - low) * hz_frac
+
+        return np.where(u_pos >= u_steps - 1, 0, values)
+
+    # Raise unless this table tabulates the given model (and options)
+    def check(self, measure: str, function_type: str, options={}):
+        if (measure.upper(), function_type.upper()) != (self.measure, self.function_type):
+            raise ValueError(f'Kernel table is for {self.measure}, {self.function_type}, '
+                f'not {measure.upper()}, {function_type.upper()}')
+        if self.function_type == 'SETHARES_BELL' and options.get('K', -2.374) != self.K:
+            raise ValueError(f'Kernel table is for K = {self.K}, not K = {options.get("K", -2.374)}')
+
+    # Drop-in replacement for the model's array function (e.g.
+    # sethares_roughness_array), evaluated from the table
+    def assess(self, x_hz, ref_hz, v_x, v_ref, options={}):
+        geometry = PairGeometry(x_hz, ref_hz, v_x, v_ref)
+        low_hz, distance = np.broadcast_arrays(geometry.min_hz, geometry.distance)
+
+        if len(self.values) == 1:
+            shape = self.interpolate(None, normalized_distance(low_hz, distance))
+        else:
+            log_low = np.log2(low_hz)
+            shape = self.interpolate(log_low, normalized_distance(low_hz, distance))
+
+            off_grid = (log_low < self.log_hz[0]) | (log_low > self.log_hz[-1])
+            if np.any(off_grid):
+                shape[off_grid] = self.exact_shape(low_hz[off_grid], normalized_distance(low_hz[off_grid], distance[off_grid]))
+
+        values = shape * table_amp_factor(self.measure, self.function_type, geometry, options)
+
+        if self.function_type in ['SETHARES', 'SETHARES_BELL'] and options.get('cutoff', False) == True:
+            cbw_limit = 1.2 * geometry.cbw_volk_max / 2
+            values = np.where((distance < ac['slow_beat_limit']) | (distance >= cbw_limit), 0, values)
+
+        return values
+
+    def save(self, path: str):
+        np.savez(
+            path,
+            measure=self.measure,
+            function_type=self.function_type,
+            K=self.K,
+            log_hz=self.log_hz,
+            u=self.u,
+            values=self.values,
+            max_error=self.max_error
+        )
+
+    @classmethod
+    def load(cls, path: str):
+        with np.load(path) as data:
+            return cls(
+                str(data['measure']),
+                str(data['function_type']),
+                data['log_hz'],
+                data['u'],
+                data['values'],
+                K=float(data['K']),
+                max_error=float(data['max_error'])
+            )
+
+# Table for a model, loaded from `directory` if it has been built before and
+# built (and saved there) otherwise. Without a directory, the table is only
+# built in memory.
+def kernel_table(
+    measure: str,
+    function_type: str,
+    *,
+    directory: str = None,
+    hz_steps: int = 512,
+    u_steps: int = 4096,
+    K: float = -2.374
+) -> KernelTable:
+    if directory is None:
+        return KernelTable.build(measure, function_type, hz_steps=hz_steps, u_steps=u_steps, K=K)
+
+    file_name = f'{measure.lower()}_{function_type.lower()}_{hz_steps}x{u_steps}'
+    if function_type.upper() == 'SETHARES_BELL':
+        file_name += f'_K{K}'
+    path = os.path.join(directory, file_name + '.npz')
+
+    if os.path.exists(path):
+        return KernelTable.load(path)
+
+    table = KernelTable.build(measure, function_type, hz_steps=hz_steps, u_steps=u_steps, K=K)
+    os.makedirs(directory, exist_ok=True)
+    table.save(path)
+
+    return table
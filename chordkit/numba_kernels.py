@@ -0,0 +1,331 @@
+import math
+
+import numpy as np
+from pair_constants import SETHARES_CONSTANTS as sc, AUDITORY_CONSTANTS as ac
+from profiling import timed, count
+
+# This file contains compiled kernels for roughness_complex and
+# overlap_complex (backend='NUMBA'). Each kernel sums one model over all the
+# pairs of a spectrum in a single fused loop, with no temporary arrays. The
+# kernels are compiled with numba when it is installed. Without numba they
+# are plain Python functions (still correct, and used as such by the tests),
+# and the summation functions fall back to the NumPy backend instead.
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+numba_available = numba is not None
+
+# Compile a kernel with numba if it is available
+def jit(function):
+    if numba is None:
+        return function
+    return numba.njit(cache=True)(function)
+
+# Module-level copies of the model constants, which numba freezes at compile
+# time
+sethares_a = float(sc['a'])
+sethares_b = float(sc['b'])
+sethares_s_star = float(sc['s_star'])
+sethares_s1 = float(sc['s1'])
+sethares_s2 = float(sc['s2'])
+slow_beat_limit = float(ac['slow_beat_limit'])
+
+####################
+# SCALAR FUNCTIONS #
+####################
+
+# Critical bandwidth, as hearing_models.cbw_volk
+@jit
+def cbw_volk_scalar(hz):
+    khz = hz / 1000
+    gz = 25 + 75 * (1 + 1.4 * (khz ** 2)) ** 0.69
+    return gz * (1 - 1 / ((38.73 * khz) ** 2 + 1))
+
+# Critical bandwidth, as hearing_models.cbw_hutchinson
+@jit
+def cbw_hutchinson_scalar(hz):
+    return 1.72 * (hz ** 0.65)
+
+# Volume scale, as pair_constants.pair_volume
+@jit
+def volume_scalar(v_x, v_ref, product):
+    if product:
+        return v_x * v_ref
+    return min(v_x, v_ref)
+
+# Sethares' cutoff: pairs closer than the slow-beat limit or farther than
+# 1.2 half-CBWs are excluded
+@jit
+def sethares_cut(x_hz, ref_hz, distance):
+    return distance < slow_beat_limit or distance >= 1.2 * cbw_volk_scalar(max(x_hz, ref_hz)) / 2
+
+##################
+# ROUGHNESS SUMS #
+##################
+
+@jit
+def sethares_roughness_sum(hz, amp, product, cutoff):
+    total = 0.0
+    n = len(hz)
+    for i in range(n - 1):
+        for j in range(i + 1, n):
+            distance = abs(hz[i] - hz[j])
+            if cutoff and sethares_cut(hz[i], hz[j], distance):
+                continue
+            s = sethares_s_star / (sethares_s1 * min(hz[i], hz[j]) + sethares_s2)
+            total += volume_scalar(amp[i], amp[j], product) * (
+                math.exp(-sethares_a * s * distance) - math.exp(-sethares_b * s * distance)
+            )
+    return total
+
+@jit
+def cbw_roughness_sum(hz, amp, product):
+    total = 0.0
+    n = len(hz)
+    for i in range(n - 1):
+        for j in range(i + 1, n):
+            distance = abs(hz[i] - hz[j])
+            if distance >= 15 and distance < cbw_volk_scalar(max(hz[i], hz[j])) / 2:
+                total += volume_scalar(amp[i], amp[j], product)
+    return total
+
+# Unnormalized; roughness_complex divides by the total squared amplitude
+@jit
+def parncutt_roughness_sum(hz, amp):
+    a = 0.25
+    total = 0.0
+    n = len(hz)
+    for i in range(n - 1):
+        for j in range(i + 1, n):
+            distance = abs(hz[i] - hz[j]) / cbw_hutchinson_scalar((hz[i] + hz[j]) / 2)
+            if distance <= 1.2:
+                total += amp[i] * amp[j] * ((math.e / a) * distance * math.exp(-distance / a)) ** 2
+    return total
+
+# Test partials (1-indexed by position) against every reference partial
+@jit
+def helmholtz_roughness_sum(hz, ref_hz):
+    bPrime1 = 1
+    bPrime2 = 1
+    beta = 0.3
+    total = 0.0
+    for i in range(len(hz)):
+        x_p = i + 1
+        for j in range(len(ref_hz)):
+            delta = ((hz[i] / ref_hz[j]) - 1) / 2
+            theta = 15.0 / ref_hz[j]
+            s = 4 * bPrime1 * bPrime2 * (beta ** 2) / (beta ** 2 + (2 * math.pi * delta) ** 2)
+            total += s * ((2 * theta * delta * x_p) ** 2) / ((theta ** 2 + (x_p * delta) ** 2) ** 2)
+    return total
+
+################
+# OVERLAP SUMS #
+################
+
+@jit
+def cbw_overlap_sum(hz, amp, product):
+    total = 0.0
+    n = len(hz)
+    for i in range(n - 1):
+        for j in range(i + 1, n):
+            if abs(hz[i] - hz[j]) < slow_beat_limit:
+                total += volume_scalar(amp[i], amp[j], product)
+    return total
+
+@jit
+def cos_overlap_sum(hz, amp, product):
+    total = 0.0
+    n = len(hz)
+    for i in range(n - 1):
+        for j in range(i + 1, n):
+            distance = abs(hz[i] - hz[j])
+            if distance < slow_beat_limit:
+                total += volume_scalar(amp[i], amp[j], product) * 0.5 * (1 + math.cos(math.pi * distance / slow_beat_limit))
+    return total
+
+@jit
+def sethares_bell_overlap_sum(hz, amp, product, K, cutoff):
+    total = 0.0
+    n = len(hz)
+    for i in range(n - 1):
+        for j in range(i + 1, n):
+            distance = abs(hz[i] - hz[j])
+            if cutoff and sethares_cut(hz[i], hz[j], distance):
+                continue
+            s = sethares_s_star / (sethares_s1 * min(hz[i], hz[j]) + sethares_s2)
+            total += volume_scalar(amp[i], amp[j], product) * math.exp(K * sethares_b * s * distance)
+    return total
+
+@jit
+def parncutt_bell_overlap_sum(hz, amp):
+    a = 0.25
+    K = 1.19614
+    total = 0.0
+    n = len(hz)
+    for i in range(n - 1):
+        for j in range(i + 1, n):
+            distance = abs(hz[i] - hz[j]) / cbw_hutchinson_scalar((hz[i] + hz[j]) / 2)
+            if distance < 1.2:
+                amp_ratio = amp[i] * amp[j] / (amp[i] * amp[i] + amp[j] * amp[j])
+                total += amp_ratio * math.exp(-(distance ** 2) / (a ** 3 / K))
+    return total
+
+################
+# TABLE LOOKUP #
+################
+
+# Sums from a kernel_tables.KernelTable: the model's shape is interpolated
+# from the table instead of computed, as in KernelTable.interpolate, which
+# these kernels must match. Compiled, a lookup is several times cheaper than
+# the exponentials and powers it replaces, which it is not with NumPy.
+
+# Shape at (lower frequency, normalized distance u) from a single-row table
+# (log_hz is ignored) or a (log2 hz x u) table. Zero past the last distance;
+# lower frequencies are clamped to the grid.
+@jit
+def table_lookup(values, log_hz0, hz_scale, u_scale, low_hz, u):
+    u_steps = values.shape[1]
+    u_pos = min(u * u_scale, u_steps - 1)
+    if u_pos >= u_steps - 1:
+        return 0.0
+    u_idx = min(int(u_pos), u_steps - 2)
+    u_frac = u_pos - u_idx
+    if values.shape[0] == 1:
+        return values[0, u_idx] + (values[0, u_idx + 1] - values[0, u_idx]) * u_frac
+
+    hz_steps = values.shape[0]
+    hz_pos = min(max((math.log2(low_hz) - log_hz0) * hz_scale, 0.0), hz_steps - 1)
+    hz_idx = min(int(hz_pos), hz_steps - 2)
+    hz_frac = hz_pos - hz_idx
+    low = values[hz_idx, u_idx] + (values[hz_idx, u_idx + 1] - values[hz_idx, u_idx]) * u_frac
+    high = values[hz_idx + 1, u_idx] + (values[hz_idx + 1, u_idx + 1] - values[hz_idx + 1, u_idx]) * u_frac
+    return low + (high - low) * hz_frac
+
+# Tabulated SETHARES roughness or SETHARES_BELL overlap: the volume scale
+# times the shape, with Sethares' cutoff applied exactly. Pairs past the
+# last distance of the table are skipped before the cutoff is computed.
+@jit
+def sethares_table_sum(hz, amp, product, cutoff, values, u_scale):
+    u_steps = values.shape[1]
+    total = 0.0
+    n = len(hz)
+    for i in range(n - 1):
+        for j in range(i + 1, n):
+            distance = abs(hz[i] - hz[j])
+            low_hz = min(hz[i], hz[j])
+            u = distance / (sethares_s1 * low_hz + sethares_s2)
+            if u * u_scale >= u_steps - 1 or (cutoff and sethares_cut(hz[i], hz[j], distance)):
+                continue
+            total += volume_scalar(amp[i], amp[j], product) * table_lookup(values, 0.0, 0.0, u_scale, low_hz, u)
+    return total
+
+# Tabulated PARNCUTT roughness (unnormalized) or PARNCUTT_BELL overlap.
+# Pairs whose lower frequency is off the grid (below min_hz or above
+# max_hz) are assessed exactly; pairs on it past the last distance are zero.
+@jit
+def parncutt_table_sum(hz, amp, bell, values, min_hz, max_hz, hz_scale, u_scale):
+    a = 0.25
+    K = 1.19614
+    u_steps = values.shape[1]
+    log_hz0 = math.log2(min_hz)
+    total = 0.0
+    n = len(hz)
+    for i in range(n - 1):
+        for j in range(i + 1, n):
+            difference = abs(hz[i] - hz[j])
+            low_hz = min(hz[i], hz[j])
+            u = difference / (sethares_s1 * low_hz + sethares_s2)
+            off_grid = low_hz < min_hz or low_hz > max_hz
+            if u * u_scale >= u_steps - 1 and not off_grid:
+                continue
+            if off_grid:
+                distance = difference / cbw_hutchinson_scalar((hz[i] + hz[j]) / 2)
+                if bell:
+                    shape = math.exp(-(distance ** 2) / (a ** 3 / K)) if distance < 1.2 else 0.0
+                else:
+                    shape = ((math.e / a) * distance * math.exp(-distance / a)) ** 2 if distance <= 1.2 else 0.0
+            else:
+                shape = table_lookup(values, log_hz0, hz_scale, u_scale, low_hz, u)
+            if bell:
+                total += amp[i] * amp[j] / (amp[i] * amp[i] + amp[j] * amp[j]) * shape
+            else:
+                total += amp[i] * amp[j] * shape
+    return total
+
+# Sum of a tabulated model over all pairs of (hz, amp)
+def compiled_table(hz, amp, table, options={}):
+    values = np.ascontiguousarray(table.values, dtype=float)
+    u_scale = 1 / (table.u[1] - table.u[0])
+    if table.function_type in ['SETHARES', 'SETHARES_BELL']:
+        product = options.get('amp_type', 'MIN') in ['PROD', 'PRODUCT']
+        if table.function_type == 'SETHARES' and options.get('original', False) == True:
+            product = False
+        return sethares_table_sum(hz, amp, product, options.get('cutoff', False) == True, values, u_scale)
+
+    return parncutt_table_sum(hz, amp, table.function_type == 'PARNCUTT_BELL', values,
+        np.exp2(table.log_hz[0]), np.exp2(table.log_hz[-1]), 1 / (table.log_hz[1] - table.log_hz[0]), u_scale)
+
+############
+# DISPATCH #
+############
+
+# Whether the compiled backend can serve these options: it only returns the
+# total, so anything that needs the individual pairs (partials, pruning,
+# caches) is left to the NumPy backend
+def compiled_supported(options={}) -> bool:
+    return (numba_available
+        and options.get('show_partials', False) != True
+        and options.get('show_error', False) != True
+        and options.get('cbw_window', None) is None
+        and options.get('cache', None) is None)
+
+# Sum of a model over all pairs of (hz, amp), before any normalization
+@timed('compiled_kernels')
+def compiled_roughness(hz, amp, function_type: str, options={}):
+    hz = np.ascontiguousarray(hz, dtype=float)
+    amp = np.ascontiguousarray(amp, dtype=float)
+    if function_type.upper() == 'HELMHOLTZ':
+        count('pairs_evaluated', len(hz) * len(options['ref']))
+    else:
+        count('pairs_evaluated', len(hz) * (len(hz) - 1) // 2)
+    if options.get('kernel_table', None) is not None:
+        return compiled_table(hz, amp, options['kernel_table'], options)
+    amp_type = options.get('amp_type', 'MIN')
+    product = amp_type in ['PROD', 'PRODUCT']
+
+    if function_type.upper() == 'SETHARES':
+        if options.get('original', False) == True:
+            product = False
+        return sethares_roughness_sum(hz, amp, product, options.get('cutoff', False) == True)
+    elif function_type.upper() == 'CBW':
+        return cbw_roughness_sum(hz, amp, product)
+    elif function_type.upper() == 'PARNCUTT':
+        return parncutt_roughness_sum(hz, amp)
+    elif function_type.upper() == 'HELMHOLTZ':
+        return helmholtz_roughness_sum(hz, np.ascontiguousarray(options['ref'], dtype=float))
+    else:
+        raise ValueError(f'Invalid assessment function type: {function_type.upper()}')
+
+@timed('compiled_kernels')
+def compiled_overlap(hz, amp, function_type: str, options={}):
+    hz = np.ascontiguousarray(hz, dtype=float)
+    amp = np.ascontiguousarray(amp, dtype=float)
+    count('pairs_evaluated', len(hz) * (len(hz) - 1) // 2)
+    if options.get('kernel_table', None) is not None:
+        return compiled_table(hz, amp, options['kernel_table'], options)
+    product = options.get('amp_type', 'MIN') in ['PROD', 'PRODUCT']
+
+    if function_type.upper() == 'SETHARES_BELL':
+        return sethares_bell_overlap_sum(hz, amp, product, float(options.get('K', -2.374)),
+            options.get('cutoff', False) == True)
+    elif function_type.upper() == 'PARNCUTT_BELL':
+        return parncutt_bell_overlap_sum(hz, amp)
+    elif function_type.upper() == 'CBW':
+        return cbw_overlap_sum(hz, amp, product)
+    elif function_type.upper() == 'COS':
+        return cos_overlap_sum(hz, amp, product)
+    else:
+        raise ValueError(f'Invalid assessment function type: {function_type.upper()}')
@@ -1,7 +1,10 @@
 import numpy as np
 from hearing_models import cbw_volk, cbw_hutchinson
-from pair_constants import SETHARES_CONSTANTS as sc, AUDITORY_CONSTANTS as ac, pair_volume, pair_distance
+from pair_constants import SETHARES_CONSTANTS as sc, AUDITORY_CONSTANTS as ac, pair_volume, pair_volume_array, pair_distance
 from chord_utils import MergedSpectrum
+from pair_utils import window_hz, window_pairs, window_error_bound, PairGeometry
+from pair_cache import cached_assess
+from profiling import timed, count
 
 # Returns overlap contribution of two partials, based on an indicator
 # function on the overlap zone, scaled to the amplitude of the partial.
@@ -49,7 +52,7 @@ def sethares_bell_overlap_pair(x_hz, ref_hz, v_x, v_ref, options={
     # function at 1.2 CBW, which prevents too-remote partials from
     # contributing to the final score.
     if options['cutoff'] == True:
-        cbw_limit = 1.2 * cbw_volk(max[x_hz, ref_hz]) / 2
+        cbw_limit = 1.2 * cbw_volk(max([x_hz, ref_hz])) / 2
         if distance < ac['slow_beat_limit'] or distance >= cbw_limit:
             v12 = 0
 
@@ -82,47 +85,239 @@ def parncutt_bell_overlap_pair(x_hz, ref_hz, v_x, v_ref, options={}):
     else:
         return 0
 
+################
+# ARRAY MODELS #
+################
+
+# Array-native versions of the pairwise models above. Each takes arrays of
+# frequencies and amplitudes (of any broadcastable shape) and returns the
+# elementwise pair overlap.
+
+def cbw_overlap_array(x_hz, ref_hz, v_x, v_ref, options={
+    'amp_type': 'MIN'
+}):
+    return cbw_overlap_geometry(PairGeometry(x_hz, ref_hz, v_x, v_ref), options)
+
+def cos_overlap_array(x_hz, ref_hz, v_x, v_ref, options={
+    'amp_type': 'MIN'
+}):
+    return cos_overlap_geometry(PairGeometry(x_hz, ref_hz, v_x, v_ref), options)
+
+def sethares_bell_overlap_array(x_hz, ref_hz, v_x, v_ref, options={
+    'amp_type': 'MIN',
+    'K': -2.374,
+    'cutoff': False
+}):
+    return sethares_bell_overlap_geometry(PairGeometry(x_hz, ref_hz, v_x, v_ref), options)
+
+def parncutt_bell_overlap_array(x_hz, ref_hz, v_x, v_ref, options={}):
+    return parncutt_bell_overlap_geometry(PairGeometry(x_hz, ref_hz, v_x, v_ref), options)
+
+# The same models in terms of a pair_utils.PairGeometry, so that several
+# models assessed on the same pairs share its distances, CBWs and amplitude
+# terms (see chord_scoring.score_spectrum).
+
+def cbw_overlap_geometry(geometry, options={}):
+    v12 = geometry.volume(options.get('amp_type', 'MIN'))
+
+    return np.where(geometry.distance < ac['slow_beat_limit'], v12, 0)
+
+def cos_overlap_geometry(geometry, options={}):
+    flat = cbw_overlap_geometry(geometry, options)
+
+    return flat * 0.5 * (1 + np.cos(np.pi * geometry.distance/ac['slow_beat_limit']))
+
+def sethares_bell_overlap_geometry(geometry, options={}):
+    s = geometry.sethares_s
+    v12 = geometry.volume(options.get('amp_type', 'MIN'))
+    K = options.get('K', -2.374)
+
+    distance = geometry.distance
+
+    if options.get('cutoff', False) == True:
+        cbw_limit = 1.2 * geometry.cbw_volk_max / 2
+        v12 = np.where((distance < ac['slow_beat_limit']) | (distance >= cbw_limit), 0, v12)
+
+    return v12 * np.exp(K * sc['b'] * s * distance)
+
+def parncutt_bell_overlap_geometry(geometry, options={}):
+    a = 0.25
+    i_factor = 2
+    K = 1.19614
+
+    distance = geometry.distance / geometry.cbw_hutchinson_mean
+
+    amp = geometry.amp_product / geometry.amp_square_sum
+
+    return np.where(distance < 1.2, amp * (np.exp(- (distance ** i_factor)/(a ** 3 / K))), 0)
+
+# Upper bounds ("envelopes") of the array models, used to bound the error of
+# pruning distant pairs (see pair_utils). Each bounds the value of any pair
+# whose lower partial has frequency low_hz and amplitude v_x, whose upper
+# partial has amplitude at most v_max, and whose frequency difference is at
+# least `distance`.
+
+def cbw_overlap_envelope(low_hz, distance, v_x, v_max, options={}):
+    v12 = pair_volume_array(v_x, v_max, options.get('amp_type', 'MIN'))
+
+    return np.where(distance >= ac['slow_beat_limit'], 0, v12)
+
+def cos_overlap_envelope(low_hz, distance, v_x, v_max, options={}):
+    # The cosine bump never exceeds the indicator function
+    return cbw_overlap_envelope(low_hz, distance, v_x, v_max, options)
+
+def sethares_bell_overlap_envelope(low_hz, distance, v_x, v_max, options={}):
+    s = sc['s_star'] / (sc['s1'] * low_hz + sc['s2'])
+    v12 = pair_volume_array(v_x, v_max, options.get('amp_type', 'MIN'))
+    K = options.get('K', -2.374)
+
+    # The bell only decays with distance for negative K
+    if K >= 0:
+        return np.full(np.shape(v12), np.inf)
+
+    return v12 * np.exp(K * sc['b'] * s * distance)
+
+def parncutt_bell_overlap_envelope(low_hz, distance, v_x, v_max, options={}):
+    a = 0.25
+    i_factor = 2
+    K = 1.19614
+
+    # The CBW-normalized distance grows with the frequency difference
+    distance = distance / cbw_hutchinson(low_hz + distance / 2)
+
+    # v_x * v / (v_x^2 + v^2) increases with v up to v = v_x, where it is 1/2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.fmin(np.divide(v_max, v_x), 1)
+    amp = ratio / (1 + ratio * ratio)
+
+    return np.where(distance < 1.2, amp * (np.exp(- (distance ** i_factor)/(a ** 3 / K))), 0)
+
+# Transposition types that leave each model's pair values unchanged, i.e.
+# that preserve everything the model depends on. HZ_SHIFT preserves
+# frequency differences; ST_DIFF and SCALE_FACTOR preserve frequency ratios.
+# The indicator and cosine models depend only on the frequency difference.
+OVERLAP_INVARIANT_TRANSPOSITIONS = {
+    'SETHARES_BELL': [],
+    'PARNCUTT_BELL': [],
+    'CBW': ['HZ_SHIFT'],
+    'COS': ['HZ_SHIFT']
+}
+
 ###################
 # SUMMATION MODEL #
 ###################
 
 # The following function is based on Sethares' 1993 model, adapted for summing
 # pairwise overlap functions.
+@timed('overlap_complex')
 def overlap_complex(
     spectrum: MergedSpectrum,
     function_type: str = 'SETHARES_BELL',
     overlap_limit: float = 0.1,
     *,
+    backend: str = 'NUMPY',
     options={
         'amp_type': 'MIN',
         'cutoff': False,
         'original': False,
-        'show_partials': False
+        'show_partials': False,
+        'show_error': False,
+        'cbw_window': None
     }
 ):
-    n = len(spectrum.partials['hz'])
+    n = len(spectrum.hz)
     overlap_partials = []
     overlap_vals = np.zeros((n, n))
 
     if function_type.upper() == 'SETHARES_BELL':
         pair_assess = sethares_bell_overlap_pair
+        array_assess = sethares_bell_overlap_array
+        array_envelope = sethares_bell_overlap_envelope
     elif function_type.upper() == 'PARNCUTT_BELL':
         pair_assess = parncutt_bell_overlap_pair
+        array_assess = parncutt_bell_overlap_array
+        array_envelope = parncutt_bell_overlap_envelope
     elif function_type.upper() == 'CBW':
         pair_assess = cbw_overlap_pair
+        array_assess = cbw_overlap_array
+        array_envelope = cbw_overlap_envelope
     elif function_type.upper() == 'COS':
         pair_assess = cos_overlap_pair
+        array_assess = cos_overlap_array
+        array_envelope = cos_overlap_envelope
     else:
         raise ValueError(f'Invalid assessment function type: {function_type.upper()}')
 
+    # With options['kernel_table'] (a kernel_tables.KernelTable built for
+    # this model), pairs are assessed from the table instead. Only the
+    # compiled backend is faster for it; the NumPy backend gives the same
+    # results.
+    if options.get('kernel_table', None) is not None:
+        options['kernel_table'].check('OVERLAP', function_type, options)
+        array_assess = options['kernel_table'].assess
+
+    # Compiled backend: one fused loop over all pairs (see numba_kernels).
+    # Falls back to the NumPy backend when numba is not installed or the
+    # options need the individual pairs. numba is only imported once this
+    # backend is first used.
+    if backend.upper() == 'NUMBA':
+        from numba_kernels import compiled_overlap, compiled_supported
+        if compiled_supported(options):
+            return compiled_overlap(spectrum.hz, spectrum.amp, function_type, options)
+        backend = 'NUMPY'
+
+    # NumPy backend: assess the whole upper triangle of the n x n pair grid
+    # at once. With options['cbw_window'] set, only pairs closer than that
+    # many critical bandwidths are assessed, and options['show_error']
+    # reports an upper bound on the overlap of the pairs left out.
+    if backend.upper() == 'NUMPY':
+        hz = np.asarray(spectrum.hz, dtype=float)
+        amp = np.asarray(spectrum.amp, dtype=float)
+        error_bound = 0.0
+        pairs_pruned = 0
+
+        if options.get('cbw_window', None) is None:
+            i, j = np.triu_indices(n, 1)
+        else:
+            # Spectra are normally sorted by hz already; if not, prune in
+            # sorted order and map the indices back.
+            order = np.argsort(hz, kind='stable')
+            widths = window_hz(hz[order], options['cbw_window'])
+            i, j, ends = window_pairs(hz[order], widths)
+            error_bound = window_error_bound(hz[order], amp[order], widths, ends, array_envelope, options)
+            i, j = np.minimum(order[i], order[j]), np.maximum(order[i], order[j])
+            pairs_pruned = n * (n - 1) // 2 - len(i)
+            count('pairs_pruned', pairs_pruned)
+        overlap_vals = cached_assess(array_assess, hz[i], hz[j], amp[i], amp[j], options)
+
+        if options.get('show_partials', False) == True:
+            above_limit = overlap_vals > overlap_limit
+            result = {
+                'overlap': np.sum(overlap_vals),
+                'overlap_partials': list(zip(i[above_limit].tolist(), j[above_limit].tolist()))
+            }
+        elif options.get('show_error', False) == True:
+            result = {'overlap': np.sum(overlap_vals)}
+        else:
+            return np.sum(overlap_vals)
+
+        if options.get('show_error', False) == True:
+            result['error_bound'] = error_bound
+            result['pairs_assessed'] = len(overlap_vals)
+            result['pairs_pruned'] = pairs_pruned
+
+        return result
+    elif backend.upper() != 'PYTHON':
+        raise ValueError(f'Invalid backend: {backend.upper()}')
+
     # Assess all pairs for overlap
     for i in range(n - 1):
         for j in range(i + 1, n):
             overlap_vals[i][j] = pair_assess(
-                spectrum.partials['hz'][i],
-                spectrum.partials['hz'][j],
-                spectrum.partials['amp'][i],
-                spectrum.partials['amp'][j],
+                spectrum.hz[i],
+                spectrum.hz[j],
+                spectrum.amp[i],
+                spectrum.amp[j],
                 options=options
             )
         if options['show_partials'] == True and overlap_vals[i][j] > overlap_limit:
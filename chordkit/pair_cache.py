@@ -0,0 +1,160 @@
+from collections import OrderedDict
+import hashlib
+import threading
+
+import numpy as np
+from profiling import timed, count, profile_active
+
+# This file contains an opt-in memoization layer for the pairwise models.
+# A PairCache is passed as options['cache'] to roughness_complex,
+# overlap_complex, the sweeps in chord_sweeps, or the curve functions in
+# chord_plots (which pass their options through), and the same cache may be
+# shared by all of them.
+#
+# The array models are cheap per pair but are called on whole blocks of
+# pairs, so the cache memoizes blocks rather than single pairs: a block is
+# keyed by the model, the options the models read, and the contents of its
+# frequency and amplitude arrays. Blocks that recur, e.g. the ref x ref block
+# of every curve with the same reference chord, or the same chord scored in
+# repeated corpus runs, are then assessed only once. Optionally, frequencies
+# are first snapped to a grid of `cents` cents, so that nearly equal blocks
+# share an entry (at the cost of evaluating the models at the snapped
+# frequencies). The cache holds at most `max_bytes` of results and evicts the
+# least recently used blocks first.
+#
+# A cache may be shared by several threads (e.g. chord_sweeps.threaded_sweep):
+# lookups and insertions are locked, and blocks are assessed outside the
+# lock. A cache sent to another process (e.g. in options for a process pool)
+# arrives there as a copy.
+
+# Number of pairs in a block
+def pair_count(*arrays) -> int:
+    return int(np.prod(np.broadcast_shapes(*[np.shape(array) for array in arrays])))
+
+# Options that change the value of a pairwise model, and so belong in the key
+kernel_option_keys = ['amp_type', 'original', 'cutoff', 'K']
+
+class PairCache:
+    def __init__(self, max_bytes: int = 64 * 2 ** 20, cents: float = None):
+        self.max_bytes = max_bytes
+        self.cents = cents
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    # Locks cannot be pickled; a copy gets its own
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    # Frequencies snapped to the cents grid (unchanged if cents is None).
+    # Non-positive frequencies (e.g. from an HZ_SHIFT transposition) have no
+    # place on the grid and are passed through unchanged.
+    def quantize(self, hz):
+        hz = np.asarray(hz, dtype=float)
+        if self.cents is None:
+            return hz
+
+        positive = hz > 0
+        steps = np.round(1200 * np.log2(np.where(positive, hz, 1.0)) / self.cents)
+        return np.where(positive, np.exp2(steps * self.cents / 1200), hz)
+
+    # Key of one block: the model (an array function, or the assess method
+    # of a kernel table), its options, the (quantized) arrays and the
+    # reduction applied to the result
+    def key(self, array_assess, arrays, options, axis):
+        digest = hashlib.blake2b(digest_size=16)
+        for array in arrays:
+            array = np.ascontiguousarray(array, dtype=float)
+            digest.update(str(np.shape(array)).encode())
+            digest.update(array.tobytes())
+
+        option_items = tuple((k, options[k]) for k in kernel_option_keys if k in options)
+
+        return (array_assess, option_items, axis, digest.digest())
+
+    # Value of array_assess on a block of pairs, summed over `axis` if given
+    # (axis='ALL' sums to a scalar; None returns the elementwise values).
+    # Stored arrays are read-only, since they may be returned to several
+    # callers; sums to a scalar come back as NumPy scalars.
+    def assess(self, array_assess, x_hz, ref_hz, v_x, v_ref, options={}, axis=None):
+        x_hz = self.quantize(x_hz)
+        ref_hz = self.quantize(ref_hz)
+        key = self.key(array_assess, [x_hz, ref_hz, v_x, v_ref], options, axis)
+
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                count('pair_cache_hits', 1)
+                return self.entries[key][()]
+            self.misses += 1
+        count('pair_cache_misses', 1)
+        if profile_active():
+            count('pairs_evaluated', pair_count(x_hz, ref_hz, v_x, v_ref))
+
+        value = array_assess(x_hz, ref_hz, v_x, v_ref, options=options)
+        if axis == 'ALL':
+            value = np.sum(value)
+        elif axis is not None:
+            value = np.sum(value, axis=axis)
+        value = np.asarray(value)
+        value.setflags(write=False)
+
+        with self.lock:
+            if value.nbytes <= self.max_bytes and key not in self.entries:
+                self.entries[key] = value
+                self.size += value.nbytes
+                while self.size > self.max_bytes:
+                    (_, evicted) = self.entries.popitem(last=False)
+                    self.size -= evicted.nbytes
+                    self.evictions += 1
+
+        return value[()]
+
+    # Hit/miss counters and current size
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups > 0 else 0.0,
+            'evictions': self.evictions,
+            'entries': len(self.entries),
+            'bytes': self.size
+        }
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+# Assess a block of pairs through options['cache'] if one is given, and
+# directly otherwise
+@timed('pair_kernels')
+def cached_assess(array_assess, x_hz, ref_hz, v_x, v_ref, options={}, axis=None):
+    cache = options.get('cache', None)
+    if cache is not None:
+        return cache.assess(array_assess, x_hz, ref_hz, v_x, v_ref, options, axis)
+
+    if profile_active():
+        count('pairs_evaluated', pair_count(x_hz, ref_hz, v_x, v_ref))
+
+    value = array_assess(x_hz, ref_hz, v_x, v_ref, options=options)
+    if axis == 'ALL':
+        return np.sum(value)
+    elif axis is not None:
+        return np.sum(value, axis=axis)
+
+    return value
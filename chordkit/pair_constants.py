@@ -1,4 +1,5 @@
 # Constants and functions shared between pairwise function assessing overlap and roughness of partials
+import numpy as np
 
 # Parameters fit by Sethares 1993.
 SETHARES_CONSTANTS = {
@@ -25,5 +26,12 @@ def pair_volume(v_x, v_ref, amp_type='MIN'):
     else:
         return min([v_x, v_ref])
 
+# Volume scale, elementwise over arrays of partial amplitudes
+def pair_volume_array(v_x, v_ref, amp_type='MIN'):
+    if amp_type in ['PROD', 'PRODUCT']:
+        return np.multiply(v_x, v_ref)
+    else:
+        return np.minimum(v_x, v_ref)
+
 def pair_distance(a_hz, b_hz):
     return abs(a_hz - b_hz)
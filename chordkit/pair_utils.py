@@ -0,0 +1,118 @@
+from functools import cached_property
+
+import numpy as np
+from hearing_models import cbw_volk, cbw_hutchinson
+from pair_constants import SETHARES_CONSTANTS as sc, pair_distance
+
+# Selection of the partial pairs assessed by the summation models, and the
+# pair quantities the models share, used by roughness_complex,
+# overlap_complex and the sweep and scoring engines.
+
+# Every pairwise model is (effectively) zero once two partials are far enough
+# apart relative to the critical bandwidth. Pruning assesses only the pairs
+# (i, j), i < j, with hz[j] - hz[i] < cbw_window * CBW(hz[i]), using the
+# Voelk 2015 critical bandwidth. For a spectrum sorted by hz, the pairs of
+# partial i are the contiguous run i + 1 .. ends[i] - 1, found by binary
+# search, so the cost is O(n log n) plus the number of pairs kept.
+
+# Width (Hz) of the pruning window above each partial
+def window_hz(hz: np.ndarray, cbw_window: float) -> np.ndarray:
+    return cbw_window * cbw_volk(hz)
+
+# Pairs within the window of a spectrum sorted by hz. Returns the indices
+# (i, j) of the kept pairs and, for each partial i, the end of its window:
+# pairs (i, j) with j >= ends[i] are pruned.
+def window_pairs(hz: np.ndarray, widths: np.ndarray):
+    n = len(hz)
+    starts = np.arange(n)
+    ends = np.maximum(np.searchsorted(hz, hz + widths, side='left'), starts + 1)
+    counts = ends - starts - 1
+
+    i = np.repeat(starts, counts)
+    offsets = np.arange(np.sum(counts)) - np.repeat(np.cumsum(counts) - counts, counts)
+    j = i + 1 + offsets
+
+    return i, j, ends
+
+# Upper bound on the total contribution of the pruned pairs of a spectrum
+# sorted by hz. `envelope(low_hz, distance, v_x, v_max, options)` must bound
+# the value of any single pair whose lower partial has frequency low_hz and
+# amplitude v_x, whose upper partial has amplitude at most v_max, and whose
+# frequency difference is at least `distance`.
+def window_error_bound(hz, amp, widths, ends, envelope, options={}) -> float:
+    n = len(hz)
+    pruned = n - ends
+    has_pruned = pruned > 0
+    if not np.any(has_pruned):
+        return 0.0
+
+    # Largest amplitude among partials ends[i] .. n - 1
+    suffix_max = np.maximum.accumulate(amp[::-1])[::-1]
+    v_max = suffix_max[ends[has_pruned]]
+
+    return float(np.sum(
+        pruned[has_pruned] * envelope(hz[has_pruned], widths[has_pruned], amp[has_pruned], v_max, options)
+    ))
+
+# Quantities of a set of partial pairs that the pairwise models share:
+# frequency distance, minimum/mean/maximum frequency, the critical bandwidths
+# the models use, and amplitude minima and products. Each is computed on
+# first use and then reused, so several models can be assessed on the same
+# pairs without recomputing them. Inputs may be arrays of any broadcastable
+# shape.
+class PairGeometry:
+    def __init__(self, x_hz, ref_hz, v_x, v_ref):
+        self.x_hz = x_hz
+        self.ref_hz = ref_hz
+        self.v_x = v_x
+        self.v_ref = v_ref
+
+    @cached_property
+    def distance(self):
+        return pair_distance(self.x_hz, self.ref_hz)
+
+    @cached_property
+    def min_hz(self):
+        return np.minimum(self.x_hz, self.ref_hz)
+
+    @cached_property
+    def max_hz(self):
+        return np.maximum(self.x_hz, self.ref_hz)
+
+    @cached_property
+    def mean_hz(self):
+        return (self.x_hz + self.ref_hz) / 2
+
+    # Voelk 2015 CBW of the upper partial
+    @cached_property
+    def cbw_volk_max(self):
+        return cbw_volk(self.max_hz)
+
+    # Hutchinson and Knopoff 1978 CBW of the mean frequency
+    @cached_property
+    def cbw_hutchinson_mean(self):
+        return cbw_hutchinson(self.mean_hz)
+
+    # Sethares' distance scaling, s = s* / (s1 * min(f) + s2)
+    @cached_property
+    def sethares_s(self):
+        return sc['s_star'] / (sc['s1'] * self.min_hz + sc['s2'])
+
+    @cached_property
+    def amp_min(self):
+        return np.minimum(self.v_x, self.v_ref)
+
+    @cached_property
+    def amp_product(self):
+        return np.multiply(self.v_x, self.v_ref)
+
+    @cached_property
+    def amp_square_sum(self):
+        return np.multiply(self.v_x, self.v_x) + np.multiply(self.v_ref, self.v_ref)
+
+    # Volume scale, as in pair_constants.pair_volume
+    def volume(self, amp_type='MIN'):
+        if amp_type in ['PROD', 'PRODUCT']:
+            return self.amp_product
+        else:
+            return self.amp_min
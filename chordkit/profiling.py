@@ -0,0 +1,160 @@
+from contextlib import contextmanager
+import functools
+import json
+import marshal
+import pstats
+import threading
+import time
+
+# This file contains opt-in instrumentation of the hot paths: chord
+# construction and transposition, merging and sorting of spectra, the
+# summation models, the sweeps and the pairwise kernels. Within
+#
+#   with profiling() as profile:
+#       roughness_curve(...)
+#
+# every instrumented stage records its call count and wall time, and the
+# code records counters: pairs evaluated by the kernels and pairs pruned by
+# cbw_window, and hits and misses of any PairCache or SpectrumCache.
+# Afterwards, profile.to_dict() / to_json() export the data, and the profile
+# can be read by pstats (pstats.Stats(profile), print_stats(), or
+# dump_stats() to a file for any cProfile viewer), with one entry per stage.
+#
+# Stages are timed by wall clock. Each stage's own time excludes the stages
+# it calls; its cumulative time includes them. Threads started inside the
+# block record into the same profile.
+#
+# Outside of a profiling() block, an instrumented function costs one extra
+# call and a global lookup, and counters are not computed at all.
+
+# The profile being recorded, if any
+active_profile = None
+
+class Profile:
+    def __init__(self):
+        # name -> [calls, own seconds, cumulative seconds]
+        self.stages = {}
+        # (caller, name) -> [calls, own seconds, cumulative seconds]
+        self.calls = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    # Stack of the stages running in this thread, as [name, start, seconds
+    # spent in called stages]
+    def stack(self) -> list:
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def enter(self, name: str):
+        self.stack().append([name, time.perf_counter(), 0.0])
+
+    def exit(self):
+        stack = self.stack()
+        (name, start, inner) = stack.pop()
+        elapsed = time.perf_counter() - start
+        caller = stack[-1][0] if stack else None
+        if stack:
+            stack[-1][2] += elapsed
+        # A stage called (indirectly) by itself is only counted once in its
+        # cumulative time
+        cumulative = 0.0 if any(frame[0] == name for frame in stack) else elapsed
+
+        with self.lock:
+            for (key, table) in [(name, self.stages), ((caller, name), self.calls)]:
+                record = table.setdefault(key, [0, 0.0, 0.0])
+                record[0] += 1
+                record[1] += elapsed - inner
+                record[2] += cumulative
+
+    def count(self, name: str, value):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_dict(self) -> dict:
+        return {
+            'stages': {
+                name: {'calls': calls, 'own_seconds': own, 'seconds': cumulative}
+                for (name, (calls, own, cumulative)) in self.stages.items()
+            },
+            'counters': dict(self.counters)
+        }
+
+    # JSON export, written to path if one is given
+    def to_json(self, path: str = None) -> str:
+        text = json.dumps(self.to_dict(), indent=2, sort_keys=True)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
+
+    # pstats interface: stages as functions ('chordkit', 0, name)
+    def create_stats(self):
+        self.stats = {}
+        for (name, (calls, own, cumulative)) in self.stages.items():
+            callers = {
+                ('chordkit', 0, caller): (n, n, caller_own, caller_cumulative)
+                for ((caller, callee), (n, caller_own, caller_cumulative)) in self.calls.items()
+                if callee == name and caller is not None
+            }
+            self.stats[('chordkit', 0, name)] = (calls, calls, own, cumulative, callers)
+
+    def print_stats(self, sort='cumulative'):
+        pstats.Stats(self).sort_stats(sort).print_stats()
+
+    # Write the stats in the format of cProfile.Profile.dump_stats
+    def dump_stats(self, path: str):
+        self.create_stats()
+        with open(path, 'wb') as f:
+            marshal.dump(self.stats, f)
+
+# Record a profile of everything run inside the block
+@contextmanager
+def profiling(profile: Profile = None):
+    global active_profile
+    profile = Profile() if profile is None else profile
+    previous = active_profile
+    active_profile = profile
+    try:
+        yield profile
+    finally:
+        active_profile = previous
+
+def profile_active() -> bool:
+    return active_profile is not None
+
+# Add to a counter of the active profile, if any
+def count(name: str, value):
+    profile = active_profile
+    if profile is not None:
+        profile.count(name, value)
+
+# Decorator recording each call of a function as a stage
+def timed(name: str):
+    def decorate(function):
+        @functools.wraps(function)
+        def timed_function(*args, **kwargs):
+            profile = active_profile
+            if profile is None:
+                return function(*args, **kwargs)
+            profile.enter(name)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                profile.exit()
+        return timed_function
+    return decorate
+
+# Record a block of code as a stage
+@contextmanager
+def stage(name: str):
+    profile = active_profile
+    if profile is None:
+        yield
+        return
+    profile.enter(name)
+    try:
+        yield
+    finally:
+        profile.exit()
@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sys
+import threading
+
+import numpy as np
+from chord_utils import CompactSpectrum, ChordSpectrum, Timbre, TransposeDomain
+
+# This file contains an on-disk store for computed results (curves, batch
+# scores), so that later runs and plots load them instead of recomputing.
+#
+# Results are keyed by a hash of everything that determines them: chords
+# (struct, struct_type, timbre, fund_hz and current partials), transpose
+# domains, function_type and options. Each result is a .npy file, loaded
+# memory-mapped and copy-on-write: nothing is read until it is used, and
+# writing into a loaded array never changes the file. Tables are stored
+# column by column, one .npy file per column. A .json file next to each
+# result records the inputs it was computed from.
+#
+# Options that do not change results (e.g. a PairCache) are left out of the
+# key.
+
+unkeyed_options = ['cache']
+
+# JSON-serializable description of a result input, with arrays replaced by
+# their shape, dtype and a hash of their contents
+def canonical(value):
+    # A value can only be a pandas object if pandas has been imported
+    pd = sys.modules.get('pandas')
+    if isinstance(value, np.ndarray):
+        array = np.ascontiguousarray(value)
+        return {
+            'array': hashlib.sha256(array.tobytes()).hexdigest(),
+            'dtype': str(array.dtype),
+            'shape': list(array.shape)
+        }
+    elif pd is not None and isinstance(value, (pd.Series, pd.Index)):
+        return canonical(value.to_numpy())
+    elif pd is not None and isinstance(value, pd.DataFrame):
+        return {'frame': canonical(value.to_numpy()), 'columns': canonical(list(value.columns))}
+    elif isinstance(value, ChordSpectrum):
+        return {
+            'chord_spectrum': canonical(value.struct),
+            'struct_type': value.struct_type,
+            'timbre': canonical(value.timbre),
+            'fund_hz': canonical(value.fund_hz),
+            'hz': canonical(value.hz),
+            'amp': canonical(value.amp)
+        }
+    elif isinstance(value, Timbre):
+        return {'timbre': canonical(value.fund_multiple), 'amp': canonical(value.amp)}
+    elif isinstance(value, CompactSpectrum):
+        return {'spectrum': canonical(value.hz), 'amp': canonical(value.amp)}
+    elif isinstance(value, TransposeDomain):
+        return {'transpose_domain': canonical(value.domain), 'transpose_type': value.transpose_type.upper()}
+    elif isinstance(value, dict):
+        return {str(k): canonical(v) for (k, v) in value.items() if k not in unkeyed_options}
+    elif isinstance(value, (list, tuple, range)):
+        return [canonical(v) for v in value]
+    elif isinstance(value, (np.integer, np.floating, np.bool_)):
+        return value.item()
+    elif value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    elif hasattr(value, '__dict__'):
+        # Other objects (e.g. a KernelTable) by their type and attributes
+        return {'object': type(value).__name__, 'attributes': canonical(vars(value))}
+    else:
+        raise ValueError(f'Cannot key a result on a {type(value).__name__}')
+
+class ResultStore:
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    # Key of a result: its name (e.g. 'roughness_curve') and a hash of its
+    # inputs
+    def key(self, name: str, *inputs) -> str:
+        description = json.dumps(canonical(list(inputs)), sort_keys=True)
+        return f'{name}-{hashlib.sha256(description.encode()).hexdigest()[:32]}'
+
+    def path(self, key: str, column: str = None) -> str:
+        if column is None:
+            return os.path.join(self.directory, key + '.npy')
+        return os.path.join(self.directory, key, column + '.npy')
+
+    # Write an array (atomically, so that an interrupted run leaves no
+    # partial result, and through a temporary file per process and thread,
+    # so that concurrent writers of the same result do not collide) and a
+    # description of its inputs
+    def save_array(self, path: str, array):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f'{path}.{os.getpid()}-{threading.get_ident()}.tmp.npy'
+        np.save(temp_path, np.asarray(array))
+        os.replace(temp_path, path)
+
+    # Write a JSON file the same way
+    def save_json(self, path: str, value):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f'{path}.{os.getpid()}-{threading.get_ident()}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(value, f, sort_keys=True)
+        os.replace(temp_path, path)
+
+    def save(self, key: str, array, inputs=None):
+        self.save_array(self.path(key), array)
+        if inputs is not None:
+            self.save_json(os.path.join(self.directory, key + '.json'), canonical(list(inputs)))
+
+    # Stored array, memory-mapped, or None if there is none
+    def load(self, key: str):
+        if not os.path.exists(self.path(key)):
+            return None
+        return np.load(self.path(key), mmap_mode='c')
+
+    # Tables are stored one column per file. The column list is written
+    # last and atomically, so a table is only found once all of its columns
+    # are, and a reader never sees a partial column list.
+    def save_frame(self, key: str, frame: pd.DataFrame):
+        os.makedirs(os.path.join(self.directory, key), exist_ok=True)
+        for column in frame.columns:
+            self.save_array(self.path(key, str(column)), frame[column].to_numpy())
+        self.save_json(os.path.join(self.directory, key, 'columns.json'),
+            {'columns': [str(column) for column in frame.columns]})
+
+    # Memory-mapped columns of a stored table, or None if there is none
+    def load_columns(self, key: str) -> dict:
+        columns_path = os.path.join(self.directory, key, 'columns.json')
+        if not os.path.exists(columns_path):
+            return None
+        with open(columns_path) as f:
+            columns = json.load(f)['columns']
+        return {column: np.load(self.path(key, column), mmap_mode='c') for column in columns}
+
+    def load_frame(self, key: str, start: int = 0) -> pd.DataFrame:
+        import pandas as pd
+        columns = self.load_columns(key)
+        if columns is None:
+            return None
+        length = len(next(iter(columns.values()))) if columns else 0
+        return pd.DataFrame(columns, index=pd.RangeIndex(start, start + length))
+
+    # Stored result for key, computing and storing it first if needed
+    def get_or_compute(self, key: str, compute, inputs=None):
+        result = self.load(key)
+        if result is None:
+            result = compute()
+            self.save(key, result, inputs)
+        return result
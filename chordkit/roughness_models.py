@@ -1,7 +1,10 @@
 import numpy as np
 from hearing_models import cbw_volk, cbw_hutchinson
-from pair_constants import SETHARES_CONSTANTS as sc, AUDITORY_CONSTANTS as ac, pair_volume, pair_distance
+from pair_constants import SETHARES_CONSTANTS as sc, AUDITORY_CONSTANTS as ac, pair_volume, pair_volume_array, pair_distance
 from chord_utils import MergedSpectrum, ChordSpectrum
+from pair_utils import window_hz, window_pairs, window_error_bound, PairGeometry
+from pair_cache import cached_assess
+from profiling import timed, count
 
 # This file contains both the individual pairwise models used for assessing the
 # roughness of partial pairs and the summing function that adds up all such
@@ -45,12 +48,13 @@ def sethares_roughness_pair(x_hz, ref_hz, v_x, v_ref, *, options = {
 }):
     s = sc['s_star'] / (sc['s1'] * min([x_hz, ref_hz]) + sc['s2'])
 
+    amp_type = options['amp_type']
     if options['original'] == True:
         # This line not based on the Sethares 1993 paper, but on the implementation
         # on his website, https://sethares.engr.wisc.edu/comprog.html
-        options['amp_type'] = 'MIN'
+        amp_type = 'MIN'
 
-    v12 = pair_volume(v_x, v_ref, options['amp_type'])
+    v12 = pair_volume(v_x, v_ref, amp_type)
 
     # Sethares' MATLAB implementation (but not the published paper)
     # scaling = 5
@@ -74,7 +78,7 @@ def sethares_roughness_pair(x_hz, ref_hz, v_x, v_ref, *, options = {
     # for larger intervals.)
     # Sethares' original does not use this cutoff.
     if options['cutoff'] == True:
-        cbw_limit = 1.2 * cbw_volk(max[x_hz, ref_hz]) / 2
+        cbw_limit = 1.2 * cbw_volk(max([x_hz, ref_hz])) / 2
         if distance < ac['slow_beat_limit'] or distance >= cbw_limit:
             v12 = 0
 
@@ -115,6 +119,139 @@ def parncutt_roughness_pair(x_hz, ref_hz, v_x, v_ref, options = {}):
     else:
         return 0
 
+################
+# ARRAY MODELS #
+################
+
+# Array-native versions of the pairwise models above. Each takes arrays of
+# frequencies and amplitudes (of any broadcastable shape) and returns the
+# elementwise pair roughness, so that all pairs of a spectrum can be assessed
+# with a handful of NumPy calls.
+
+def helmholtz_roughness_array(x_hz, ref_hz, *, x_p=1, options={}):
+    # Same constants as helmholtz_roughness_pair. Here ref_hz holds the
+    # reference partial(s) directly rather than an index into options['ref'].
+    bPrime1 = 1
+    bPrime2 = 1
+    beta = 0.3
+
+    delta = ((x_hz / ref_hz) - 1) / 2
+    theta = 15.0 / ref_hz
+
+    s = 4 * bPrime1 * bPrime2 * (beta ** 2) / (beta ** 2 + (2 * np.pi * delta) ** 2)
+
+    return s * ((2 * theta * delta * x_p) ** 2) / ((theta ** 2 + (x_p * delta) ** 2) ** 2)
+
+def sethares_roughness_array(x_hz, ref_hz, v_x, v_ref, *, options={
+    'original': False,
+    'amp_type': 'MIN',
+    'cutoff': False,
+}):
+    return sethares_roughness_geometry(PairGeometry(x_hz, ref_hz, v_x, v_ref), options)
+
+def cbw_roughness_array(x_hz, ref_hz, v_x, v_ref, options={ 'amp_type': 'MIN' }):
+    return cbw_roughness_geometry(PairGeometry(x_hz, ref_hz, v_x, v_ref), options)
+
+def parncutt_roughness_array(x_hz, ref_hz, v_x, v_ref, options = {}):
+    return parncutt_roughness_geometry(PairGeometry(x_hz, ref_hz, v_x, v_ref), options)
+
+# The same models in terms of a pair_utils.PairGeometry, so that several
+# models assessed on the same pairs share its distances, CBWs and amplitude
+# terms (see chord_scoring.score_spectrum).
+
+def sethares_roughness_geometry(geometry, options={}):
+    # As in sethares_roughness_pair, the original model always uses the
+    # minimum amplitude.
+    amp_type = options.get('amp_type', 'MIN')
+    if options.get('original', False) == True:
+        amp_type = 'MIN'
+
+    v12 = geometry.volume(amp_type)
+    scaling = 1
+
+    s = geometry.sethares_s
+    distance = geometry.distance
+
+    if options.get('cutoff', False) == True:
+        cbw_limit = 1.2 * geometry.cbw_volk_max / 2
+        v12 = np.where((distance < ac['slow_beat_limit']) | (distance >= cbw_limit), 0, v12)
+
+    return v12 * scaling * (np.exp(-sc['a'] * s * distance) - np.exp(-sc['b'] * s * distance))
+
+def cbw_roughness_geometry(geometry, options={}):
+    cbw_limit = geometry.cbw_volk_max / 2
+    distance = geometry.distance
+    v12 = geometry.volume(options.get('amp_type', 'MIN'))
+
+    return np.where((distance >= 15) & (distance < cbw_limit), v12, 0)
+
+def parncutt_roughness_geometry(geometry, options={}):
+    max_distance = 1.2
+    a = 0.25
+    i_factor = 2
+
+    distance = geometry.distance / geometry.cbw_hutchinson_mean
+
+    amp = geometry.amp_product
+
+    return np.where(
+        distance <= max_distance,
+        amp * (((np.exp(1)/a) * distance * np.exp(-distance / a)) ** i_factor),
+        0
+    )
+
+# Upper bounds ("envelopes") of the array models, used to bound the error of
+# pruning distant pairs (see pair_utils). Each bounds the value of any pair
+# whose lower partial has frequency low_hz and amplitude v_x, whose upper
+# partial has amplitude at most v_max, and whose frequency difference is at
+# least `distance`.
+
+def sethares_roughness_envelope(low_hz, distance, v_x, v_max, options={}):
+    s = sc['s_star'] / (sc['s1'] * low_hz + sc['s2'])
+
+    amp_type = options.get('amp_type', 'MIN')
+    if options.get('original', False) == True:
+        amp_type = 'MIN'
+
+    # exp(-a s d) - exp(-b s d) < exp(-a s d), which decreases with d
+    return pair_volume_array(v_x, v_max, amp_type) * np.exp(-sc['a'] * s * distance)
+
+def cbw_roughness_envelope(low_hz, distance, v_x, v_max, options={}):
+    # Above 25 Hz, half the CBW grows more slowly than the frequency
+    # difference, so once the difference reaches half the CBW of the upper
+    # partial, every more distant pair is zero too.
+    v12 = pair_volume_array(v_x, v_max, options.get('amp_type', 'MIN'))
+
+    return np.where((low_hz >= 25) & (distance >= cbw_volk(low_hz + distance) / 2), 0, v12)
+
+def parncutt_roughness_envelope(low_hz, distance, v_x, v_max, options={}):
+    max_distance = 1.2
+    a = 0.25
+    i_factor = 2
+
+    # The CBW-normalized distance grows with the frequency difference. The
+    # model peaks (at 1) where the normalized distance equals a.
+    distance = distance / cbw_hutchinson(low_hz + distance / 2)
+    peak = np.maximum(distance, a)
+
+    return np.where(
+        distance <= max_distance,
+        np.multiply(v_x, v_max) * (((np.exp(1)/a) * peak * np.exp(-peak / a)) ** i_factor),
+        0
+    )
+
+# Transposition types that leave each model's pair values unchanged, i.e.
+# that preserve everything the model depends on. HZ_SHIFT preserves
+# frequency differences; ST_DIFF and SCALE_FACTOR preserve frequency ratios.
+# All of the roughness models depend on absolute register (through
+# min(f), CBW(max(f)) or CBW(mean(f))), so none qualifies.
+ROUGHNESS_INVARIANT_TRANSPOSITIONS = {
+    'SETHARES': [],
+    'CBW': [],
+    'PARNCUTT': [],
+    'HELMHOLTZ': []
+}
+
 ###################
 # SUMMATION MODEL #
 ###################
@@ -122,39 +259,128 @@ def parncutt_roughness_pair(x_hz, ref_hz, v_x, v_ref, options = {}):
 # The following function is based on Sethares' 1993 model, which linearly sums
 # all pairwise contributions to roughness. It can use any of the other
 # pairwise roughness evaluation functions.
+@timed('roughness_complex')
 def roughness_complex(
     spectrum: MergedSpectrum or ChordSpectrum,
     function_type: str = 'SETHARES',
     rough_limit: float = 0.1,
     *,
+    backend: str = 'NUMPY',
     options={
         'amp_type': 'MIN',
         'cutoff': False,
         'original': False,
-        'show_partials': False
+        'show_partials': False,
+        'show_error': False,
+        'cbw_window': None
     }
 ):
-    n = len(spectrum.partials['hz'])
+    n = len(spectrum.hz)
     rough_partials = []
     rough_vals = np.zeros((n, n))
 
     if function_type.upper() == 'SETHARES':
         pair_assess = sethares_roughness_pair
+        array_assess = sethares_roughness_array
+        array_envelope = sethares_roughness_envelope
         denom = 1
     elif function_type.upper() == 'CBW':
         pair_assess = cbw_roughness_pair
+        array_assess = cbw_roughness_array
+        array_envelope = cbw_roughness_envelope
         denom = 1
     elif function_type.upper() == 'PARNCUTT':
         pair_assess = parncutt_roughness_pair
+        array_assess = parncutt_roughness_array
+        array_envelope = parncutt_roughness_envelope
         # Hutchinson and Knopoff (1979, 6) use a single scaling
         # denominator across the entire sum.
-        denom = np.sum(spectrum.partials['amp'] ** 2)
+        denom = np.sum(spectrum.amp ** 2)
     elif function_type.upper() == 'HELMHOLTZ':
         pair_assess = helmholtz_roughness_pair
+        array_assess = helmholtz_roughness_array
+        array_envelope = None
         denom = 1
     else:
         raise ValueError(f'Invalid assessment function type: {function_type.upper()}')
 
+    # With options['kernel_table'] (a kernel_tables.KernelTable built for
+    # this model), pairs are assessed from the table instead. Only the
+    # compiled backend is faster for it; the NumPy backend gives the same
+    # results.
+    if options.get('kernel_table', None) is not None:
+        options['kernel_table'].check('ROUGHNESS', function_type, options)
+        array_assess = options['kernel_table'].assess
+
+    # Compiled backend: one fused loop over all pairs (see numba_kernels).
+    # Falls back to the NumPy backend when numba is not installed or the
+    # options need the individual pairs. numba is only imported once this
+    # backend is first used.
+    if backend.upper() == 'NUMBA':
+        from numba_kernels import compiled_roughness, compiled_supported
+        if compiled_supported(options):
+            return compiled_roughness(spectrum.hz, spectrum.amp, function_type, options) / denom
+        backend = 'NUMPY'
+
+    # NumPy backend: assess the whole upper triangle of the n x n pair grid
+    # (or, for Helmholtz, the full test x reference grid) at once.
+    # With options['cbw_window'] set, only pairs closer than that many
+    # critical bandwidths are assessed, and options['show_error'] reports an
+    # upper bound on the roughness of the pairs left out. Helmholtz's model
+    # is never pruned.
+    if backend.upper() == 'NUMPY':
+        hz = np.asarray(spectrum.hz, dtype=float)
+        amp = np.asarray(spectrum.amp, dtype=float)
+        error_bound = 0.0
+        pairs_pruned = 0
+
+        if function_type.upper() == 'HELMHOLTZ':
+            ref_hz = np.asarray(options['ref'], dtype=float)
+            rough_vals = array_assess(
+                hz[:, np.newaxis],
+                ref_hz[np.newaxis, :],
+                x_p=np.arange(1, len(hz) + 1)[:, np.newaxis],
+                options=options
+            )
+            i, j = np.indices(np.shape(rough_vals))
+            i, j = i.ravel(), j.ravel()
+            rough_vals = rough_vals.ravel()
+        else:
+            if options.get('cbw_window', None) is None:
+                i, j = np.triu_indices(n, 1)
+            else:
+                # Spectra are normally sorted by hz already; if not, prune
+                # in sorted order and map the indices back.
+                order = np.argsort(hz, kind='stable')
+                widths = window_hz(hz[order], options['cbw_window'])
+                i, j, ends = window_pairs(hz[order], widths)
+                error_bound = window_error_bound(hz[order], amp[order], widths, ends, array_envelope, options)
+                i, j = np.minimum(order[i], order[j]), np.maximum(order[i], order[j])
+                pairs_pruned = n * (n - 1) // 2 - len(i)
+                count('pairs_pruned', pairs_pruned)
+            rough_vals = cached_assess(array_assess, hz[i], hz[j], amp[i], amp[j], options)
+
+        if options.get('show_partials', False) == True:
+            above_limit = rough_vals > rough_limit
+            result = {
+                'roughness': np.sum(rough_vals),
+                'rough_partials': list(zip(i[above_limit].tolist(), j[above_limit].tolist()))
+            }
+        elif options.get('show_error', False) == True:
+            result = {'roughness': np.sum(rough_vals) / denom}
+            error_bound /= denom
+        else:
+            return np.sum(rough_vals) / denom
+
+        if options.get('show_error', False) == True:
+            result['error_bound'] = error_bound
+            result['pairs_assessed'] = len(rough_vals)
+            result['pairs_pruned'] = pairs_pruned
+
+        return result
+    elif backend.upper() != 'PYTHON':
+        raise ValueError(f'Invalid backend: {backend.upper()}')
+
     # Assess all pairs for roughness
 
     # Helmholtz's function works differently from the others.
@@ -163,12 +389,12 @@ def roughness_complex(
     # The second, reference pitch is stored under options['ref'] and is fixed.
     # This method will not work for cardinality > 2.
     if function_type.upper() == 'HELMHOLTZ':
-        m = len(spectrum.partials['hz'])
+        m = len(spectrum.hz)
         n = len(options['ref'])
         for i in range(m):
             for j in range(n):
                 rough_vals[i][j] = helmholtz_roughness_pair(
-                    spectrum.partials['hz'][i],
+                    spectrum.hz[i],
                     x_p=i + 1, # p is 1-indexed
                     ref_p=j + 1,
                     options=options
@@ -181,10 +407,10 @@ def roughness_complex(
         for i in range(n - 1):
             for j in range(i + 1, n):
                 rough_vals[i][j] = pair_assess(
-                    spectrum.partials['hz'][i],
-                    spectrum.partials['hz'][j],
-                    spectrum.partials['amp'][i],
-                    spectrum.partials['amp'][j],
+                    spectrum.hz[i],
+                    spectrum.hz[j],
+                    spectrum.amp[i],
+                    spectrum.amp[j],
                     options=options
                 )
                 if options['show_partials'] == True and rough_vals[i][j] > rough_limit:
@@ -0,0 +1,97 @@
+from collections import OrderedDict
+import hashlib
+import threading
+
+from chord_utils import ChordSpectrum, Timbre
+from profiling import count
+
+# This file contains a content-addressed cache of chord spectra. Pipelines
+# and sweeps often build the same chord (same structure, timbre and
+# fundamental) many times; with a SpectrumCache, each distinct chord is
+# built once and later requests cost a dictionary lookup. Cached spectra are
+# frozen (read-only), so one instance can be shared by every caller; use
+# ChordSpectrum.copy() to get one that can be transposed in place. The cache
+# holds at most `max_entries` spectra and evicts the least recently used
+# first. It may be shared by several threads.
+
+# Hash of a timbre's contents, so that equal timbres built separately share
+# cache entries
+def timbre_hash(timbre: Timbre) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for array in [timbre.fund_multiple, timbre.amp]:
+        digest.update(str(array.dtype).encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+class SpectrumCache:
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    # Locks cannot be pickled; a copy gets its own
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    # Frozen ChordSpectrum for the given arguments (as in ChordSpectrum),
+    # built only if it is not cached
+    def get(self, chord_struct: list, chord_struct_type: str = 'ST_DIFF', *, timbre: Timbre = None, fund_hz: float = 220.0):
+        key = (
+            tuple(float(note) for note in chord_struct),
+            chord_struct_type.upper(),
+            None if timbre is None else timbre_hash(timbre),
+            float(fund_hz)
+        )
+
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                count('spectrum_cache_hits', 1)
+                return self.entries[key]
+            self.misses += 1
+        count('spectrum_cache_misses', 1)
+
+        if timbre is None:
+            chord = ChordSpectrum(chord_struct, chord_struct_type, fund_hz=fund_hz)
+        else:
+            chord = ChordSpectrum(chord_struct, chord_struct_type, timbre=timbre, fund_hz=fund_hz)
+        chord.freeze()
+
+        # Another thread may have built the same chord meanwhile; all callers
+        # get the same instance
+        with self.lock:
+            if key in self.entries:
+                return self.entries[key]
+            self.entries[key] = chord
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+        return chord
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups > 0 else 0.0,
+            'evictions': self.evictions,
+            'entries': len(self.entries)
+        }
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
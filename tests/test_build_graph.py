@@ -0,0 +1,115 @@
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import numpy as np
+from chord_utils import ChordSpectrum, Timbre, TransposeDomain
+from chord_plots import roughness_curve
+from chord_scoring import score_chords
+from result_store import ResultStore
+from build_graph import BuildGraph
+
+class TestBuildGraph(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = ResultStore(self.directory.name)
+        self.graph = BuildGraph(self.store, version='1')
+        self.timbre = Timbre(range(1, 7), [1/n for n in range(1, 7)])
+        self.chord = ChordSpectrum([0, 4, 7], 'ST_DIFF', timbre=self.timbre, fund_hz=220.0)
+        self.domain = TransposeDomain(-1, 1, 11, 'ST_DIFF')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    # test: nodes are keyed by the code version as well as their inputs
+    def test_keys(self):
+        key = self.graph.key('curve', self.chord, 'SETHARES')
+        self.assertEqual(key, BuildGraph(self.store, version='1').key('curve', self.chord, 'SETHARES'))
+        self.assertNotEqual(key, BuildGraph(self.store, version='2').key('curve', self.chord, 'SETHARES'))
+        self.assertNotEqual(key, self.graph.key('curve', self.chord, 'PARNCUTT'))
+
+    # test: curves and scores computed through the graph are loaded on
+    # rebuild, recomputed for a new code version, and recorded per target
+    def test_incremental_rebuild(self):
+        with self.graph.target() as nodes:
+            computed = roughness_curve(self.chord, self.chord, transpose_domain=self.domain, store=self.graph)
+            scores = score_chords([self.chord], store=self.graph)
+        self.assertEqual(len(nodes), 2)
+        self.assertEqual(self.graph.stats(), {'computed': 2, 'loaded': 0, 'waited': 0})
+
+        rebuild = BuildGraph(self.store, version='1')
+        with rebuild.target() as rebuilt_nodes:
+            loaded = roughness_curve(self.chord, self.chord, transpose_domain=self.domain, store=rebuild)
+            loaded_scores = score_chords([self.chord], store=rebuild)
+        self.assertEqual(rebuilt_nodes, nodes)
+        self.assertEqual(rebuild.stats()['computed'], 0)
+        np.testing.assert_array_equal(loaded, computed)
+        np.testing.assert_array_equal(loaded_scores.to_numpy(), scores.to_numpy())
+
+        changed = BuildGraph(self.store, version='2')
+        roughness_curve(self.chord, self.chord, transpose_domain=self.domain, store=changed)
+        self.assertEqual(changed.stats()['computed'], 1)
+        self.assertFalse([name for name in os.listdir(self.directory.name) if name.endswith('.lock')])
+
+    # test: a node being computed elsewhere is waited for and loaded, not
+    # computed again
+    def test_shared_node_computed_once(self):
+        other = BuildGraph(self.store, version='1', wait=0.01)
+        key = self.graph.key('node')
+        self.assertIsNone(self.graph.load(key))
+
+        results = []
+        waiter = threading.Thread(target=lambda: results.append(other.get_or_compute(key, lambda: np.zeros(3))))
+        waiter.start()
+        time.sleep(0.05)
+        self.assertTrue(waiter.is_alive())
+        self.graph.save(key, np.ones(3))
+        waiter.join()
+
+        np.testing.assert_array_equal(results[0], np.ones(3))
+        self.assertEqual(other.stats(), {'computed': 0, 'loaded': 1, 'waited': 1})
+
+    # test: two processes each holding a node the other waits for (e.g. the
+    # batches of two streams of scores in flight) do not deadlock
+    def test_no_claim_deadlock(self):
+        other = BuildGraph(self.store, version='1', wait=0.01)
+        (first, second) = (self.graph.key('first'), self.graph.key('second'))
+        self.assertTrue(self.graph.claim(first))
+        self.assertTrue(other.claim(second))
+
+        results = []
+        waiter = threading.Thread(target=lambda: results.append(self.graph.claim(second)))
+        waiter.start()
+        time.sleep(0.05)
+        claimer = threading.Thread(target=lambda: results.append(other.claim(first)))
+        claimer.start()
+        claimer.join(timeout=5)
+        self.assertFalse(claimer.is_alive())
+
+        other.save(second, np.ones(2))
+        other.save(first, np.ones(2))
+        waiter.join(timeout=5)
+        self.assertEqual(results, [True, False])
+        self.assertFalse([name for name in os.listdir(self.directory.name) if name.endswith('.lock')])
+
+    # test: locks left by a failed target are released, and those of a dead
+    # process are taken over
+    def test_stale_locks(self):
+        key = self.graph.key('node')
+        with self.assertRaises(RuntimeError):
+            with self.graph.target():
+                self.assertIsNone(self.graph.load(key))
+                raise RuntimeError
+        self.assertFalse(os.path.exists(self.graph.lock_path(key)))
+
+        process = subprocess.Popen([sys.executable, '-c', 'pass'])
+        process.wait()
+        with open(self.graph.lock_path(key), 'w') as f:
+            f.write(str(process.pid))
+        self.assertEqual(self.graph.get_or_compute(key, lambda: np.ones(2)).tolist(), [1.0, 1.0])
+
+if __name__ == '__main__':
+    unittest.main()
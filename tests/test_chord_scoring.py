@@ -0,0 +1,106 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from chord_utils import ChordSpectrum, Timbre
+from roughness_models import roughness_complex
+from overlap_models import overlap_complex
+from chord_scoring import score_chords, score_spectrum, stream_scores, chord_spectra, read_chord_structs, default_models
+
+class TestScoreChords(unittest.TestCase):
+    def setUp(self):
+        timbre = Timbre(range(1, 12), [1/n for n in range(1, 12)])
+        structs = [[0, 4, 7], [0, 3, 7], [0, 4, 7, 10], [0, 1], [0, 7, 14, 21], [0, 6]] * 3
+        self.chords = [ChordSpectrum(struct, 'ST_DIFF', timbre=timbre, fund_hz=130.8) for struct in structs]
+
+    # test: batch scores match scoring each chord by itself, in input order
+    def test_scores_match_single_chords(self):
+        scores = score_chords(self.chords, default_models, batch_size=4)
+        np.testing.assert_allclose(scores['roughness_sethares'], [roughness_complex(c, 'SETHARES') for c in self.chords])
+        np.testing.assert_allclose(scores['overlap_sethares_bell'], [overlap_complex(c, 'SETHARES_BELL') for c in self.chords])
+        np.testing.assert_allclose(scores['roughness_parncutt'], [roughness_complex(c, 'PARNCUTT') for c in self.chords])
+        np.testing.assert_allclose(scores['overlap_parncutt_bell'], [overlap_complex(c, 'PARNCUTT_BELL') for c in self.chords])
+
+    # test: a process pool gives the same table as scoring in-process
+    def test_workers_preserve_order(self):
+        serial = score_chords(self.chords, default_models, batch_size=4)
+        parallel = score_chords(self.chords, default_models, workers=2, batch_size=4)
+        np.testing.assert_array_equal(parallel.to_numpy(), serial.to_numpy())
+
+class TestStreamScores(unittest.TestCase):
+    def setUp(self):
+        self.timbre = Timbre(range(1, 8), [1/n for n in range(1, 8)])
+        self.structs = [[0, 4, 7], [0, 3, 7], [0, 4, 7, 10], [0, 1], [0, 6]] * 3
+
+    # test: chord structures are read from a file, skipping blanks and comments
+    def test_read_chord_structs(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'corpus.txt')
+            with open(path, 'w') as f:
+                f.write('# corpus\n0 4 7\n\n0, 3, 7  # minor\n0 6.5\n')
+            self.assertEqual(list(read_chord_structs(path)), [[0, 4, 7], [0, 3, 7], [0, 6.5]])
+
+    # test: streamed batches concatenate to the batch result
+    def test_stream_matches_score_chords(self):
+        chords = [ChordSpectrum(struct, 'ST_DIFF', timbre=self.timbre) for struct in self.structs]
+        frames = list(stream_scores(chord_spectra(self.structs, timbre=self.timbre), batch_size=4))
+        self.assertEqual([len(frame) for frame in frames], [4, 4, 4, 3])
+        self.assertEqual(list(frames[-1].index), [12, 13, 14])
+        expected = score_chords(chords)
+        np.testing.assert_array_equal(np.concatenate([frame.to_numpy() for frame in frames]), expected.to_numpy())
+
+    # test: input is consumed one batch at a time
+    def test_stream_is_lazy(self):
+        consumed = []
+        def structs():
+            for struct in self.structs:
+                consumed.append(struct)
+                yield struct
+        stream = stream_scores(chord_spectra(structs(), timbre=self.timbre), batch_size=2)
+        next(stream)
+        self.assertLessEqual(len(consumed), 3)
+
+    # test: a process pool streams the same results in the same order
+    def test_stream_workers(self):
+        serial = list(stream_scores(chord_spectra(self.structs, timbre=self.timbre), batch_size=2))
+        parallel = list(stream_scores(chord_spectra(self.structs, timbre=self.timbre), batch_size=2, workers=2))
+        self.assertEqual(len(parallel), len(serial))
+        for (a, b) in zip(parallel, serial):
+            np.testing.assert_array_equal(a.to_numpy(), b.to_numpy())
+            self.assertEqual(list(a.index), list(b.index))
+
+class TestScoreSpectrum(unittest.TestCase):
+    def setUp(self):
+        timbre = Timbre(range(1, 16), [1/n for n in range(1, 16)])
+        self.chord = ChordSpectrum([0, 3.5, 7, 10.2, 14], 'ST_DIFF', timbre=timbre, fund_hz=98.0)
+
+    # test: single-pass scoring matches each model assessed on its own
+    def test_matches_complex(self):
+        models = [('ROUGHNESS', function_type) for function_type in ['SETHARES', 'CBW', 'PARNCUTT']] + \
+            [('OVERLAP', function_type) for function_type in ['SETHARES_BELL', 'PARNCUTT_BELL', 'CBW', 'COS']]
+        for amp_type in ['MIN', 'PRODUCT']:
+            for cutoff in [False, True]:
+                options = {'amp_type': amp_type, 'cutoff': cutoff, 'original': False}
+                scores = score_spectrum(self.chord, models, options)
+                for (measure, function_type) in models:
+                    complex_assess = roughness_complex if measure == 'ROUGHNESS' else overlap_complex
+                    np.testing.assert_allclose(
+                        scores[f'{measure.lower()}_{function_type.lower()}'],
+                        complex_assess(self.chord, function_type, options=options),
+                        rtol=1e-12, err_msg=f'{measure}, {function_type}, {amp_type}, {cutoff}'
+                    )
+
+    # test: pruned single-pass scoring matches pruned single models
+    def test_matches_complex_pruned(self):
+        options = {'amp_type': 'MIN', 'cbw_window': 2}
+        scores = score_spectrum(self.chord, default_models, options)
+        np.testing.assert_allclose(scores['roughness_sethares'], roughness_complex(self.chord, 'SETHARES', options=options), rtol=1e-12)
+        np.testing.assert_allclose(scores['overlap_parncutt_bell'], overlap_complex(self.chord, 'PARNCUTT_BELL', options=options), rtol=1e-12)
+
+    # test: Helmholtz's model is not a single-spectrum pairwise model
+    def test_invalid_model(self):
+        with self.assertRaises(ValueError):
+            score_spectrum(self.chord, [('ROUGHNESS', 'HELMHOLTZ')])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,202 @@
+import tempfile
+import unittest
+import numpy as np
+from chord_utils import ChordSpectrum, MergedSpectrum, Timbre, TransposeDomain
+from chord_plots import roughness_curve, overlap_curve
+from overlap_models import overlap_complex
+from roughness_models import roughness_complex
+from chord_sweeps import roughness_surface, overlap_surface, adaptive_sweep, roughness_sweep
+from result_store import ResultStore
+from profiling import profiling
+
+class TestRoughnessSweep(unittest.TestCase):
+    def setUp(self):
+        self.timbre = Timbre(range(1, 8), [0.88 ** p for p in range(0, 7)])
+        self.ref_chord = ChordSpectrum([0, 4, 7], 'ST_DIFF', timbre=self.timbre, fund_hz=220.0)
+        self.test_chord = ChordSpectrum([0], 'ST_DIFF', timbre=self.timbre, fund_hz=220.0)
+        self.domains = [
+            TransposeDomain(-0.5, 12.5, 53, 'ST_DIFF'),
+            TransposeDomain(1.0, 2.0, 41, 'SCALE_FACTOR'),
+            TransposeDomain(0.0, 300.0, 41, 'HZ_SHIFT'),
+        ]
+
+    def assert_sweeps_match(self, function_type, transpose_domain, **kwargs):
+        expected = roughness_curve(self.ref_chord, self.test_chord, transpose_domain=transpose_domain,
+            function_type=function_type, sweep_type='LOOP', **kwargs)
+        actual = roughness_curve(self.ref_chord, self.test_chord, transpose_domain=transpose_domain,
+            function_type=function_type, sweep_type='BATCH', chunk_size=16, **kwargs)
+        np.testing.assert_allclose(actual, expected, rtol=1e-9, atol=1e-12,
+            err_msg=f'{function_type}, {transpose_domain.transpose_type}')
+
+    # test: batched sweep agrees with the step-by-step loop
+    def test_batch_matches_loop(self):
+        for function_type in ['SETHARES', 'CBW', 'PARNCUTT']:
+            for transpose_domain in self.domains:
+                self.assert_sweeps_match(function_type, transpose_domain)
+
+    # test: batched sweep agrees with the loop for crossterms and normalization
+    def test_batch_crossterms_normalize(self):
+        options = {'crossterms_only': True, 'amp_type': 'PRODUCT', 'cutoff': False, 'original': False, 'show_partials': False}
+        for function_type in ['SETHARES', 'PARNCUTT']:
+            self.assert_sweeps_match(function_type, self.domains[0], normalize=True, options=options)
+
+    # test: batched sweep leaves test_chord untouched
+    def test_batch_does_not_mutate(self):
+        hz = self.test_chord.partials['hz'].copy()
+        roughness_curve(self.ref_chord, self.test_chord, transpose_domain=self.domains[0])
+        np.testing.assert_array_equal(self.test_chord.partials['hz'], hz)
+
+class TestOverlapSweep(unittest.TestCase):
+    def setUp(self):
+        self.timbre = Timbre(range(1, 12), [1/n for n in range(1, 12)])
+        self.ref_chord = ChordSpectrum([0, 4, 7], 'ST_DIFF', timbre=self.timbre, fund_hz=220.0)
+        self.test_chord = ChordSpectrum([0], 'ST_DIFF', timbre=self.timbre, fund_hz=220.0)
+
+    def assert_sweeps_match(self, function_type, transpose_domain, **kwargs):
+        expected = overlap_curve(self.ref_chord, self.test_chord, transpose_domain=transpose_domain,
+            function_type=function_type, sweep_type='LOOP', **kwargs)
+        actual = overlap_curve(self.ref_chord, self.test_chord, transpose_domain=transpose_domain,
+            function_type=function_type, sweep_type='BATCH', chunk_size=16, **kwargs)
+        np.testing.assert_allclose(actual, expected, rtol=1e-9, atol=1e-12,
+            err_msg=f'{function_type}, {transpose_domain.transpose_type}')
+
+    # test: batched sweep agrees with the step-by-step loop
+    def test_batch_matches_loop(self):
+        transpose_domain = TransposeDomain(1.0, 2.0, 61, 'SCALE_FACTOR')
+        for function_type in ['SETHARES_BELL', 'PARNCUTT_BELL', 'CBW', 'COS']:
+            self.assert_sweeps_match(function_type, transpose_domain)
+
+    # test: reusing the test x test block under HZ_SHIFT agrees with the loop
+    def test_batch_invariant_test_block(self):
+        transpose_domain = TransposeDomain(0.0, 300.0, 41, 'HZ_SHIFT')
+        for function_type in ['CBW', 'COS']:
+            self.assert_sweeps_match(function_type, transpose_domain)
+
+    # test: crossterms are the merged overlap minus each chord's own overlap
+    def test_crossterms_definition(self):
+        transpose_domain = TransposeDomain(3.0, 3.0, 1, 'ST_DIFF')
+        options = {'crossterms_only': True, 'amp_type': 'MIN', 'cutoff': False, 'show_partials': False}
+        crossterms = overlap_curve(self.ref_chord, self.test_chord, transpose_domain=transpose_domain,
+            function_type='SETHARES_BELL', options=options)
+        test_chord = ChordSpectrum([3.0], 'ST_DIFF', timbre=self.timbre, fund_hz=220.0)
+        expected = (overlap_complex(MergedSpectrum(self.ref_chord, test_chord))
+            - overlap_complex(self.ref_chord) - overlap_complex(test_chord))
+        np.testing.assert_allclose(crossterms[0], expected, rtol=1e-9)
+
+    # test: batched sweep agrees with the loop for crossterms and normalization
+    def test_batch_crossterms_normalize(self):
+        transpose_domain = TransposeDomain(-0.5, 12.5, 53, 'ST_DIFF')
+        options = {'crossterms_only': True, 'amp_type': 'MIN', 'cutoff': False, 'show_partials': False, 'K': -23.74}
+        self.assert_sweeps_match('SETHARES_BELL', transpose_domain, normalize=True, options=options)
+
+class TestSurfaces(unittest.TestCase):
+    def setUp(self):
+        self.timbre = Timbre(range(1, 7), [1/n for n in range(1, 7)])
+        self.tone = ChordSpectrum([0], 'ST_DIFF', timbre=self.timbre, fund_hz=220.0)
+        self.x_domain = TransposeDomain(1, 6, 6, 'ST_DIFF')
+        self.y_domain = TransposeDomain(5, 11, 4, 'ST_DIFF')
+
+    def triad(self, x, y):
+        return ChordSpectrum([0, x, y], 'ST_DIFF', timbre=self.timbre, fund_hz=220.0)
+
+    # test: a triad surface equals scoring each triad [0, x, y] directly
+    def test_roughness_surface(self):
+        for function_type in ['SETHARES', 'CBW', 'PARNCUTT']:
+            surface = roughness_surface(self.tone, [self.tone, self.tone], [self.x_domain, self.y_domain], function_type)
+            expected = [[roughness_complex(self.triad(x, y), function_type) for y in self.y_domain.domain]
+                for x in self.x_domain.domain]
+            np.testing.assert_allclose(surface, expected, rtol=1e-12, err_msg=function_type)
+
+    # test: crossterms subtract each tone's own roughness at its transposition
+    def test_roughness_surface_crossterms(self):
+        surface = roughness_surface(self.tone, [self.tone, self.tone], [self.x_domain, self.y_domain], 'SETHARES',
+            options={'crossterms_only': True})
+        def own(st):
+            return roughness_complex(ChordSpectrum([st], 'ST_DIFF', timbre=self.timbre, fund_hz=220.0), 'SETHARES')
+        expected = [[roughness_complex(self.triad(x, y), 'SETHARES') - own(0) - own(x) - own(y)
+            for y in self.y_domain.domain] for x in self.x_domain.domain]
+        np.testing.assert_allclose(surface, expected, rtol=1e-10, atol=1e-12)
+
+    # test: with crossterms only, the self blocks are not assessed at all
+    def test_surface_crossterms_skip_self_terms(self):
+        partials = len(self.tone.hz)
+        (x_steps, y_steps) = (len(self.x_domain.domain), len(self.y_domain.domain))
+        cross_pairs = (x_steps + y_steps) * partials ** 2 + x_steps * y_steps * partials ** 2
+        for surface_function in [roughness_surface, overlap_surface]:
+            with profiling() as profile:
+                surface_function(self.tone, [self.tone, self.tone], [self.x_domain, self.y_domain],
+                    options={'crossterms_only': True})
+            self.assertEqual(profile.counters['pairs_evaluated'], cross_pairs)
+
+    def test_overlap_surface(self):
+        surface = overlap_surface(self.tone, [self.tone, self.tone], [self.x_domain, self.y_domain], 'PARNCUTT_BELL')
+        expected = [[overlap_complex(self.triad(x, y), 'PARNCUTT_BELL') for y in self.y_domain.domain]
+            for x in self.x_domain.domain]
+        np.testing.assert_allclose(surface, expected, rtol=1e-12)
+
+    # test: three moving tones give a 3-D grid; workers do not change it
+    def test_surface_dimensions_and_workers(self):
+        z_domain = TransposeDomain(12, 14, 3, 'ST_DIFF')
+        domains = [self.x_domain, self.y_domain, z_domain]
+        serial = roughness_surface(self.tone, [self.tone] * 3, domains, chunk_size=4)
+        parallel = roughness_surface(self.tone, [self.tone] * 3, domains, chunk_size=4, workers=2)
+        self.assertEqual(serial.shape, (6, 4, 3))
+        np.testing.assert_array_equal(parallel, serial)
+        np.testing.assert_allclose(serial[2, 1, 0], roughness_complex(
+            ChordSpectrum([0, 3, 7, 12], 'ST_DIFF', timbre=self.timbre, fund_hz=220.0), 'SETHARES'), rtol=1e-12)
+
+    def test_surface_domain_count(self):
+        with self.assertRaises(ValueError):
+            roughness_surface(self.tone, [self.tone, self.tone], [self.x_domain])
+
+class TestAdaptiveSweep(unittest.TestCase):
+    def setUp(self):
+        self.timbre = Timbre(range(1, 12), [1/n for n in range(1, 12)])
+        self.tone = ChordSpectrum([0], 'ST_DIFF', timbre=self.timbre, fund_hz=220.0)
+        self.domain = TransposeDomain(-0.5, 12.5, 1301, 'ST_DIFF')
+        self.fine_domain = TransposeDomain(-0.5, 12.5, 13001, 'ST_DIFF')
+
+    # test: the adaptive curve follows a much finer uniform curve as closely
+    # as the uniform domain does, from fewer positions
+    def test_accuracy(self):
+        fine = roughness_sweep(self.tone, self.tone, self.fine_domain, 'SETHARES')
+        uniform = fine[::10]
+        (positions, values) = adaptive_sweep(roughness_sweep, self.tone, self.tone, self.domain, 'SETHARES')
+        self.assertTrue(np.all(np.diff(positions) > 0))
+        self.assertEqual((positions[0], positions[-1]), (-0.5, 12.5))
+        self.assertLess(len(positions), len(self.domain.domain) / 2)
+
+        curve_range = np.max(fine) - np.min(fine)
+        uniform_error = np.max(np.abs(np.interp(self.fine_domain.domain, self.domain.domain, uniform) - fine))
+        adaptive_error = np.max(np.abs(np.interp(self.fine_domain.domain, positions, values) - fine))
+        self.assertLess(adaptive_error, 1.5 * uniform_error)
+        self.assertLess(adaptive_error / curve_range, 5e-3)
+
+        np.testing.assert_allclose(values, roughness_sweep(self.tone, self.tone,
+            TransposeDomain.from_positions(positions, 'ST_DIFF'), 'SETHARES'), rtol=1e-12)
+
+    # test: adaptive curves return their positions, are stored as such, and
+    # reject models the batched sweeps do not cover
+    def test_curves(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = ResultStore(directory)
+            (positions, values) = overlap_curve(self.tone, self.tone, transpose_domain=self.domain,
+                function_type='SETHARES_BELL', sweep_type='ADAPTIVE', store=store)
+            (loaded_positions, loaded_values) = overlap_curve(self.tone, self.tone, transpose_domain=self.domain,
+                function_type='SETHARES_BELL', sweep_type='ADAPTIVE', store=store)
+            np.testing.assert_array_equal(loaded_positions, positions)
+            np.testing.assert_array_equal(loaded_values, values)
+
+            (_, coarse_values) = overlap_curve(self.tone, self.tone, transpose_domain=self.domain,
+                function_type='SETHARES_BELL', sweep_type='ADAPTIVE', tolerance=1e-2, store=store)
+            self.assertLess(len(coarse_values), len(values))
+
+        (_, normalized) = roughness_curve(self.tone, self.tone, transpose_domain=self.domain,
+            sweep_type='ADAPTIVE', normalize=True)
+        self.assertEqual(np.max(normalized), 1.0)
+        with self.assertRaises(ValueError):
+            roughness_curve(self.tone, self.tone, transpose_domain=self.domain,
+                function_type='HELMHOLTZ', sweep_type='ADAPTIVE')
+
+if __name__ == '__main__':
+    unittest.main()
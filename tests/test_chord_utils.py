@@ -1,3 +1,4 @@
+import pickle
 import unittest
 import pandas as pd
 from pandas.testing import assert_frame_equal
@@ -20,6 +21,13 @@ class TestTimbre(unittest.TestCase):
         })
         assert_frame_equal(test_timbre, cu.Timbre(range(1,6), [1/n for n in range(1,6)]).partials)
 
+    # test: from_partials builds an instance of the class it is called on
+    def test_timbre_from_partials(self):
+        timbre = cu.Timbre(range(1,4), [1/n for n in range(1,4)])
+        copy = cu.Timbre.from_partials(timbre.partials)
+        self.assertIsInstance(copy, cu.Timbre)
+        assert_frame_equal(copy.partials, timbre.partials)
+
 class TestMakeChord(unittest.TestCase):
 
     # test: make_chord makes a chord using semitone-based intervals
@@ -50,5 +58,72 @@ class TestMakeChord(unittest.TestCase):
         })
         assert_frame_equal(test_chord, cu.ChordSpectrum(chord_struct, 'SCALE_FACTOR', timbre=timbre, fund_hz=fund).partials)
 
+class TestCompactSpectrum(unittest.TestCase):
+
+    # test: partials view follows the arrays through transpose and reset
+    def test_partials_view_tracks_arrays(self):
+        timbre = cu.Timbre(range(1,3), [1/n for n in range(1,3)])
+        chord = cu.ChordSpectrum([0], 'ST_DIFF', timbre=timbre, fund_hz=220)
+        chord.transpose(12, 'ST_DIFF')
+        self.assertEqual(list(chord.partials['hz']), [440., 880.])
+        chord.reset_partials()
+        self.assertEqual(list(chord.partials['hz']), [220., 440.])
+
+    # test: assigning a DataFrame to partials replaces the arrays
+    def test_partials_setter(self):
+        spectrum = cu.MergedSpectrum(cu.Timbre([1, 2]), 100)
+        spectrum.partials = pd.DataFrame({'hz': [150., 300.], 'amp': [1., .5]})
+        self.assertEqual(list(spectrum.hz), [150., 300.])
+        self.assertIsNone(spectrum.note_id)
+
+    # test: spectra do not carry a per-instance __dict__
+    def test_slots(self):
+        chord = cu.ChordSpectrum([0, 7])
+        self.assertFalse(hasattr(chord, '__dict__'))
+
+class TestMergedSpectrum(unittest.TestCase):
+
+    # test: merging several chords gives the same table as concat + sort
+    def test_merge_many(self):
+        timbre = cu.Timbre(range(1,6), [1/n for n in range(1,6)])
+        chords = [cu.ChordSpectrum(struct, 'ST_DIFF', timbre=timbre, fund_hz=110) for struct in [[0, 7], [4], [12, 19, 24]]]
+        expected = cu.sort_partials(pd.concat([chord.partials for chord in chords], ignore_index=True))
+        merged = cu.MergedSpectrum(*chords)
+        self.assertEqual(list(merged.hz), list(expected['hz']))
+        self.assertEqual(sorted(zip(merged.hz, merged.amp)), sorted(zip(expected['hz'], expected['amp'])))
+
+    # test: merging works even if an input is not sorted by hz
+    def test_merge_unsorted_input(self):
+        unsorted = cu.MergedSpectrum(cu.Timbre([3, 1, 2]), 100)
+        merged = cu.MergedSpectrum(unsorted, cu.MergedSpectrum(cu.Timbre([1.5]), 100))
+        self.assertEqual(list(merged.hz), [100., 150., 200., 300.])
+
+class TestTransposedSpectrum(unittest.TestCase):
+
+    # test: a view has the frequencies transpose() would set, and leaves the
+    # chord unchanged
+    def test_matches_transpose(self):
+        for (position, transpose_type) in [(3.5, 'ST_DIFF'), (1.25, 'SCALE_FACTOR'), (40.0, 'HZ_SHIFT')]:
+            chord = cu.ChordSpectrum([0, 4, 7], transpose_type, fund_hz=196)
+            hz = chord.hz.copy()
+            view = chord.transposed(position, transpose_type)
+
+            transposed = cu.ChordSpectrum([0, 4, 7], transpose_type, fund_hz=196)
+            transposed.transpose(position, transpose_type)
+            self.assertEqual(list(view.hz), list(transposed.hz))
+            self.assertIs(view.amp, chord.amp)
+            self.assertEqual(list(chord.hz), list(hz))
+
+    # test: views can be merged, are read-only, and pickle
+    def test_view(self):
+        chord = cu.ChordSpectrum([0, 7])
+        view = chord.transposed(2, 'ST_DIFF')
+        merged = cu.MergedSpectrum(chord, view)
+        self.assertEqual(len(merged), 2 * len(chord))
+
+        with self.assertRaises(ValueError):
+            view.hz[0] = 1.0
+        self.assertEqual(list(pickle.loads(pickle.dumps(view)).hz), list(view.hz))
+
 if __name__ == '__main__':
     unittest.main()
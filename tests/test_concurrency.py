@@ -0,0 +1,80 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from chord_utils import ChordSpectrum, Timbre, TransposeDomain
+from chord_plots import roughness_curve, overlap_curve
+from chord_sweeps import roughness_sweep, threaded_sweep
+from roughness_models import sethares_roughness_pair
+from pair_cache import PairCache
+from spectrum_cache import SpectrumCache
+
+class TestConcurrency(unittest.TestCase):
+    def setUp(self):
+        self.timbre = Timbre(range(1, 10), [0.88 ** p for p in range(0, 9)])
+        self.ref_chord = ChordSpectrum([0, 4, 7], 'ST_DIFF', timbre=self.timbre, fund_hz=196.0)
+        self.test_chord = ChordSpectrum([0, 3, 7], 'ST_DIFF', timbre=self.timbre, fund_hz=196.0)
+        self.domain = TransposeDomain(-1, 13, 281, 'ST_DIFF')
+        self.jobs = [
+            (roughness_curve, 'SETHARES', 'BATCH'),
+            (roughness_curve, 'PARNCUTT', 'BATCH'),
+            (roughness_curve, 'SETHARES', 'LOOP'),
+            (overlap_curve, 'SETHARES_BELL', 'BATCH'),
+            (overlap_curve, 'PARNCUTT_BELL', 'LOOP'),
+        ]
+
+    def run_job(self, job, options):
+        (curve, function_type, sweep_type) = job
+        return curve(self.ref_chord, self.test_chord, transpose_domain=TransposeDomain(-1, 13, 57, 'ST_DIFF'),
+            function_type=function_type, sweep_type=sweep_type, options=options)
+
+    # test: curves running concurrently on shared chords (and a shared
+    # cache) give exactly the serial results, and leave the chords unchanged
+    def test_concurrent_curves(self):
+        hz = self.test_chord.hz.copy()
+        fund_multiple = self.test_chord.fund_multiple.copy()
+        options = {'crossterms_only': False, 'amp_type': 'MIN', 'cutoff': False, 'original': True, 'show_partials': False}
+        expected = [self.run_job(job, dict(options)) for job in self.jobs]
+
+        options['cache'] = PairCache()
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            futures = [executor.submit(self.run_job, self.jobs[k % len(self.jobs)], options)
+                for k in range(4 * len(self.jobs))]
+            results = [future.result() for future in futures]
+
+        for (k, result) in enumerate(results):
+            np.testing.assert_array_equal(result, expected[k % len(self.jobs)])
+        np.testing.assert_array_equal(self.test_chord.hz, hz)
+        np.testing.assert_array_equal(self.test_chord.fund_multiple, fund_multiple)
+        self.assertEqual(options['amp_type'], 'MIN')
+
+    # test: a sweep split across threads matches the single-threaded sweep
+    def test_threaded_sweep(self):
+        options = {'amp_type': 'MIN', 'cache': PairCache()}
+        expected = roughness_sweep(self.ref_chord, self.test_chord, self.domain, 'SETHARES', options={'amp_type': 'MIN'})
+        for threads in [1, 3, 8]:
+            actual = threaded_sweep(roughness_sweep, self.ref_chord, self.test_chord, self.domain, 'SETHARES',
+                threads=threads, chunk_size=32, options=options)
+            np.testing.assert_allclose(actual, expected, rtol=1e-12, atol=1e-15)
+
+        actual = roughness_curve(self.ref_chord, self.test_chord, transpose_domain=self.domain, threads=4)
+        np.testing.assert_allclose(actual, expected, rtol=1e-12, atol=1e-15)
+
+    # test: concurrent requests for the same chords share single instances
+    def test_shared_spectrum_cache(self):
+        cache = SpectrumCache()
+        structs = [[0, 4, 7], [0, 3, 7], [0, 4, 7, 10]] * 20
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            chords = list(executor.map(lambda struct: cache.get(struct, timbre=self.timbre), structs))
+
+        for (struct, chord) in zip(structs, chords):
+            self.assertIs(chord, cache.get(struct, timbre=self.timbre))
+        self.assertEqual(cache.stats()['entries'], 3)
+
+    # test: the pairwise model no longer writes into its options
+    def test_pair_options_unchanged(self):
+        options = {'original': True, 'amp_type': 'PRODUCT', 'cutoff': False}
+        sethares_roughness_pair(220.0, 230.0, 0.5, 0.25, options=options)
+        self.assertEqual(options['amp_type'], 'PRODUCT')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import os
+import subprocess
+import sys
+import time
+import unittest
+
+chordkit_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'chordkit')
+
+# Best wall time of a fresh interpreter running `code`, and its output
+def run_fresh(code: str, repeat: int = 3):
+    env = dict(os.environ, PYTHONPATH=chordkit_path)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', code], env=env, check=True, capture_output=True, text=True).stdout
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, output
+
+class TestImports(unittest.TestCase):
+    # test: the scoring modules load neither matplotlib, pandas nor numba
+    def test_no_heavy_imports(self):
+        for module in ['chordkit', 'roughness_models', 'overlap_models', 'chord_scoring', 'chord_plots']:
+            (_, output) = run_fresh(f'import sys, {module}; print(sorted(m for m in ["matplotlib", "pandas", "numba"] if m in sys.modules))')
+            self.assertEqual(output.strip(), '[]', module)
+
+    # test: lazy names resolve to the same objects as the submodules hold
+    def test_lazy_names(self):
+        (_, output) = run_fresh('import chordkit, defaults; '
+            'print(chordkit.Chord is chordkit.chord_utils.ChordSpectrum, '
+            'defaults.default_transpose_domain is defaults.one_octave, '
+            'len(defaults.default_chord))')
+        self.assertEqual(output.split(), ['True', 'True', '1'])
+
+    # test: importing the scoring code costs little more than importing
+    # NumPy (the budget is generous, to allow for slow machines)
+    def test_import_time_budget(self):
+        (numpy_time, _) = run_fresh('import numpy')
+        (scoring_time, _) = run_fresh('import chord_scoring, chord_plots')
+        self.assertLess(scoring_time - numpy_time, 0.5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from chord_utils import ChordSpectrum, Timbre, TransposeDomain
+from roughness_models import roughness_complex, sethares_roughness_array, parncutt_roughness_array
+from overlap_models import overlap_complex, sethares_bell_overlap_array, parncutt_bell_overlap_array
+from pair_utils import PairGeometry
+from chord_sweeps import overlap_sweep
+from kernel_tables import KernelTable, kernel_table, table_amp_factor
+from numba_kernels import compiled_table
+
+class TestKernelTables(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        self.x_hz = np.exp2(rng.uniform(np.log2(15), np.log2(21000), 20000))
+        self.ref_hz = self.x_hz * np.exp2(rng.uniform(-1, 1, 20000))
+        self.v_x = rng.uniform(0, 1, 20000)
+        self.v_ref = rng.uniform(0, 1, 20000)
+
+    # test: table values are within the documented error of the models
+    def test_within_max_error(self):
+        models = [
+            ('ROUGHNESS', 'SETHARES', sethares_roughness_array),
+            ('OVERLAP', 'SETHARES_BELL', sethares_bell_overlap_array),
+            ('ROUGHNESS', 'PARNCUTT', parncutt_roughness_array),
+            ('OVERLAP', 'PARNCUTT_BELL', parncutt_bell_overlap_array),
+        ]
+        for (measure, function_type, array_assess) in models:
+            table = KernelTable.build(measure, function_type, hz_steps=128, u_steps=1024)
+            for options in [{'amp_type': 'MIN'}, {'amp_type': 'PRODUCT', 'cutoff': True}]:
+                expected = array_assess(self.x_hz, self.ref_hz, self.v_x, self.v_ref, options=options)
+                actual = table.assess(self.x_hz, self.ref_hz, self.v_x, self.v_ref, options=options)
+                self.assertLessEqual(np.max(np.abs(actual - expected)), table.max_error, f'{function_type}, {options}')
+
+    # test: tables are saved once and reloaded unchanged
+    def test_persistence(self):
+        with tempfile.TemporaryDirectory() as directory:
+            built = kernel_table('ROUGHNESS', 'PARNCUTT', directory=directory, hz_steps=64, u_steps=256)
+            self.assertEqual(len(os.listdir(directory)), 1)
+            loaded = kernel_table('ROUGHNESS', 'PARNCUTT', directory=directory, hz_steps=64, u_steps=256)
+            np.testing.assert_array_equal(loaded.values, built.values)
+            self.assertEqual(loaded.max_error, built.max_error)
+            self.assertEqual(loaded.function_type, 'PARNCUTT')
+
+    # test: roughness_complex and overlap_complex use a table passed in the
+    # options, within max_error per unit amplitude factor of each pair, with
+    # the same results from both backends
+    def test_table_option(self):
+        timbre = Timbre(range(1, 13), [1/n for n in range(1, 13)])
+        chord = ChordSpectrum([0, 4, 7], 'ST_DIFF', timbre=timbre, fund_hz=196.0)
+        (i, j) = np.triu_indices(len(chord.hz), 1)
+        geometry = PairGeometry(chord.hz[i], chord.hz[j], chord.amp[i], chord.amp[j])
+        models = [
+            ('ROUGHNESS', 'SETHARES', roughness_complex, 1),
+            ('OVERLAP', 'SETHARES_BELL', overlap_complex, 1),
+            ('ROUGHNESS', 'PARNCUTT', roughness_complex, np.sum(chord.amp ** 2)),
+            ('OVERLAP', 'PARNCUTT_BELL', overlap_complex, 1),
+        ]
+        for (measure, function_type, complex_assess, denom) in models:
+            table = kernel_table(measure, function_type)
+            for options in [{'amp_type': 'MIN'}, {'amp_type': 'PRODUCT', 'cutoff': True}]:
+                bound = table.max_error * np.sum(table_amp_factor(measure, function_type, geometry, options)) / denom
+                exact = complex_assess(chord, function_type, options=options)
+                table_options = dict(options, kernel_table=table)
+                tabulated = complex_assess(chord, function_type, options=table_options)
+                compiled = complex_assess(chord, function_type, backend='NUMBA', options=table_options)
+                self.assertLessEqual(abs(tabulated - exact), bound, f'{function_type}, {options}')
+                self.assertAlmostEqual(compiled, tabulated, delta=1e-12 * abs(tabulated) + 1e-15)
+
+    # test: the compiled kernels match the NumPy table evaluation, including
+    # pairs off the grid of a 2-D table
+    def test_compiled_tables(self):
+        hz = np.concatenate([[12.0, 15.0], np.exp2(np.linspace(np.log2(20), np.log2(8000), 60)), [21000.0, 22000.0]])
+        amp = np.linspace(1, 0.2, len(hz))
+        (i, j) = np.triu_indices(len(hz), 1)
+        for (measure, function_type) in [('ROUGHNESS', 'SETHARES'), ('OVERLAP', 'SETHARES_BELL'),
+                ('ROUGHNESS', 'PARNCUTT'), ('OVERLAP', 'PARNCUTT_BELL')]:
+            table = KernelTable.build(measure, function_type, hz_steps=64, u_steps=512)
+            for options in [{'amp_type': 'MIN'}, {'amp_type': 'PRODUCT', 'cutoff': True, 'original': True}]:
+                expected = np.sum(table.assess(hz[i], hz[j], amp[i], amp[j], options=options))
+                actual = compiled_table(hz, amp, table, options)
+                self.assertAlmostEqual(actual, expected, delta=1e-12 * abs(expected), msg=f'{function_type}, {options}')
+
+    # test: the sweeps, which gain nothing from tables, reject them
+    def test_sweeps_reject_tables(self):
+        chord = ChordSpectrum([0, 4, 7])
+        domain = TransposeDomain(-1, 1, 21, 'ST_DIFF')
+        with self.assertRaises(ValueError):
+            overlap_sweep(chord, chord, domain, options={'kernel_table': kernel_table('OVERLAP', 'SETHARES_BELL')})
+
+    # test: a table cannot stand in for a different model
+    def test_mismatched_table(self):
+        chord = ChordSpectrum([0, 4, 7])
+        with self.assertRaises(ValueError):
+            roughness_complex(chord, 'PARNCUTT', options={'kernel_table': kernel_table('ROUGHNESS', 'SETHARES')})
+        with self.assertRaises(ValueError):
+            kernel_table('ROUGHNESS', 'CBW')
+
+if __name__ == '__main__':
+    unittest.main()
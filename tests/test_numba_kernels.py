@@ -0,0 +1,59 @@
+import unittest
+import numpy as np
+from chord_utils import ChordSpectrum, Timbre
+from roughness_models import roughness_complex
+from overlap_models import overlap_complex
+from numba_kernels import compiled_roughness, compiled_overlap
+
+class TestCompiledKernels(unittest.TestCase):
+    def setUp(self):
+        timbre = Timbre(range(1, 9), [1/n for n in range(1, 9)])
+        self.chord = ChordSpectrum([0, 3.5, 7, 10.2], 'ST_DIFF', timbre=timbre, fund_hz=130.8)
+        self.option_sets = [
+            {'amp_type': 'MIN', 'cutoff': False, 'original': False},
+            {'amp_type': 'PRODUCT', 'cutoff': True, 'original': False},
+            {'amp_type': 'PRODUCT', 'cutoff': False, 'original': True, 'K': -1.5},
+        ]
+
+    # test: the kernels (compiled or not) agree with the NumPy reference
+    def test_roughness_kernels(self):
+        for function_type in ['SETHARES', 'CBW', 'PARNCUTT']:
+            for options in self.option_sets:
+                expected = roughness_complex(self.chord, function_type, backend='NUMPY', options=options)
+                actual = compiled_roughness(self.chord.hz, self.chord.amp, function_type, options)
+                if function_type == 'PARNCUTT':
+                    actual /= np.sum(self.chord.amp ** 2)
+                np.testing.assert_allclose(actual, expected, rtol=1e-12, err_msg=f'{function_type}, {options}')
+
+    def test_overlap_kernels(self):
+        for function_type in ['SETHARES_BELL', 'PARNCUTT_BELL', 'CBW', 'COS']:
+            for options in self.option_sets:
+                expected = overlap_complex(self.chord, function_type, backend='NUMPY', options=options)
+                actual = compiled_overlap(self.chord.hz, self.chord.amp, function_type, options)
+                np.testing.assert_allclose(actual, expected, rtol=1e-12, err_msg=f'{function_type}, {options}')
+
+    def test_helmholtz_kernel(self):
+        tone = ChordSpectrum([0], 'ST_DIFF', timbre=Timbre(range(1, 11)), fund_hz=264.0)
+        test_tone = ChordSpectrum([0.7], 'ST_DIFF', timbre=Timbre(range(1, 11)), fund_hz=264.0)
+        options = {'ref': tone.hz, 'show_partials': False}
+        expected = roughness_complex(test_tone, 'HELMHOLTZ', backend='NUMPY', options=options)
+        np.testing.assert_allclose(compiled_roughness(test_tone.hz, test_tone.amp, 'HELMHOLTZ', options), expected, rtol=1e-12)
+
+    # test: the NUMBA backend gives the NumPy results, compiled or not
+    def test_numba_backend(self):
+        options = {'amp_type': 'MIN', 'cutoff': False, 'original': False, 'show_partials': False}
+        for function_type in ['SETHARES', 'CBW', 'PARNCUTT']:
+            np.testing.assert_allclose(
+                roughness_complex(self.chord, function_type, backend='NUMBA', options=options),
+                roughness_complex(self.chord, function_type, backend='NUMPY', options=options),
+                rtol=1e-12
+            )
+        for function_type in ['SETHARES_BELL', 'PARNCUTT_BELL', 'CBW', 'COS']:
+            np.testing.assert_allclose(
+                overlap_complex(self.chord, function_type, backend='NUMBA', options=options),
+                overlap_complex(self.chord, function_type, backend='NUMPY', options=options),
+                rtol=1e-12
+            )
+
+if __name__ == '__main__':
+    unittest.main()
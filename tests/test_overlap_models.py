@@ -0,0 +1,44 @@
+import unittest
+import numpy as np
+from chord_utils import ChordSpectrum, Timbre
+from overlap_models import overlap_complex
+
+class TestOverlapBackends(unittest.TestCase):
+    def setUp(self):
+        timbre = Timbre(range(1, 12), [1/n for n in range(1, 12)])
+        self.chord = ChordSpectrum([0, 3.5, 7, 10.2, 12.05], 'ST_DIFF', timbre=timbre, fund_hz=196.0)
+
+    # test: NumPy backend agrees with the scalar loop for every pairwise model
+    def test_numpy_matches_python(self):
+        for function_type in ['SETHARES_BELL', 'PARNCUTT_BELL', 'CBW', 'COS']:
+            for amp_type in ['MIN', 'PRODUCT']:
+                options = {'amp_type': amp_type, 'cutoff': False, 'original': False, 'show_partials': False}
+                expected = overlap_complex(self.chord, function_type, backend='PYTHON', options=options)
+                actual = overlap_complex(self.chord, function_type, backend='NUMPY', options=options)
+                np.testing.assert_allclose(actual, expected, rtol=1e-12, err_msg=f'{function_type}, {amp_type}')
+
+    # test: the 'K' option reaches the Sethares-like bell in both backends
+    def test_numpy_sethares_bell_k(self):
+        options = {'amp_type': 'MIN', 'cutoff': False, 'show_partials': False, 'K': -23.74}
+        expected = overlap_complex(self.chord, 'SETHARES_BELL', backend='PYTHON', options=options)
+        actual = overlap_complex(self.chord, 'SETHARES_BELL', backend='NUMPY', options=options)
+        np.testing.assert_allclose(actual, expected, rtol=1e-12)
+
+class TestOverlapPruning(unittest.TestCase):
+    def setUp(self):
+        timbre = Timbre(range(1, 21), [1/n for n in range(1, 21)])
+        self.chord = ChordSpectrum(list(np.arange(0, 36, 2.7)), 'ST_DIFF', timbre=timbre, fund_hz=65.0)
+
+    # test: pruned overlap is within the reported error bound of the full sum
+    def test_pruning_within_error_bound(self):
+        for function_type in ['SETHARES_BELL', 'PARNCUTT_BELL', 'CBW', 'COS']:
+            for cbw_window in [0.5, 1, 2]:
+                full = overlap_complex(self.chord, function_type)
+                pruned = overlap_complex(self.chord, function_type,
+                    options={'amp_type': 'MIN', 'cbw_window': cbw_window, 'show_error': True})
+                self.assertGreater(pruned['pairs_pruned'], 0)
+                self.assertLessEqual(abs(full - pruned['overlap']), pruned['error_bound'] + 1e-12,
+                    f'{function_type}, {cbw_window}')
+
+if __name__ == '__main__':
+    unittest.main()
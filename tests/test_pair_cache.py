@@ -0,0 +1,71 @@
+import unittest
+import numpy as np
+from chord_utils import ChordSpectrum, Timbre, TransposeDomain
+from roughness_models import roughness_complex, sethares_roughness_array
+from overlap_models import overlap_complex
+from chord_sweeps import roughness_sweep
+from pair_cache import PairCache
+
+class TestPairCache(unittest.TestCase):
+    def setUp(self):
+        timbre = Timbre(range(1, 12), [1/n for n in range(1, 12)])
+        self.ref_chord = ChordSpectrum([0, 4, 7], 'ST_DIFF', timbre=timbre, fund_hz=196.0)
+        self.test_chord = ChordSpectrum([0, 3, 7], 'ST_DIFF', timbre=timbre, fund_hz=196.0)
+        self.domain = TransposeDomain(-3, 3, 301, 'ST_DIFF')
+
+    # test: cached results equal uncached ones, and repeats hit the cache
+    def test_exact_cache(self):
+        cache = PairCache()
+        options = {'amp_type': 'MIN', 'cache': cache}
+        for _ in range(2):
+            self.assertEqual(roughness_complex(self.ref_chord, 'SETHARES', options=options),
+                roughness_complex(self.ref_chord, 'SETHARES'))
+            self.assertEqual(overlap_complex(self.ref_chord, 'PARNCUTT_BELL', options=options),
+                overlap_complex(self.ref_chord, 'PARNCUTT_BELL'))
+        self.assertEqual(cache.stats()['misses'], 2)
+        self.assertEqual(cache.stats()['hits'], 2)
+
+    # test: one cache shared across sweeps reuses the fixed ref x ref block
+    def test_shared_across_sweeps(self):
+        cache = PairCache()
+        expected = roughness_sweep(self.ref_chord, self.test_chord, self.domain)
+        actual = roughness_sweep(self.ref_chord, self.test_chord, self.domain, options={'cache': cache})
+        np.testing.assert_array_equal(actual, expected)
+        misses = cache.stats()['misses']
+        roughness_sweep(self.ref_chord, self.ref_chord, self.domain, options={'cache': cache})
+        self.assertGreater(cache.stats()['hits'], 0)
+        self.assertLess(cache.stats()['misses'], 2 * misses)
+
+    # test: options that change the model are part of the key
+    def test_options_in_key(self):
+        cache = PairCache()
+        minimum = roughness_complex(self.ref_chord, 'SETHARES', options={'amp_type': 'MIN', 'cache': cache})
+        product = roughness_complex(self.ref_chord, 'SETHARES', options={'amp_type': 'PRODUCT', 'cache': cache})
+        self.assertNotEqual(minimum, product)
+        self.assertEqual(cache.stats()['hits'], 0)
+
+    # test: quantized frequencies stay within the cents grid
+    def test_quantized_cache(self):
+        cache = PairCache(cents=1)
+        hz = np.array([100.0, 261.63, 1000.3])
+        self.assertTrue(np.all(np.abs(1200 * np.log2(cache.quantize(hz) / hz)) <= 0.5 + 1e-9))
+        expected = roughness_complex(self.ref_chord, 'SETHARES')
+        actual = roughness_complex(self.ref_chord, 'SETHARES', options={'cache': cache})
+        np.testing.assert_allclose(actual, expected, rtol=1e-2)
+
+        with np.errstate(all='raise'):
+            np.testing.assert_array_equal(cache.quantize([-50.0, 0.0]), [-50.0, 0.0])
+
+    # test: the size bound evicts least recently used blocks
+    def test_eviction(self):
+        hz = np.arange(100.0, 200.0)
+        amp = np.ones(100)
+        cache = PairCache(max_bytes=2 * hz.nbytes)
+        for shift in range(3):
+            cache.assess(sethares_roughness_array, hz + shift, hz + shift + 10, amp, amp)
+        self.assertEqual(cache.stats()['entries'], 2)
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertLessEqual(cache.stats()['bytes'], cache.max_bytes)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import json
+import os
+import pstats
+import tempfile
+import unittest
+from chord_utils import ChordSpectrum, Timbre, TransposeDomain
+from chord_plots import roughness_curve
+from roughness_models import roughness_complex
+from pair_cache import PairCache
+import profiling
+from profiling import profiling as profile_block, timed
+
+class TestProfiling(unittest.TestCase):
+    def setUp(self):
+        timbre = Timbre(range(1, 8), [0.88 ** p for p in range(0, 7)])
+        self.ref_chord = ChordSpectrum([0, 4, 7], 'ST_DIFF', timbre=timbre, fund_hz=220.0)
+        self.test_chord = ChordSpectrum([0], 'ST_DIFF', timbre=timbre, fund_hz=220.0)
+        self.domain = TransposeDomain(0, 12, 25, 'ST_DIFF')
+        self.options = {'crossterms_only': False, 'amp_type': 'MIN', 'cutoff': False, 'original': False, 'show_partials': False}
+
+    # test: stages, pair counts and cache hits are recorded, and only inside
+    # the block
+    def test_records_stages_and_counters(self):
+        options = dict(self.options, cache=PairCache())
+        with profile_block() as profile:
+            roughness_curve(self.ref_chord, self.test_chord, transpose_domain=self.domain, sweep_type='LOOP', options=options)
+            roughness_curve(self.ref_chord, self.test_chord, transpose_domain=self.domain, sweep_type='LOOP', options=options)
+            roughness_complex(self.ref_chord, options={'cbw_window': 1.0})
+        self.assertIsNone(profiling.active_profile)
+
+        stats = profile.to_dict()
+        self.assertEqual(stats['stages']['roughness_curve']['calls'], 2)
+        self.assertEqual(stats['stages']['roughness_complex']['calls'], 2 * 25 + 1)
+        self.assertEqual(stats['stages']['MergedSpectrum']['calls'], 2 * 25)
+        self.assertEqual(stats['counters']['pair_cache_hits'], 25)
+        self.assertGreater(stats['counters']['pairs_evaluated'], 0)
+        self.assertGreater(stats['counters']['pairs_pruned'], 0)
+
+        curve = stats['stages']['roughness_curve']
+        self.assertLessEqual(curve['own_seconds'], curve['seconds'])
+        self.assertEqual(json.loads(profile.to_json()), stats)
+
+        roughness_complex(self.ref_chord)
+        self.assertEqual(profile.to_dict()['stages']['roughness_complex']['calls'], 2 * 25 + 1)
+
+    # test: the profile reads as pstats, directly and from a dump file
+    def test_pstats_export(self):
+        with profile_block() as profile:
+            roughness_curve(self.ref_chord, self.test_chord, transpose_domain=self.domain, options=self.options)
+
+        stats = pstats.Stats(profile)
+        self.assertIn(('chordkit', 0, 'roughness_sweep'), stats.stats)
+        callers = stats.stats[('chordkit', 0, 'pair_sweep')][4]
+        self.assertIn(('chordkit', 0, 'roughness_sweep'), callers)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'profile.prof')
+            profile.dump_stats(path)
+            self.assertIn(('chordkit', 0, 'roughness_curve'), pstats.Stats(path).stats)
+
+    # test: recursive stages count once in their cumulative time
+    def test_recursive_stage(self):
+        @timed('countdown')
+        def countdown(n):
+            return 0 if n == 0 else countdown(n - 1)
+
+        with profile_block() as profile:
+            countdown(3)
+
+        (calls, own, cumulative) = profile.stages['countdown']
+        self.assertEqual(calls, 4)
+        self.assertAlmostEqual(own, cumulative, delta=1e-3)
+
+if __name__ == '__main__':
+    unittest.main()
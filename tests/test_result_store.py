@@ -0,0 +1,73 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from chord_utils import ChordSpectrum, Timbre, TransposeDomain
+from chord_plots import roughness_curve, overlap_curve
+from chord_scoring import score_chords
+from pair_cache import PairCache
+from result_store import ResultStore
+
+class TestResultStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = ResultStore(self.directory.name)
+        self.timbre = Timbre(range(1, 7), [1/n for n in range(1, 7)])
+        self.chord = ChordSpectrum([0, 4, 7], 'ST_DIFF', timbre=self.timbre, fund_hz=220.0)
+        self.domain = TransposeDomain(-1, 1, 11, 'ST_DIFF')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    # test: keys change with any input and ignore options that do not matter
+    def test_keys(self):
+        options = {'amp_type': 'MIN'}
+        key = self.store.key('curve', self.chord, self.domain, 'SETHARES', options)
+        self.assertEqual(key, self.store.key('curve', ChordSpectrum([0, 4, 7], 'ST_DIFF', timbre=self.timbre, fund_hz=220.0),
+            TransposeDomain(-1, 1, 11, 'ST_DIFF'), 'SETHARES', {'amp_type': 'MIN', 'cache': PairCache()}))
+        self.assertNotEqual(key, self.store.key('curve', self.chord, self.domain, 'SETHARES', {'amp_type': 'PRODUCT'}))
+        self.assertNotEqual(key, self.store.key('curve', self.chord, self.domain, 'PARNCUTT', options))
+        self.assertNotEqual(key, self.store.key('curve', ChordSpectrum([0, 4, 7], 'ST_DIFF', timbre=self.timbre, fund_hz=221.0),
+            self.domain, 'SETHARES', options))
+
+    # test: a stored curve is loaded memory-mapped and not recomputed
+    def test_curve_round_trip(self):
+        computed = roughness_curve(self.chord, self.chord, transpose_domain=self.domain, store=self.store)
+        cache = PairCache()
+        loaded = roughness_curve(self.chord, self.chord, transpose_domain=self.domain, store=self.store,
+            options={'crossterms_only': False, 'amp_type': 'MIN', 'cutoff': False, 'original': False,
+                'show_partials': False, 'cache': cache})
+        self.assertIsInstance(loaded, np.memmap)
+        np.testing.assert_array_equal(loaded, computed)
+        self.assertEqual(cache.stats()['misses'], 0)
+
+        normalized = overlap_curve(self.chord, self.chord, transpose_domain=self.domain, function_type='SETHARES_BELL',
+            normalize=True, store=self.store)
+        reloaded = overlap_curve(self.chord, self.chord, transpose_domain=self.domain, function_type='SETHARES_BELL',
+            normalize=True, store=self.store)
+        np.testing.assert_array_equal(reloaded, normalized)
+        self.assertEqual(np.max(reloaded), 1.0)
+
+    # test: writing into a loaded result does not change the stored one
+    def test_copy_on_write(self):
+        self.store.save(self.store.key('values', 1), np.arange(4.0))
+        loaded = self.store.load(self.store.key('values', 1))
+        loaded[:] = 0
+        np.testing.assert_array_equal(self.store.load(self.store.key('values', 1)), np.arange(4.0))
+
+    # test: batch scores are stored column by column, through temporary
+    # files, and reloaded
+    def test_scores_round_trip(self):
+        chords = [ChordSpectrum(struct, 'ST_DIFF', timbre=self.timbre) for struct in [[0, 4, 7], [0, 3, 7], [0, 6]]]
+        computed = score_chords(chords, batch_size=2, store=self.store)
+        columns = self.store.load_columns(self.store.key('scores', [(chord.hz, chord.amp) for chord in chords[:2]],
+            [('ROUGHNESS', 'SETHARES'), ('OVERLAP', 'SETHARES_BELL'), ('ROUGHNESS', 'PARNCUTT'), ('OVERLAP', 'PARNCUTT_BELL')],
+            {'amp_type': 'MIN', 'cutoff': False, 'original': False, 'cbw_window': None}))
+        self.assertEqual(list(columns), list(computed.columns))
+        self.assertFalse([name for (_, _, names) in os.walk(self.directory.name) for name in names if '.tmp' in name])
+        loaded = score_chords(chords, batch_size=2, store=self.store)
+        np.testing.assert_array_equal(loaded.to_numpy(), computed.to_numpy())
+        self.assertEqual(list(loaded.index), [0, 1, 2])
+
+if __name__ == '__main__':
+    unittest.main()
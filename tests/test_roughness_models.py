@@ -0,0 +1,66 @@
+import unittest
+import numpy as np
+from chord_utils import ChordSpectrum, Timbre
+from roughness_models import roughness_complex
+
+class TestRoughnessBackends(unittest.TestCase):
+    def setUp(self):
+        timbre = Timbre(range(1, 12), [1/n for n in range(1, 12)])
+        self.chord = ChordSpectrum([0, 3.5, 7, 10.2, 14], 'ST_DIFF', timbre=timbre, fund_hz=196.0)
+
+    # test: NumPy backend agrees with the scalar loop for every pairwise model
+    def test_numpy_matches_python(self):
+        for function_type in ['SETHARES', 'CBW', 'PARNCUTT']:
+            for amp_type in ['MIN', 'PRODUCT']:
+                options = {'amp_type': amp_type, 'cutoff': False, 'original': False, 'show_partials': False}
+                expected = roughness_complex(self.chord, function_type, backend='PYTHON', options=options)
+                actual = roughness_complex(self.chord, function_type, backend='NUMPY', options=options)
+                np.testing.assert_allclose(actual, expected, rtol=1e-12, err_msg=f'{function_type}, {amp_type}')
+
+    # test: NumPy backend reports the same rough partials as the scalar loop
+    def test_numpy_show_partials(self):
+        options = {'amp_type': 'MIN', 'cutoff': False, 'original': False, 'show_partials': True}
+        expected = roughness_complex(self.chord, 'SETHARES', 0.05, backend='PYTHON', options=options)
+        actual = roughness_complex(self.chord, 'SETHARES', 0.05, backend='NUMPY', options=options)
+        np.testing.assert_allclose(actual['roughness'], expected['roughness'], rtol=1e-12)
+        self.assertEqual(actual['rough_partials'], expected['rough_partials'])
+
+    # test: Helmholtz model agrees across backends
+    def test_numpy_helmholtz(self):
+        tone = ChordSpectrum([0], 'ST_DIFF', timbre=Timbre(range(1, 11)), fund_hz=264.0)
+        test_tone = ChordSpectrum([0.7], 'ST_DIFF', timbre=Timbre(range(1, 11)), fund_hz=264.0)
+        options = {'ref': tone.partials['hz'], 'show_partials': False}
+        expected = roughness_complex(test_tone, 'HELMHOLTZ', backend='PYTHON', options=options)
+        actual = roughness_complex(test_tone, 'HELMHOLTZ', backend='NUMPY', options=options)
+        np.testing.assert_allclose(actual, expected, rtol=1e-12)
+
+    # test: unknown backends are rejected
+    def test_invalid_backend(self):
+        with self.assertRaises(ValueError):
+            roughness_complex(self.chord, 'SETHARES', backend='FORTRAN')
+
+class TestRoughnessPruning(unittest.TestCase):
+    def setUp(self):
+        timbre = Timbre(range(1, 21), [1/n for n in range(1, 21)])
+        self.chord = ChordSpectrum(list(np.arange(0, 36, 2.7)), 'ST_DIFF', timbre=timbre, fund_hz=65.0)
+
+    # test: pruned roughness is within the reported error bound of the full sum
+    def test_pruning_within_error_bound(self):
+        for function_type in ['SETHARES', 'CBW', 'PARNCUTT']:
+            for cbw_window in [1, 2, 4]:
+                full = roughness_complex(self.chord, function_type)
+                pruned = roughness_complex(self.chord, function_type,
+                    options={'amp_type': 'MIN', 'cbw_window': cbw_window, 'show_error': True})
+                self.assertGreater(pruned['pairs_pruned'], 0)
+                self.assertLessEqual(abs(full - pruned['roughness']), pruned['error_bound'] + 1e-12,
+                    f'{function_type}, {cbw_window}')
+
+    # test: a wide enough window is exact for the models with a hard cutoff
+    def test_pruning_exact_past_cutoff(self):
+        for function_type in ['CBW', 'PARNCUTT']:
+            pruned = roughness_complex(self.chord, function_type,
+                options={'amp_type': 'MIN', 'cbw_window': 2, 'show_error': True})
+            self.assertEqual(pruned['error_bound'], 0.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+import numpy as np
+from chord_utils import ChordSpectrum, Timbre
+from chord_scoring import chord_spectra
+from spectrum_cache import SpectrumCache
+
+class TestSpectrumCache(unittest.TestCase):
+    # test: equal requests (including equal but distinct timbres) share one
+    # spectrum, equal to a freshly built one
+    def test_shared_spectra(self):
+        cache = SpectrumCache()
+        chord = cache.get([0, 4, 7], 'ST_DIFF', timbre=Timbre(range(1, 8), [1/n for n in range(1, 8)]), fund_hz=196.0)
+        again = cache.get([0, 4, 7], 'st_diff', timbre=Timbre(range(1, 8), [1/n for n in range(1, 8)]), fund_hz=196.0)
+        fresh = ChordSpectrum([0, 4, 7], 'ST_DIFF', timbre=Timbre(range(1, 8), [1/n for n in range(1, 8)]), fund_hz=196.0)
+
+        self.assertIs(chord, again)
+        np.testing.assert_array_equal(chord.hz, fresh.hz)
+        np.testing.assert_array_equal(chord.amp, fresh.amp)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+        cache.get([0, 4, 7], 'ST_DIFF', fund_hz=196.0)
+        cache.get([0, 4, 7], 'ST_DIFF', fund_hz=220.0)
+        self.assertEqual(cache.stats()['entries'], 3)
+
+    # test: cached spectra cannot be modified, but copies can
+    def test_frozen(self):
+        chord = SpectrumCache().get([0, 4, 7])
+        with self.assertRaises(ValueError):
+            chord.transpose(1, 'ST_DIFF')
+        with self.assertRaises(ValueError):
+            chord.hz[0] = 1.0
+
+        copy = chord.copy()
+        copy.transpose(1, 'ST_DIFF')
+        self.assertFalse(np.array_equal(copy.hz, chord.hz))
+        np.testing.assert_array_equal(chord.hz, ChordSpectrum([0, 4, 7]).hz)
+
+    # test: least recently used spectra are evicted first
+    def test_eviction(self):
+        cache = SpectrumCache(max_entries=2)
+        first = cache.get([0, 4, 7])
+        cache.get([0, 3, 7])
+        cache.get([0, 4, 7])
+        cache.get([0, 5, 7])
+
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertIs(cache.get([0, 4, 7]), first)
+        self.assertEqual(cache.stats()['misses'], 3)
+
+    def test_chord_spectra(self):
+        cache = SpectrumCache()
+        spectra = list(chord_spectra([[0, 4, 7], [0, 3, 7], [0, 4, 7]], cache=cache))
+        self.assertIs(spectra[0], spectra[2])
+        self.assertEqual(cache.stats()['hits'], 1)
+
+if __name__ == '__main__':
+    unittest.main()